@@ -0,0 +1,13 @@
+"""Reproducible request benchmarks against a large seeded SQLite database.
+
+    python -m bench                                  # 50k users, 2M approvals
+    python -m bench --users 5000 --approvals 100000 --requests 100
+    python -m bench --json results.json --reseed
+
+The database is seeded once per (users, approvals, seed) with bulk inserts
+(bench/seed.py) and reused by later runs. Exchange rates and SMTP are local
+stubs (bench/stubs.py), so nothing leaves the machine. Each scenario in
+bench/run.py drives one view through the Flask test client. It reports
+p50/p95/p99 latency and SQL statements per request, and the run fails if a
+view goes over its declared query budget.
+"""
@@ -0,0 +1,54 @@
+import argparse
+import os
+import sys
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m bench', description='Seeded request benchmarks with SQL query budgets')
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--approvals', type=int, default=2000000)
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the synthetic data')
+    parser.add_argument('--db', default=None, help='database file (default: instance/bench-<users>-<approvals>-<seed>.db)')
+    parser.add_argument('--reseed', action='store_true', help='rebuild the database even if it is already seeded')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--only', action='append', help='run just this scenario; repeatable')
+    parser.add_argument('--latency-factor', type=float, default=0, help='check p95 latency against the budgets scaled by this (default 0: not checked)')
+    parser.add_argument('--json', dest='json_path', default=None, help='also write results to this file')
+    args = parser.parse_args()
+
+    path = args.db or os.path.join('instance', f'bench-{args.users}-{args.approvals}-{args.seed}.db')
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if args.reseed and os.path.exists(path):
+        os.remove(path)
+
+    from bench import run, seed
+    app = run.load_app(path)
+    from db import migrations
+    with app.app_context():
+        migrations.upgrade()
+        if not seed.is_seeded():
+            if _has_rows():
+                print(f'{path} holds an unfinished seed; rerun with --reseed')
+                return 2
+            print(f'seeding {path}: {args.users} users, {args.approvals} approvals (seed {args.seed})')
+            seed.seed(args.users, args.approvals, args.seed)
+
+    results = run.run(app, requests=args.requests, warmup=args.warmup, only=args.only, latency_factor=args.latency_factor)
+    print(run.report(results))
+    if args.json_path:
+        run.write_json(results, args.json_path, {'users': args.users, 'approvals': args.approvals, 'seed': args.seed, 'requests': args.requests})
+    failed = [r['name'] for r in results if r['over_budget'] or r['too_slow'] or r['errors']]
+    if failed:
+        print(f"FAILED: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+def _has_rows() -> bool:
+    from db.users import User
+    return User.query.first() is not None
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""Benchmark scenarios, query budgets and reporting."""
+from collections import namedtuple
+import contextlib
+import io
+import json
+import os
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# name, role whose session is used (None: anonymous), method, path,
+# expected status, max SQL statements per request, max p95 latency in ms
+Scenario = namedtuple('Scenario', 'name role method path status budget p95_ms')
+
+# Query budgets are today's statement count plus two. That leaves room for
+# a lookup or two more, but any per-row query (N+1) over a page of 100-200
+# rows blows straight through them. Latency budgets are for the default
+# dataset (50k users, 2M approvals) on one core of a current laptop, with
+# roughly 3x headroom. They are only checked when asked for with
+# --latency-factor (1 on such a laptop, more on slower hardware).
+SCENARIOS = (
+    # admin and user lookups, the session-token update and the session rows = 8;
+    # the time is dominated by the password hash
+    Scenario('login', None, 'POST', '/login', 302, 10, 400),
+    # counter, one page of the inbox, usernames, company currency = 4
+    Scenario('manager_dashboard', 'Manager', 'GET', '/manager/dashboard', 200, 6, 100),
+    # counter, one page of pending approvals, usernames = 3
+    Scenario('manager_api_list_approvals', 'Manager', 'GET', '/manager/api/approvals', 200, 5, 100),
+    # counter, one page of the employee's own approvals = 2
+    Scenario('employee_dashboard', 'Employee', 'GET', '/employee/dashboard', 200, 4, 50),
+    # users, manager names, admins = 3; the page renders every user
+    Scenario('admin_users', 'Admin', 'GET', '/admin/users', 200, 5, 500),
+    # counter, one page of approvals = 2
+    Scenario('admin_expenses', 'Admin', 'GET', '/admin/expenses', 200, 4, 100),
+)
+
+
+def load_app(db_path: str):
+    """Import the app against `db_path` with background threads and real I/O disabled."""
+    os.environ['SQL_URL'] = f'sqlite:///{os.path.abspath(db_path)}'
+    os.environ['EXCHANGE_RATES_BACKGROUND'] = '0'
+    os.environ.setdefault('SLOW_QUERY_MS', '0')
+    import main
+    from bench import stubs
+    stubs.install()
+    return main.app
+
+
+def _percentile(sorted_values: list, p: float) -> float:
+    # nearest-rank
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.n = 0
+
+    def __call__(self, *args):
+        self.n += 1
+
+
+def _actors():
+    """Deterministic accounts: the manager with the most employee reports and two of those employees.
+
+    The second employee only signs in through the login scenario, so it never
+    rotates the session the employee scenarios run under.
+    """
+    from db import db
+    from db.users import User
+    from bench.seed import ADMIN_EMAIL
+    manager_id = db.session.query(User.manager_id).filter(User.role == 'Employee', User.manager_id.isnot(None)).group_by(
+        User.manager_id).order_by(db.func.count().desc(), User.manager_id.asc()).limit(1).scalar()
+    manager = db.session.get(User, manager_id)
+    employees = User.query.filter_by(manager_id=manager_id, role='Employee').order_by(User.id.asc()).limit(2).all()
+    db.session.remove()
+    return {'Admin': ADMIN_EMAIL, 'Manager': manager.email, 'Employee': employees[0].email, 'login': employees[-1].email}
+
+
+def run(app, requests: int = 200, warmup: int = 10, only: list = None, latency_factor: float = 0) -> list:
+    """Drive every scenario `warmup + requests` times. Returns one result dict per scenario.
+
+    `latency_factor` scales the p95 budgets; the default 0 skips the latency check.
+    """
+    from bench.seed import PASSWORD
+    with app.app_context():
+        accounts = _actors()
+    clients = {}
+    for role in ('Admin', 'Manager', 'Employee'):
+        c = app.test_client()
+        with contextlib.redirect_stdout(io.StringIO()):
+            res = c.post('/login', data={'email': accounts[role], 'password': PASSWORD})
+        if res.status_code != 302:
+            raise RuntimeError(f'could not sign in as {accounts[role]} ({res.status_code})')
+        clients[role] = c
+
+    counter = _QueryCounter()
+    event.listen(Engine, 'after_cursor_execute', counter)
+    results = []
+    try:
+        for s in SCENARIOS:
+            if only and s.name not in only:
+                continue
+            client = clients[s.role] if s.role else app.test_client()
+            data = {'email': accounts['login'], 'password': PASSWORD} if s.name == 'login' else None
+            latencies, queries, errors = [], [], 0
+            for i in range(warmup + requests):
+                counter.n = 0
+                # views print debug lines (e.g. login); keep the report readable
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    res = client.open(s.path, method=s.method, data=data)
+                    res.get_data()
+                    elapsed = time.perf_counter() - start
+                if i < warmup:
+                    continue
+                if res.status_code != s.status:
+                    errors += 1
+                latencies.append(elapsed)
+                queries.append(counter.n)
+            latencies.sort()
+            p95_ms = round(_percentile(latencies, 95) * 1000, 2)
+            p95_budget = round(s.p95_ms * latency_factor, 1) if latency_factor else None
+            results.append({
+                'name': s.name,
+                'path': s.path,
+                'requests': requests,
+                'errors': errors,
+                'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+                'p95_ms': p95_ms,
+                'p99_ms': round(_percentile(latencies, 99) * 1000, 2),
+                'queries_avg': round(sum(queries) / len(queries), 2) if queries else 0,
+                'queries_max': max(queries) if queries else 0,
+                'budget': s.budget,
+                'over_budget': bool(queries) and max(queries) > s.budget,
+                'p95_budget_ms': p95_budget,
+                'too_slow': p95_budget is not None and p95_ms > p95_budget,
+            })
+    finally:
+        event.remove(Engine, 'after_cursor_execute', counter)
+    return results
+
+
+def report(results: list) -> str:
+    lines = [f"{'scenario':<28} {'p50 ms':>9} {'p95 ms':>9} {'budget':>8} {'p99 ms':>9} {'queries':>8} {'budget':>7}  status"]
+    for r in results:
+        problems = [label for key, label in (('over_budget', 'OVER BUDGET'), ('too_slow', 'TOO SLOW'), ('errors', 'ERRORS')) if r[key]]
+        p95_budget = '-' if r['p95_budget_ms'] is None else r['p95_budget_ms']
+        lines.append(
+            f"{r['name']:<28} {r['p50_ms']:>9} {r['p95_ms']:>9} {p95_budget:>8} {r['p99_ms']:>9} "
+            f"{r['queries_max']:>8} {r['budget']:>7}  {', '.join(problems) or 'ok'}"
+        )
+    return '\n'.join(lines)
+
+
+def write_json(results: list, path: str, meta: dict) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2)
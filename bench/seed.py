@@ -0,0 +1,164 @@
+"""Seed a benchmark database with synthetic users and approvals.
+
+Everything is derived from a seeded `random.Random`, so the same arguments
+always produce the same data. Rows go in through Core bulk inserts. The
+approval indexes are dropped during the load and rebuilt afterwards. The
+derived tables (org closure, user search, spend totals) are then built with
+the same code the app uses, followed by ANALYZE.
+"""
+from datetime import datetime, timedelta
+import random
+import time
+
+from db import db
+
+SEEDED_COUNTER = 'bench_seeded'
+ADMIN_EMAIL = 'admin@bench.example'
+PASSWORD = 'bench-password'
+BATCH = 10000
+
+FIRST = ('ava', 'liam', 'noah', 'mia', 'ravi', 'priya', 'chen', 'sofia', 'omar', 'lena', 'yuki', 'ivan', 'zara', 'tom', 'nora', 'arjun')
+LAST = ('smith', 'patel', 'garcia', 'kim', 'nguyen', 'mueller', 'rossi', 'silva', 'khan', 'sato', 'cohen', 'novak', 'reyes', 'shah')
+CATEGORIES = ('Travel', 'Meals', 'Lodging', 'Software', 'Office', 'Training')
+CURRENCIES = ('USD', 'USD', 'USD', 'EUR', 'GBP', 'INR', 'JPY', 'CAD')
+STATUSES = ('Approved',) * 13 + ('Rejected',) * 4 + ('Pending',) * 3
+
+
+def is_seeded() -> bool:
+    from db.counters import get_counter
+    try:
+        return get_counter(SEEDED_COUNTER) > 0
+    except Exception:
+        return False
+
+
+def user_email(uid: int) -> str:
+    return f'user{uid}@bench.example'
+
+
+def _org(rng: random.Random, n_users: int) -> list:
+    """manager_id for users 1..n (index 0 unused): a forest built breadth-first.
+
+    About one root per 5000 users; every manager gets 3-12 direct reports,
+    so 50k users come out 5-6 levels deep.
+    """
+    roots = max(1, n_users // 5000)
+    managers = [None] * (n_users + 1)
+    queue = list(range(1, roots + 1))
+    nxt = roots + 1
+    head = 0
+    while nxt <= n_users:
+        boss = queue[head]
+        head += 1
+        for _ in range(rng.randint(3, 12)):
+            if nxt > n_users:
+                break
+            managers[nxt] = boss
+            queue.append(nxt)
+            nxt += 1
+    return managers
+
+
+def _seed_users(conn, rng: random.Random, n_users: int) -> list:
+    from db.users import User
+    from utils.passwords import hash_password
+    managers = _org(rng, n_users)
+    has_reports = set(m for m in managers if m is not None)
+    # one hash shared by every seeded user; hashing 50k passwords would dominate the seed
+    pw = hash_password(PASSWORD)
+    rows = []
+    for uid in range(1, n_users + 1):
+        rows.append({
+            'id': uid,
+            'email': user_email(uid),
+            'username': f'{rng.choice(FIRST)}.{rng.choice(LAST)}{uid}',
+            'password': pw,
+            'role': 'Manager' if uid in has_reports else 'Employee',
+            'manager_id': managers[uid],
+        })
+        if len(rows) >= BATCH:
+            conn.execute(User.__table__.insert(), rows)
+            rows = []
+    if rows:
+        conn.execute(User.__table__.insert(), rows)
+    return managers
+
+
+def _seed_approvals(conn, rng: random.Random, n_approvals: int, managers: list) -> None:
+    from bench.stubs import RATES
+    from db.approvals import Approval
+    t = Approval.__table__
+    n_users = len(managers) - 1
+    now = datetime.utcnow()
+    span = 730 * 24 * 3600
+    # company currency is INR (the seeded admin is in India)
+    inr = RATES['INR']
+    rows = []
+    for _ in range(n_approvals):
+        uid = rng.randint(1, n_users)
+        manager = managers[uid]
+        status = rng.choice(STATUSES) if manager else 'Pending'
+        currency = rng.choice(CURRENCIES)
+        amount = round(rng.uniform(5, 2000), 2)
+        created = now - timedelta(seconds=rng.randint(0, span))
+        decided = status != 'Pending'
+        rows.append({
+            'requestor_id': uid,
+            'requestor_email': user_email(uid),
+            'description': f'{rng.choice(CATEGORIES).lower()} expense',
+            'category': rng.choice(CATEGORIES),
+            'amount': amount,
+            'currency': currency,
+            'status': status,
+            'created_at': created,
+            'updated_at': created + timedelta(hours=rng.randint(1, 72)) if decided else created,
+            'approver_id': manager if decided else None,
+            'approver_email': user_email(manager) if decided else None,
+            'approver_comments': None,
+            'receipt_filename': None,
+            'company_amount': round(amount * inr / RATES[currency], 2),
+            'assigned_approver_id': manager,
+            'version': 1,
+        })
+        if len(rows) >= BATCH:
+            conn.execute(t.insert(), rows)
+            rows = []
+    if rows:
+        conn.execute(t.insert(), rows)
+
+
+def seed(n_users: int, n_approvals: int, seed: int = 1, log=print) -> None:
+    """Load the data into the (freshly migrated, empty) database bound to `db`."""
+    from db import admins, org, spend, user_search
+    from db.approvals import Approval, CHANGES_COUNTER
+    from db.counters import bump_counter
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    admins.create_admin('Bench Admin', ADMIN_EMAIL, PASSWORD, 'India')
+
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql('PRAGMA synchronous=OFF')
+        managers = _seed_users(conn, rng, n_users)
+        org.backfill(conn)
+        if user_search.backend(conn) == 'grams':
+            user_search.backfill_grams(conn)
+    log(f'users: {n_users} ({time.perf_counter() - started:.1f}s)')
+
+    indexes = list(Approval.__table__.indexes)
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql('PRAGMA synchronous=OFF')
+        for idx in indexes:
+            idx.drop(bind=conn, checkfirst=True)
+        _seed_approvals(conn, rng, n_approvals, managers)
+        for idx in indexes:
+            idx.create(bind=conn)
+    log(f'approvals: {n_approvals} ({time.perf_counter() - started:.1f}s)')
+
+    spend.rebuild(batch_size=BATCH)
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql('ANALYZE')
+    bump_counter(CHANGES_COUNTER)
+    bump_counter(SEEDED_COUNTER)
+    db.session.commit()
+    log(f'seeded in {time.perf_counter() - started:.1f}s')
@@ -1,5 +1,5 @@
 from . import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from utils.passwords import hash_password, verify_password, needs_rehash
 from utils.tokens import generate_random_tokens
 
 class Admin(db.Model):
@@ -20,11 +20,18 @@ class Admin(db.Model):
     # -----------------------
     def set_password(self, password: str):
         """Hash and set password"""
-        self.password = generate_password_hash(password)
+        self.password = hash_password(password)
 
     def check_password(self, password: str) -> bool:
-        """Verify password"""
-        return check_password_hash(self.password, password)
+        """Verify password, upgrading the stored hash if the hash method changed.
+
+        The upgrade is committed by the caller (login commits the new session).
+        """
+        if not verify_password(self.password, password):
+            return False
+        if needs_rehash(self.password):
+            self.set_password(password)
+        return True
 
     def generate_session_token(self):
         """Generate a new session token"""
@@ -62,6 +69,43 @@ def update_admin_session_token(email: str) -> str:
     admin = get_admin_by_email(email)
     if not admin:
         return None
+    from db import sessions
     token = admin.generate_session_token()
+    sessions.start_session(sessions.PRINCIPAL_ADMIN, admin.id, token)
     db.session.commit()
     return token
+
+
+# country -> currency code, shared by every request in this process
+_company_currency_cache = {}
+
+
+def get_company_currency(default: str = 'USD') -> str:
+    """Return the company currency, derived from the first admin's country.
+
+    Resolved at most once per request (memoized on `g`) and cached per
+    company country for the life of the process, so views that convert many
+    rows don't repeat the admin lookup or the country -> currency scan.
+    """
+    from flask import g, has_app_context
+    if has_app_context() and 'company_currency' in g:
+        return g.company_currency
+
+    currency = default
+    try:
+        row = db.session.query(Admin.country).order_by(Admin.id.asc()).first()
+        country = row[0] if row else None
+        if country:
+            code = _company_currency_cache.get(country)
+            if code is None:
+                from utils.currency import get_currency_for_country
+                code = get_currency_for_country(country)
+                if code:
+                    _company_currency_cache[country] = code
+            currency = code or default
+    except Exception:
+        pass
+
+    if has_app_context():
+        g.company_currency = currency
+    return currency
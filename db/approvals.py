@@ -1,11 +1,43 @@
 from . import db
 from datetime import datetime
+from sqlalchemy import and_, or_
+import base64
+import json
+
+# Bumped by every write that changes what approval listings show; the
+# conditional-GET views (handlers/caching.py) derive their ETags from it.
+# Views that only show one person's approvals use the per-requestor or
+# per-assignee counter instead, so other people's writes don't invalidate them.
+CHANGES_COUNTER = 'approvals'
+
+
+def requestor_counter(user_id: int) -> str:
+    return f'{CHANGES_COUNTER}:requestor:{user_id}'
+
+
+def assignee_counter(user_id: int) -> str:
+    return f'{CHANGES_COUNTER}:assignee:{user_id}'
+
+
+def bump_changes(rows=(), requestor_ids=(), assignee_ids=(), conn=None) -> None:
+    """Bump the global change counter and the scoped counters of everyone `rows` touch."""
+    from db.counters import bump_counters
+    names = {CHANGES_COUNTER}
+    names.update(requestor_counter(r.requestor_id) for r in rows if r.requestor_id)
+    names.update(assignee_counter(r.assigned_approver_id) for r in rows if r.assigned_approver_id)
+    names.update(requestor_counter(i) for i in requestor_ids if i)
+    names.update(assignee_counter(i) for i in assignee_ids if i)
+    bump_counters(names, conn=conn)
+
 
 # Simple Approval model — adapt as needed for your real app
 class Approval(db.Model):
     __tablename__ = 'approvals'
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # requestor_id / approver_id are the keys; the emails are kept for display
+    # and for approvals whose user no longer exists
+    requestor_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
     requestor_email = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=True)
     category = db.Column(db.String(100), nullable=True)
@@ -15,13 +47,26 @@ class Approval(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    approver_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
     approver_email = db.Column(db.String(100), nullable=True)
     approver_comments = db.Column(db.Text, nullable=True)
     receipt_filename = db.Column(db.String(200), nullable=True)
+    # routing decided by the rule engine when the approval is created
+    rule_id = db.Column(db.Integer, db.ForeignKey('approval_rules.id'), nullable=True)
+    required_approvers = db.Column(db.Integer, nullable=True)
+    # amount in company currency at creation time; feeds db/spend.py totals
+    company_amount = db.Column(db.Float, nullable=True)
+    # manager responsible for deciding, resolved from users.manager_id at creation
+    assigned_approver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    # optimistic-concurrency counter: every decision bumps it and checks it
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
 
     def to_dict(self):
         return {
             'id': self.id,
+            'requestor_id': self.requestor_id,
             'requestor_email': self.requestor_email,
             'description': self.description,
             'category': self.category,
@@ -30,12 +75,29 @@ class Approval(db.Model):
             'status': self.status,
             'created_at': None if not self.created_at else self.created_at.isoformat(),
             'updated_at': None if not self.updated_at else self.updated_at.isoformat(),
+            'approver_id': self.approver_id,
             'approver_email': self.approver_email,
             'approver_comments': self.approver_comments,
             'receipt_filename': self.receipt_filename,
+            'rule_id': self.rule_id,
+            'required_approvers': self.required_approvers,
+            'assigned_approver_id': self.assigned_approver_id,
+            'company_amount': self.company_amount,
+            'version': self.version,
         }
 
 
+# Composite indexes matching the list_approvals* filter + ORDER BY (created_at, id) DESC
+# keyset pagination patterns
+db.Index('ix_approvals_created_id', Approval.created_at.desc(), Approval.id.desc())
+db.Index('ix_approvals_status_created_id', Approval.status, Approval.created_at.desc(), Approval.id.desc())
+db.Index('ix_approvals_requestor_id_created_id', Approval.requestor_id, Approval.created_at.desc(), Approval.id.desc())
+db.Index('ix_approvals_approver_id_created_id', Approval.approver_id, Approval.created_at.desc(), Approval.id.desc())
+# per-approver inbox: "my queue" and "my pending queue" are single index range scans
+db.Index('ix_approvals_assignee_created_id', Approval.assigned_approver_id, Approval.created_at.desc(), Approval.id.desc())
+db.Index('ix_approvals_assignee_status_created_id', Approval.assigned_approver_id, Approval.status, Approval.created_at.desc(), Approval.id.desc())
+
+
 class ApprovalRule(db.Model):
     __tablename__ = 'approval_rules'
 
@@ -61,69 +123,433 @@ class ApprovalRule(db.Model):
 # CRUD functions
 # -----------------------
 
+def build_approvals(items: list) -> list:
+    """Prepare (unsaved) Approval rows from a list of field dicts.
+
+    Company-currency conversion is done once per distinct currency, the
+    requestors' managers are resolved with one IN query and rules come from
+    the compiled rule engine, so the cost doesn't grow with per-row queries.
+    """
+    from db.admins import get_company_currency
+    from db.rule_engine import get_compiled_rules
+    from db.users import User
+    from utils.currency import convert_amounts
+    company_currency = get_company_currency()
+    converted = convert_amounts([(i.get('amount'), i.get('currency') or company_currency) for i in items], company_currency)
+    emails = {i['requestor_email'] for i in items}
+    requestors = {}
+    if emails:
+        requestors = {e: (uid, mid) for e, uid, mid in db.session.query(User.email, User.id, User.manager_id).filter(User.email.in_(emails)).all()}
+    rules = get_compiled_rules()
+    now = datetime.utcnow()
+    out = []
+    for i, company_amount in zip(items, converted):
+        amount = i.get('amount')
+        requestor_id, manager_id = requestors.get(i['requestor_email'], (None, None))
+        a = Approval(
+            requestor_id=requestor_id, requestor_email=i['requestor_email'], description=i.get('description'), category=i.get('category'),
+            amount=amount, currency=i.get('currency'), receipt_filename=i.get('receipt_filename'),
+            assigned_approver_id=manager_id, company_amount=company_amount,
+            status='Pending', created_at=now,
+        )
+        # rule bounds are in company currency. An amount that couldn't be
+        # converted stays unmatched rather than comparing a foreign amount.
+        rule = None
+        if company_amount is not None or amount is None:
+            rule = rules.match(a.category, company_amount)
+        if rule is not None:
+            a.rule_id = rule.id
+            a.required_approvers = rule.required_approvers
+        out.append(a)
+    return out
+
+
+def create_approvals(items: list, commit: bool = True) -> list:
+    """Insert many approvals in one transaction, keeping spend totals in step."""
+    from db import events, spend
+    rows = build_approvals(items)
+    db.session.add_all(rows)
+    spend.record_created(*rows)
+    bump_changes(rows)
+    # ids are needed for the change feed
+    db.session.flush()
+    events.record_created(rows)
+    if commit:
+        db.session.commit()
+    return rows
+
+
 def create_approval(requestor_email: str, description: str = None, category: str = None, amount: float = None, currency: str = None, receipt_filename: str = None) -> Approval:
-    a = Approval(requestor_email=requestor_email, description=description, category=category, amount=amount, currency=currency, receipt_filename=receipt_filename)
-    db.session.add(a)
-    db.session.commit()
-    return a
+    return create_approvals([{
+        'requestor_email': requestor_email, 'description': description, 'category': category,
+        'amount': amount, 'currency': currency, 'receipt_filename': receipt_filename,
+    }])[0]
+
+
+# -----------------------
+# Keyset pagination
+# -----------------------
+
+MAX_PAGE_SIZE = 500
+
+
+class ApprovalPage(list):
+    """A page of approvals (a plain list) plus opaque next/prev cursors.
+
+    Pages are ordered newest first on (created_at, id). Cursors point at the
+    boundary row, so fetching any page is one index range scan of `limit`
+    rows no matter how deep it is.
+    """
+    next_cursor = None
+    prev_cursor = None
+
+
+def encode_cursor(a: Approval, direction: str):
+    if a.created_at is None:
+        return None
+    raw = json.dumps([direction, a.created_at.isoformat(), a.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
 
 
-def list_approvals(status: str = None, limit: int = 200):
+def decode_cursor(cursor: str):
+    """Return (direction, created_at, id). Raises ValueError for a malformed cursor."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, ts, aid = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if direction not in ('n', 'p'):
+            raise ValueError(direction)
+        return direction, datetime.fromisoformat(ts), int(aid)
+    except Exception:
+        raise ValueError('invalid cursor')
+
+
+def _page(q, limit: int, cursor: str = None) -> ApprovalPage:
+    limit = max(1, min(int(limit or 1), MAX_PAGE_SIZE))
+    direction = 'n'
+    if cursor:
+        direction, ts, aid = decode_cursor(cursor)
+        if direction == 'n':
+            q = q.filter(or_(Approval.created_at < ts, and_(Approval.created_at == ts, Approval.id < aid)))
+        else:
+            q = q.filter(or_(Approval.created_at > ts, and_(Approval.created_at == ts, Approval.id > aid)))
+    if direction == 'n':
+        q = q.order_by(Approval.created_at.desc(), Approval.id.desc())
+    else:
+        q = q.order_by(Approval.created_at.asc(), Approval.id.asc())
+    # one extra row tells us whether there is another page in this direction
+    rows = q.limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == 'p':
+        rows.reverse()
+    page = ApprovalPage(rows)
+    if rows:
+        if direction == 'n':
+            page.next_cursor = encode_cursor(rows[-1], 'n') if more else None
+            page.prev_cursor = encode_cursor(rows[0], 'p') if cursor else None
+        else:
+            page.prev_cursor = encode_cursor(rows[0], 'p') if more else None
+            page.next_cursor = encode_cursor(rows[-1], 'n')
+    return page
+
+
+def list_approvals(status: str = None, limit: int = 200, cursor: str = None):
     q = Approval.query
     if status:
         q = q.filter_by(status=status)
-    return q.order_by(Approval.created_at.desc()).limit(limit).all()
+    return _page(q, limit, cursor)
 
 
-def list_approvals_by_requestor(email: str, status: str = None, limit: int = 200):
-    q = Approval.query.filter_by(requestor_email=email)
+def list_approvals_by_requestor(user_id: int, status: str = None, limit: int = 200, cursor: str = None):
+    if user_id is None:
+        return ApprovalPage()
+    q = Approval.query.filter_by(requestor_id=user_id)
     if status:
         q = q.filter_by(status=status)
-    return q.order_by(Approval.created_at.desc()).limit(limit).all()
+    return _page(q, limit, cursor)
 
 
-def list_approvals_by_requestors(emails: list, status: str = None, limit: int = 200):
-    """Return approvals for any of the given requestor emails.
+def list_approvals_by_requestors(user_ids: list, status: str = None, limit: int = 200, cursor: str = None):
+    """Return approvals for any of the given requestors.
 
     Args:
-        emails: list of email strings
+        user_ids: list of requestor user ids
         status: optional status filter
         limit: max rows
+        cursor: opaque cursor from a previous page's next_cursor/prev_cursor
     """
-    if not emails:
-        return []
-    q = Approval.query.filter(Approval.requestor_email.in_(emails))
+    if not user_ids:
+        return ApprovalPage()
+    q = Approval.query.filter(Approval.requestor_id.in_(user_ids))
+    if status:
+        q = q.filter_by(status=status)
+    return _page(q, limit, cursor)
+
+
+def list_approvals_by_approver(user_id: int, status: str = None, limit: int = 200, cursor: str = None):
+    if user_id is None:
+        # filter_by(approver_id=None) would match every undecided approval
+        return ApprovalPage()
+    q = Approval.query.filter_by(approver_id=user_id)
+    if status:
+        q = q.filter_by(status=status)
+    return _page(q, limit, cursor)
+
+
+def list_approvals_by_assignee(approver_id: int, status: str = None, limit: int = 200, cursor: str = None):
+    """Return the inbox of approvals assigned to a manager (by user id)."""
+    q = Approval.query.filter_by(assigned_approver_id=approver_id)
     if status:
         q = q.filter_by(status=status)
-    return q.order_by(Approval.created_at.desc()).limit(limit).all()
+    return _page(q, limit, cursor)
+
 
+def list_approvals_by_org(manager_id: int, status: str = None, limit: int = 200, cursor: str = None):
+    """Return approvals requested by anyone in `manager_id`'s reporting tree.
 
-def list_approvals_by_approver(email: str, status: str = None, limit: int = 200):
-    q = Approval.query.filter_by(approver_email=email)
+    The tree is filtered with a subquery on org_closure rather than a list of
+    ids, so the statement stays the same size however big the org is.
+    """
+    from db import org
+    q = Approval.query.filter(Approval.requestor_id.in_(org.subtree_ids_select(manager_id)))
     if status:
         q = q.filter_by(status=status)
-    return q.order_by(Approval.created_at.desc()).limit(limit).all()
+    return _page(q, limit, cursor)
+
+
+def reassign_pending(requestor_ids: list, approver_id: int) -> int:
+    """Move the requestors' pending approvals to another approver in one UPDATE.
+
+    Decided approvals stay with whoever was assigned when they were decided.
+    Caller commits. Returns the number of rows moved.
+    """
+    if not requestor_ids:
+        return 0
+    pending = and_(Approval.requestor_id.in_(requestor_ids), Approval.status == 'Pending')
+    # the inboxes the approvals leave also change
+    old = [aid for (aid,) in db.session.query(Approval.assigned_approver_id).filter(pending).distinct()]
+    moved = (
+        Approval.query
+        .filter(pending)
+        .update({Approval.assigned_approver_id: approver_id}, synchronize_session=False)
+    )
+    if moved:
+        bump_changes(requestor_ids=requestor_ids, assignee_ids=old + [approver_id])
+    return moved
+
+
+def enrich_with_requestors(items) -> list:
+    """Return approvals as dicts with `requestor_username` filled in.
+
+    Usernames are resolved with a single batched IN lookup, so the number of
+    queries stays constant no matter how many rows are passed in. Requestors
+    without a user record fall back to their email.
+    """
+    from db.users import User
+    ids = {a.requestor_id for a in items if a.requestor_id}
+    names = {}
+    if ids:
+        names = dict(db.session.query(User.id, User.username).filter(User.id.in_(ids)).all())
+    out = []
+    for a in items:
+        d = a.to_dict()
+        d['requestor_username'] = names.get(a.requestor_id) or a.requestor_email
+        out.append(d)
+    return out
 
 
 def get_approval_by_id(aid: int):
     return Approval.query.get(aid)
 
 
-def set_approval_status(aid: int, approver_email: str, status: str, comments: str = None):
+def _user_id_for(email: str):
+    """User id for an approver email, or None (e.g. admins, who aren't users)."""
+    from db.users import User
+    if not email:
+        return None
+    row = db.session.query(User.id).filter_by(email=email).first()
+    return row[0] if row else None
+
+
+def detach_user(conn, user_id: int) -> None:
+    """Clear a deleted user's ids from approvals; their emails stay for display.
+
+    Pending approvals assigned to them are left unassigned.
+    """
+    t = Approval.__table__
+    # requestors whose approvals show this user as approver or assignee
+    affected = conn.execute(db.select(t.c.requestor_id).where(
+        or_(t.c.approver_id == user_id, t.c.assigned_approver_id == user_id)).distinct()).scalars().all()
+    conn.execute(t.update().where(t.c.requestor_id == user_id).values(requestor_id=None))
+    conn.execute(t.update().where(t.c.approver_id == user_id).values(approver_id=None))
+    conn.execute(t.update().where(t.c.assigned_approver_id == user_id).values(assigned_approver_id=None))
+    bump_changes(requestor_ids=affected + [user_id], assignee_ids=[user_id], conn=conn)
+
+
+def backfill_user_ids(engine, batch_size: int = 1000) -> int:
+    """Fill requestor_id / approver_id from the email columns, one id range per transaction.
+
+    Short transactions keep locks brief on a live table, and only rows still
+    missing an id are touched, so an interrupted run can simply be repeated.
+    Returns the number of id ranges processed.
+    """
+    from db.users import User
+    t = Approval.__table__
+    u = User.__table__
+    requestor = db.select(u.c.id).where(u.c.email == t.c.requestor_email).scalar_subquery()
+    approver = db.select(u.c.id).where(u.c.email == t.c.approver_email).scalar_subquery()
+    with engine.connect() as conn:
+        hi = conn.execute(db.select(db.func.max(t.c.id))).scalar() or 0
+    chunks = 0
+    for lo in range(0, hi, batch_size):
+        in_range = (t.c.id > lo, t.c.id <= lo + batch_size)
+        with engine.begin() as conn:
+            conn.execute(t.update().where(*in_range, t.c.requestor_id.is_(None)).values(requestor_id=requestor))
+            conn.execute(t.update().where(*in_range, t.c.approver_id.is_(None), t.c.approver_email.isnot(None)).values(approver_id=approver))
+        chunks += 1
+    return chunks
+
+
+class VersionConflict(ValueError):
+    """The approval changed since the caller read it."""
+
+
+def set_approval_status(aid: int, approver_email: str, status: str, comments: str = None, expected_version: int = None):
+    """Decide one approval. Raises VersionConflict if `expected_version` is stale
+    or another writer commits first."""
+    from sqlalchemy.orm.exc import StaleDataError
+    from db import events, spend
     a = get_approval_by_id(aid)
     if not a:
         return None
+    if expected_version is not None and a.version != expected_version:
+        raise VersionConflict(f'approval {aid} is at version {a.version}')
+    old_status = a.status
     a.status = status
+    a.approver_id = _user_id_for(approver_email)
     a.approver_email = approver_email
     a.approver_comments = comments
-    db.session.commit()
+    spend.record_status_change(a, old_status)
+    bump_changes([a])
+    events.record_decided([a])
+    try:
+        # the UPDATE is guarded by the version we loaded (version_id_col)
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        raise VersionConflict(f'approval {aid} was changed concurrently')
     return a
 
 
+class DecisionResult:
+    """Outcome of decide_approvals: ids applied, in conflict, or missing."""
+
+    def __init__(self):
+        self.applied = []
+        self.conflicts = []
+        self.not_found = []
+
+    def to_dict(self):
+        return {'applied': self.applied, 'conflicts': self.conflicts, 'not_found': self.not_found}
+
+
+def decide_approvals(ids, approver_email: str, status: str, comments: str = None, expected_versions: dict = None) -> DecisionResult:
+    """Approve or reject many approvals with one set-based UPDATE.
+
+    An id is applied only if it is still Pending and, when `expected_versions`
+    ({id: version}) names it, still at that version; everything else is
+    reported as a conflict rather than overwritten.
+    """
+    from types import SimpleNamespace
+    from sqlalchemy import tuple_
+    from db import events, spend
+    ids = list(dict.fromkeys(int(i) for i in ids))
+    expected_versions = {int(k): int(v) for k, v in (expected_versions or {}).items()}
+    result = DecisionResult()
+    if not ids:
+        return result
+    cols = (
+        Approval.id, Approval.status, Approval.version, Approval.requestor_id, Approval.requestor_email,
+        Approval.assigned_approver_id, Approval.category, Approval.created_at, Approval.company_amount,
+    )
+    seen = {}
+    for i in range(0, len(ids), MAX_PAGE_SIZE):
+        # row locks where the backend has them, so the UPDATE below sees what we read
+        rows = db.session.query(*cols).filter(Approval.id.in_(ids[i:i + MAX_PAGE_SIZE])).with_for_update().all()
+        seen.update((r.id, r) for r in rows)
+    targets = []
+    for aid in ids:
+        r = seen.get(aid)
+        if r is None:
+            result.not_found.append(aid)
+        elif r.status != 'Pending' or expected_versions.get(aid, r.version) != r.version:
+            result.conflicts.append(aid)
+        else:
+            targets.append(r)
+
+    now = datetime.utcnow()
+    approver_id = _user_id_for(approver_email)
+    values = {
+        Approval.status: status, Approval.approver_id: approver_id,
+        Approval.approver_email: approver_email, Approval.approver_comments: comments,
+        Approval.updated_at: now, Approval.version: Approval.version + 1,
+    }
+    returning = db.session.get_bind().dialect.update_returning
+    applied = set()
+    for i in range(0, len(targets), MAX_PAGE_SIZE):
+        chunk = targets[i:i + MAX_PAGE_SIZE]
+        stmt = db.update(Approval).where(
+            tuple_(Approval.id, Approval.version).in_([(r.id, r.version) for r in chunk]),
+            Approval.status == 'Pending',
+        ).values(values).execution_options(synchronize_session=False)
+        if returning:
+            applied.update(aid for (aid,) in db.session.execute(stmt.returning(Approval.id)))
+        elif db.session.execute(stmt).rowcount == len(chunk):
+            applied.update(r.id for r in chunk)
+        else:
+            # without RETURNING a partial update can't be attributed; undo it all
+            db.session.rollback()
+            result.conflicts = list(ids)
+            result.not_found = []
+            return result
+    changed = [r for r in targets if r.id in applied]
+    spend.record_status_changes(changed, status)
+    if changed:
+        bump_changes(changed)
+        events.record_decided([
+            SimpleNamespace(id=r.id, status=status, requestor_id=r.requestor_id, assigned_approver_id=r.assigned_approver_id, approver_id=approver_id)
+            for r in changed
+        ])
+    db.session.commit()
+    result.applied = [r.id for r in changed]
+    result.conflicts += [r.id for r in targets if r.id not in applied]
+    return result
+
+
 # Approval rule helpers
 def create_rule(name: str, min_amount: float = None, max_amount: float = None, category: str = None, required_approvers: int = 1):
+    from db.counters import bump_counter
+    from db.rule_engine import RULES_COUNTER
     r = ApprovalRule(name=name, min_amount=min_amount, max_amount=max_amount, category=category, required_approvers=required_approvers)
     db.session.add(r)
+    # invalidates every process's compiled rule cache
+    bump_counter(RULES_COUNTER)
+    db.session.commit()
+    return r
+
+
+def update_rule(rid: int, **fields):
+    """Update an existing rule's fields (name, min_amount, max_amount, category, required_approvers)."""
+    from db.counters import bump_counter
+    from db.rule_engine import RULES_COUNTER
+    r = get_rule_by_id(rid)
+    if not r:
+        return None
+    for k, v in fields.items():
+        if k not in ('name', 'min_amount', 'max_amount', 'category', 'required_approvers'):
+            raise ValueError(f'unknown rule field: {k}')
+        setattr(r, k, v)
+    bump_counter(RULES_COUNTER)
     db.session.commit()
     return r
 
@@ -0,0 +1,80 @@
+from . import db
+from datetime import datetime
+
+
+class Counter(db.Model):
+    """Named monotonically increasing counters (cache versions, change markers)."""
+    __tablename__ = 'counters'
+
+    name = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    # when `value` last moved; used for Last-Modified headers
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+
+def get_counter(name: str) -> int:
+    value = db.session.query(Counter.value).filter(Counter.name == name).scalar()
+    return value or 0
+
+
+def get_counter_state(name: str):
+    """(value, updated_at) for `name`; (0, None) if it has never been bumped."""
+    row = db.session.query(Counter.value, Counter.updated_at).filter(Counter.name == name).first()
+    return (row[0], row[1]) if row else (0, None)
+
+
+def bump_counter(name: str, conn=None) -> None:
+    """Increment `name` inside the caller's transaction; caller commits.
+
+    Pass `conn` to write through a Connection (e.g. from a flush event).
+    """
+    bump_counters([name], conn=conn)
+
+
+def bump_counters(names, conn=None) -> None:
+    """Increment every counter in `names` with one UPDATE, creating missing ones.
+
+    Missing rows are inserted with ON CONFLICT DO NOTHING (or inside a
+    savepoint on other databases) and then updated, so two writers creating
+    the same counter both land their increment instead of one failing on
+    the primary key.
+    """
+    names = sorted(set(names))
+    if not names:
+        return
+    if conn is None:
+        conn = db.session.connection()
+    t = Counter.__table__
+    now = datetime.utcnow()
+
+    def update(which):
+        return t.update().where(t.c.name.in_(which)).values(value=t.c.value + 1, updated_at=now)
+
+    if conn.dialect.update_returning:
+        # common case: every counter exists and this is the only statement
+        bumped = {n for (n,) in conn.execute(update(names).returning(t.c.name))}
+        missing = [n for n in names if n not in bumped]
+        if not missing:
+            return
+    else:
+        missing = names
+    _insert_missing(conn, missing, now)
+    conn.execute(update(missing))
+
+
+def _insert_missing(conn, names, now) -> None:
+    t = Counter.__table__
+    rows = [{'name': n, 'value': 0, 'updated_at': now} for n in names]
+    dialect = conn.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        from importlib import import_module
+        insert = import_module(f'sqlalchemy.dialects.{dialect}').insert
+        conn.execute(insert(t).values(rows).on_conflict_do_nothing(index_elements=['name']))
+        return
+    from sqlalchemy.exc import IntegrityError
+    for row in rows:
+        try:
+            with conn.begin_nested():
+                conn.execute(t.insert().values(**row))
+        except IntegrityError:
+            pass
@@ -0,0 +1,225 @@
+"""Approval change feed (created / decided events) for SSE and long-poll clients.
+
+`record_created` and `record_decided` are called by db/approvals.py inside
+the writing transaction. Events reach subscribers only if that transaction
+commits. Each process keeps an `EventBus`: a bounded, id-ordered buffer that
+subscribers wait on.
+
+EVENTS_BACKEND selects the fan-out:
+  * ``memory`` (default): events are published to the local bus on commit.
+    Ids are process-local, so this only suits a single worker process.
+  * ``db``: events are inserted into `approval_events` in the same
+    transaction. A poller thread in every worker copies new rows into its
+    local bus, so all workers see every event, and resuming from an event id
+    survives restarts. The writing worker wakes its own poller on commit.
+
+Clients resume by sending the last event id they saw. If the feed can no
+longer fill the gap, they get a `reset` and should refetch their listing.
+"""
+from . import db
+from collections import deque
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import itertools
+import json
+import os
+import threading
+import time
+
+BACKEND = os.getenv('EVENTS_BACKEND', 'memory')
+BUFFER_SIZE = int(os.getenv('EVENTS_BUFFER', '1000'))
+POLL_INTERVAL = float(os.getenv('EVENTS_POLL_INTERVAL', '0.5'))
+# an id gap older than this is a rolled-back insert, not an uncommitted one
+GAP_WAIT = float(os.getenv('EVENTS_GAP_WAIT', '2'))
+RETENTION = timedelta(hours=float(os.getenv('EVENTS_RETENTION_HOURS', '24')))
+
+CREATED = 'approval.created'
+DECIDED = 'approval.decided'
+
+
+class ApprovalEvent(db.Model):
+    __tablename__ = 'approval_events'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(30), nullable=False)
+    approval_id = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+# -----------------------
+# In-process bus
+# -----------------------
+
+class EventBus:
+    """Bounded buffer of events ordered by id, with blocking waits."""
+
+    def __init__(self, size: int = BUFFER_SIZE, last_id: int = 0):
+        self._events = deque(maxlen=size)
+        self._cond = threading.Condition()
+        self.last_id = last_id
+
+    def publish(self, events: list) -> None:
+        if not events:
+            return
+        with self._cond:
+            for e in events:
+                if e['id'] > self.last_id:
+                    self._events.append(e)
+                    self.last_id = e['id']
+            self._cond.notify_all()
+
+    def since(self, last_id: int):
+        """(events after `last_id`, complete). `complete` is False if some were evicted."""
+        with self._cond:
+            events = [e for e in self._events if e['id'] > last_id]
+            oldest = self._events[0]['id'] if self._events else self.last_id + 1
+            complete = last_id >= oldest - 1 or last_id >= self.last_id
+            return events, complete
+
+    def wait(self, last_id: int, timeout: float):
+        with self._cond:
+            self._cond.wait_for(lambda: self.last_id > last_id, timeout)
+        return self.since(last_id)
+
+
+# memory mode ids start from the boot time in ms, so they keep increasing
+# across restarts and a stale Last-Event-ID reads as "too old" (reset)
+_memory_start = int(time.time() * 1000)
+_memory_ids = itertools.count(_memory_start)
+bus = EventBus(last_id=_memory_start - 1 if BACKEND != 'db' else 0)
+_memory_lock = threading.Lock()
+
+
+def _to_dict(kind: str, a, at: datetime) -> dict:
+    return {
+        'type': kind,
+        'approval_id': a.id,
+        'status': a.status,
+        'requestor_id': a.requestor_id,
+        'assignee_id': a.assigned_approver_id,
+        'approver_id': a.approver_id,
+        'at': at.isoformat(),
+    }
+
+
+def _record(kind: str, approvals) -> None:
+    now = datetime.utcnow()
+    payloads = [_to_dict(kind, a, now) for a in approvals]
+    if not payloads:
+        return
+    if BACKEND == 'db':
+        db.session.add_all([ApprovalEvent(kind=kind, approval_id=p['approval_id'], payload=json.dumps(p), created_at=now) for p in payloads])
+        db.session.info['approval_events_wake'] = True
+    else:
+        db.session.info.setdefault('approval_events', []).extend(payloads)
+
+
+def record_created(approvals) -> None:
+    """Queue created events (approvals must be flushed so they have ids)."""
+    _record(CREATED, approvals)
+
+
+def record_decided(approvals) -> None:
+    _record(DECIDED, approvals)
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_on_commit(session):
+    pending = session.info.pop('approval_events', None)
+    if pending:
+        with _memory_lock:
+            for p in pending:
+                p['id'] = next(_memory_ids)
+            bus.publish(pending)
+    if session.info.pop('approval_events_wake', False):
+        _poller_wake.set()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('approval_events', None)
+    session.info.pop('approval_events_wake', None)
+
+
+# -----------------------
+# DB fan-out
+# -----------------------
+
+_poller = None
+_poller_lock = threading.Lock()
+_poller_wake = threading.Event()
+
+
+def _row_event(row) -> dict:
+    e = json.loads(row.payload)
+    e['id'] = row.id
+    return e
+
+
+def _poll_loop(app):
+    last_id = None
+    gap_since = None
+    last_prune = 0
+    while True:
+        try:
+            with app.app_context():
+                if last_id is None:
+                    last_id = db.session.query(db.func.max(ApprovalEvent.id)).scalar() or 0
+                    bus.last_id = max(bus.last_id, last_id)
+                rows = ApprovalEvent.query.filter(ApprovalEvent.id > last_id).order_by(ApprovalEvent.id.asc()).limit(500).all()
+                ready = []
+                for row in rows:
+                    if row.id != last_id + 1:
+                        # a lower id may still be uncommitted; give it GAP_WAIT
+                        gap_since = gap_since or time.monotonic()
+                        if time.monotonic() - gap_since < GAP_WAIT:
+                            break
+                    gap_since = None
+                    ready.append(_row_event(row))
+                    last_id = row.id
+                bus.publish(ready)
+                if time.time() - last_prune > 3600:
+                    last_prune = time.time()
+                    ApprovalEvent.query.filter(ApprovalEvent.created_at < datetime.utcnow() - RETENTION).delete(synchronize_session=False)
+                    db.session.commit()
+                db.session.remove()
+        except Exception as e:
+            print(f"Error polling approval events: {e}")
+        _poller_wake.wait(POLL_INTERVAL)
+        _poller_wake.clear()
+
+
+def ensure_poller(app) -> None:
+    """Start this process's DB poller (db backend only)."""
+    global _poller
+    if BACKEND != 'db' or _poller is not None:
+        return
+    with _poller_lock:
+        if _poller is None:
+            _poller = threading.Thread(target=_poll_loop, args=(app,), name='approval-events', daemon=True)
+            _poller.start()
+
+
+def replay(last_id: int, limit: int = 1000):
+    """(events after `last_id`, complete) for a resuming client.
+
+    The in-process buffer is used when it still covers the gap; in db mode
+    older events are read back from `approval_events`.
+    """
+    events, complete = bus.since(last_id)
+    if complete or BACKEND != 'db':
+        return events, complete
+    first = db.session.query(db.func.min(ApprovalEvent.id)).scalar()
+    if first is not None and last_id < first - 1:
+        # the rows the client missed were pruned
+        return [], False
+    rows = ApprovalEvent.query.filter(ApprovalEvent.id > last_id).order_by(ApprovalEvent.id.asc()).limit(limit + 1).all()
+    return [_row_event(r) for r in rows[:limit]], len(rows) <= limit
+
+
+def visible_to(e: dict, user_id, role: str) -> bool:
+    if role == 'Admin':
+        return True
+    return user_id is not None and user_id in (e.get('requestor_id'), e.get('assignee_id'), e.get('approver_id'))
@@ -0,0 +1,73 @@
+from . import db
+from datetime import datetime
+
+
+class IdempotencyKey(db.Model):
+    """Client-supplied key -> the approval it created, scoped per caller."""
+    __tablename__ = 'idempotency_keys'
+
+    scope = db.Column(db.String(100), primary_key=True)
+    key = db.Column(db.String(100), primary_key=True)
+    approval_id = db.Column(db.Integer, db.ForeignKey('approvals.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def lookup_keys(scope: str, keys) -> dict:
+    """Return {key: approval_id} for the keys already used in `scope`."""
+    keys = list(keys)
+    found = {}
+    for i in range(0, len(keys), 500):
+        rows = db.session.query(IdempotencyKey.key, IdempotencyKey.approval_id).filter(
+            IdempotencyKey.scope == scope, IdempotencyKey.key.in_(keys[i:i + 500])
+        ).all()
+        found.update(rows)
+    return found
+
+
+def remember_keys(scope: str, pairs) -> None:
+    """Record (key, approval_id) pairs in the caller's transaction; caller commits."""
+    rows = [{'scope': scope, 'key': k, 'approval_id': aid, 'created_at': datetime.utcnow()} for k, aid in pairs]
+    if rows:
+        db.session.execute(IdempotencyKey.__table__.insert(), rows)
+
+
+def create_approvals_once(scope: str, keyed_items: list) -> list:
+    """Create approvals for (key, fields) pairs, skipping keys already used in `scope`.
+
+    Everything new is inserted in one transaction together with its keys.
+    A key repeated within the batch maps to the first occurrence. Returns a
+    list aligned with `keyed_items` of (approval_id, created) tuples.
+    """
+    from sqlalchemy.exc import IntegrityError
+    from db import approvals
+    # a second pass only happens when a concurrent retry claimed a key first
+    for attempt in range(2):
+        existing = lookup_keys(scope, {k for k, _ in keyed_items})
+        first = {}
+        to_create = []
+        for idx, (k, fields) in enumerate(keyed_items):
+            if k in existing or k in first:
+                continue
+            first[k] = idx
+            to_create.append((k, fields))
+        if not to_create:
+            # a pure replay: nothing to write, so no counter bump or events
+            return [(existing[k], False) for k, _ in keyed_items]
+        try:
+            rows = approvals.create_approvals([f for _, f in to_create], commit=False)
+            db.session.flush()
+            remember_keys(scope, [(k, a.id) for (k, _), a in zip(to_create, rows)])
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            if attempt:
+                raise
+            continue
+        created = {k: a.id for (k, _), a in zip(to_create, rows)}
+        out = []
+        for idx, (k, _) in enumerate(keyed_items):
+            if k in created:
+                out.append((created[k], first[k] == idx))
+            else:
+                out.append((existing[k], False))
+        return out
@@ -0,0 +1,383 @@
+"""Versioned schema migrations.
+
+`db.create_all()` only creates missing tables, so it never adds an index or a
+column to an existing deployment. Each entry in `MIGRATIONS` runs once, in
+order, and the highest applied version is recorded in `schema_version`.
+Migrations are written to be idempotent so a fresh database (where version 1
+already creates everything from the current models) can run the rest safely.
+
+Usage:
+    flask --app main db upgrade      # apply pending migrations
+    flask --app main db current      # print the applied schema version
+    flask --app main db explain      # EXPLAIN the hot list queries
+"""
+from . import db
+from datetime import datetime
+from sqlalchemy import inspect
+import click
+import warnings
+
+
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=True)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def _load_models():
+    # Importing the modules registers their tables on db.metadata
+    from db import admins, approvals, counters, events, idempotency, org, outbox, sessions, spend, user_search, users  # noqa: F401
+
+
+# -----------------------
+# Migration helpers
+# -----------------------
+
+def _create_declared_indexes(conn, *tables):
+    """Create every index declared on the given tables that doesn't exist yet.
+
+    Only for tables a migration creates itself. Indexes on existing tables
+    must be frozen in the migration with `_create_index`, because the live
+    model may declare indexes on columns a later migration adds.
+    """
+    for table in tables:
+        for idx in table.indexes:
+            idx.create(bind=conn, checkfirst=True)
+
+
+def _create_index(conn, table_name: str, index_name: str, *columns: str):
+    """CREATE INDEX `index_name` ON `table_name` (columns) unless it exists.
+
+    `columns` are SQL fragments such as 'created_at DESC'.
+    """
+    if index_name in _index_names(conn, table_name):
+        return
+    conn.exec_driver_sql(f"CREATE INDEX {index_name} ON {table_name} ({', '.join(columns)})")
+
+
+def _create_expression_index(conn, table_name: str, index_name: str, expression: str):
+    """CREATE INDEX on an expression such as 'lower(email)' unless it exists.
+
+    Reflection doesn't report expression indexes, so the database checks.
+    """
+    if conn.dialect.name == 'mysql':
+        found = conn.exec_driver_sql(
+            "SELECT 1 FROM information_schema.statistics WHERE table_schema = DATABASE() "
+            "AND table_name = %s AND index_name = %s", (table_name, index_name)
+        ).first()
+        if not found:
+            conn.exec_driver_sql(f"CREATE INDEX {index_name} ON {table_name} (({expression}))")
+        return
+    conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({expression})")
+
+
+def _index_names(conn, table_name: str) -> set:
+    with warnings.catch_warnings():
+        # expression indexes can't be reflected; they're handled separately
+        warnings.filterwarnings('ignore', message='Skipped unsupported reflection of expression-based index')
+        return {i['name'] for i in inspect(conn).get_indexes(table_name)}
+
+
+def _drop_index(conn, table_name: str, index_name: str):
+    if index_name not in _index_names(conn, table_name):
+        return
+    if conn.dialect.name == 'mysql':
+        conn.exec_driver_sql(f"DROP INDEX {index_name} ON {table_name}")
+    else:
+        conn.exec_driver_sql(f"DROP INDEX {index_name}")
+
+
+def _add_column(conn, table, column):
+    """ALTER TABLE ... ADD COLUMN for a model column if it is missing."""
+    existing = {c['name'] for c in inspect(conn).get_columns(table.name)}
+    if column.name in existing:
+        return
+    ddl = column.type.compile(dialect=conn.dialect)
+    nullable = '' if column.nullable else ' NOT NULL'
+    default = ''
+    if column.server_default is not None:
+        default = f" DEFAULT {column.server_default.arg}"
+    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {ddl}{default}{nullable}")
+
+
+def _online(fn):
+    """Mark a migration that runs its own short transactions; it receives the Engine.
+
+    Used for large backfills that shouldn't hold one lock for the whole table.
+    """
+    fn.online = True
+    return fn
+
+
+# -----------------------
+# Migrations
+# -----------------------
+
+def _m0001_baseline(conn):
+    db.metadata.create_all(bind=conn)
+
+
+def _m0002_hot_path_indexes(conn):
+    _create_index(conn, 'approvals', 'ix_approvals_created', 'created_at DESC')
+    _create_index(conn, 'approvals', 'ix_approvals_status_created', 'status', 'created_at DESC')
+    _create_index(conn, 'approvals', 'ix_approvals_requestor_created', 'requestor_email', 'created_at DESC')
+    _create_index(conn, 'approvals', 'ix_approvals_approver_created', 'approver_email', 'created_at DESC')
+    _create_index(conn, 'users', 'ix_users_session_token', 'session_token')
+    _create_index(conn, 'users', 'ix_users_manager_id', 'manager_id')
+    _create_index(conn, 'admins', 'ix_admins_session_token', 'session_token')
+
+
+def _m0003_keyset_indexes(conn):
+    for name in ('ix_approvals_created', 'ix_approvals_status_created', 'ix_approvals_requestor_created', 'ix_approvals_approver_created'):
+        _drop_index(conn, 'approvals', name)
+    _create_index(conn, 'approvals', 'ix_approvals_created_id', 'created_at DESC', 'id DESC')
+    _create_index(conn, 'approvals', 'ix_approvals_status_created_id', 'status', 'created_at DESC', 'id DESC')
+    _create_index(conn, 'approvals', 'ix_approvals_requestor_created_id', 'requestor_email', 'created_at DESC', 'id DESC')
+    _create_index(conn, 'approvals', 'ix_approvals_approver_created_id', 'approver_email', 'created_at DESC', 'id DESC')
+
+
+def _m0004_email_outbox(conn):
+    from db.outbox import OutboxEmail
+    OutboxEmail.__table__.create(bind=conn, checkfirst=True)
+
+
+def _m0005_rule_routing(conn):
+    from db.approvals import Approval
+    from db.counters import Counter
+    Counter.__table__.create(bind=conn, checkfirst=True)
+    _add_column(conn, Approval.__table__, Approval.__table__.c.rule_id)
+    _add_column(conn, Approval.__table__, Approval.__table__.c.required_approvers)
+
+
+def _m0006_approver_inbox(conn):
+    from db.approvals import Approval
+    _add_column(conn, Approval.__table__, Approval.__table__.c.assigned_approver_id)
+    _create_index(conn, 'approvals', 'ix_approvals_assignee_created_id', 'assigned_approver_id', 'created_at DESC', 'id DESC')
+    _create_index(conn, 'approvals', 'ix_approvals_assignee_status_created_id', 'assigned_approver_id', 'status', 'created_at DESC', 'id DESC')
+    conn.exec_driver_sql(
+        "UPDATE approvals SET assigned_approver_id = "
+        "(SELECT users.manager_id FROM users WHERE users.email = approvals.requestor_email) "
+        "WHERE assigned_approver_id IS NULL"
+    )
+
+
+def _m0007_spend_totals(conn):
+    # run `flask --app main spend rebuild` afterwards to backfill the totals
+    from db.approvals import Approval
+    from db.spend import SpendTotal
+    _add_column(conn, Approval.__table__, Approval.__table__.c.company_amount)
+    SpendTotal.__table__.create(bind=conn, checkfirst=True)
+
+
+def _m0008_idempotency_keys(conn):
+    from db.idempotency import IdempotencyKey
+    IdempotencyKey.__table__.create(bind=conn, checkfirst=True)
+
+
+def _m0009_approval_version(conn):
+    from db.approvals import Approval
+    _add_column(conn, Approval.__table__, Approval.__table__.c.version)
+
+
+def _m0010_user_search(conn):
+    from db import user_search
+    user_search.UserSearchGram.__table__.create(bind=conn, checkfirst=True)
+    # SQLite gets an FTS5 trigram index; other backends use the gram table
+    if not user_search.create_fts(conn):
+        user_search.backfill_grams(conn)
+
+
+def _m0011_org_closure(conn):
+    from db import org
+    org.OrgClosure.__table__.create(bind=conn, checkfirst=True)
+    org.backfill(conn)
+
+
+def _m0012_approval_user_ids(conn):
+    from db.approvals import Approval
+    _add_column(conn, Approval.__table__, Approval.__table__.c.requestor_id)
+    _add_column(conn, Approval.__table__, Approval.__table__.c.approver_id)
+    _create_index(conn, 'approvals', 'ix_approvals_requestor_id_created_id', 'requestor_id', 'created_at DESC', 'id DESC')
+    _create_index(conn, 'approvals', 'ix_approvals_approver_id_created_id', 'approver_id', 'created_at DESC', 'id DESC')
+
+
+@_online
+def _m0013_backfill_approval_user_ids(engine):
+    from db.approvals import backfill_user_ids
+    backfill_user_ids(engine)
+    # the id indexes replace the email ones
+    with engine.begin() as conn:
+        _drop_index(conn, 'approvals', 'ix_approvals_requestor_created_id')
+        _drop_index(conn, 'approvals', 'ix_approvals_approver_created_id')
+
+
+def _m0014_counter_timestamps(conn):
+    from db.counters import Counter
+    _add_column(conn, Counter.__table__, Counter.__table__.c.updated_at)
+
+
+def _m0015_approval_events(conn):
+    from db.events import ApprovalEvent
+    ApprovalEvent.__table__.create(bind=conn, checkfirst=True)
+
+
+def _m0016_redact_outbox(conn):
+    # earlier releases kept the bodies (temporary passwords) of delivered mail
+    conn.exec_driver_sql("UPDATE email_outbox SET body_text = '', body_html = NULL WHERE status IN ('sent', 'failed')")
+
+
+def _m0017_user_prefix_indexes(conn):
+    # user search looks up exact and prefix matches before the substring index
+    _create_expression_index(conn, 'users', 'ix_users_email_lower', 'lower(email)')
+    _create_expression_index(conn, 'users', 'ix_users_username_lower', 'lower(username)')
+
+
+def _m0018_drop_session_token_indexes(conn):
+    # logins resolve through the sessions table; nothing looks these columns up
+    _drop_index(conn, 'users', 'ix_users_session_token')
+    _drop_index(conn, 'admins', 'ix_admins_session_token')
+
+
+MIGRATIONS = [
+    (1, 'baseline tables', _m0001_baseline),
+    (2, 'indexes for approval listings, manager lookups and session tokens', _m0002_hot_path_indexes),
+    (3, 'approval indexes with id tie-breaker for keyset pagination', _m0003_keyset_indexes),
+    (4, 'email outbox', _m0004_email_outbox),
+    (5, 'counters table; approval rule routing columns', _m0005_rule_routing),
+    (6, 'per-approver inbox column, indexes and backfill', _m0006_approver_inbox),
+    (7, 'spend totals table and approvals.company_amount', _m0007_spend_totals),
+    (8, 'idempotency keys for approval submission', _m0008_idempotency_keys),
+    (9, 'approvals.version for optimistic concurrency', _m0009_approval_version),
+    (10, 'user search index (FTS5 on SQLite, trigram table elsewhere)', _m0010_user_search),
+    (11, 'org hierarchy closure table', _m0011_org_closure),
+    (12, 'approvals.requestor_id / approver_id columns and indexes', _m0012_approval_user_ids),
+    (13, 'backfill approval user ids in batches; drop email indexes', _m0013_backfill_approval_user_ids),
+    (14, 'counters.updated_at for Last-Modified headers', _m0014_counter_timestamps),
+    (15, 'approval change feed events (EVENTS_BACKEND=db)', _m0015_approval_events),
+    (16, 'clear the bodies of delivered outbox mail', _m0016_redact_outbox),
+    (17, 'case-insensitive prefix indexes for user search', _m0017_user_prefix_indexes),
+    (18, 'drop the unused session_token indexes', _m0018_drop_session_token_indexes),
+]
+
+
+def current_version() -> int:
+    if not inspect(db.engine).has_table(SchemaVersion.__tablename__):
+        return 0
+    return db.session.query(db.func.max(SchemaVersion.version)).scalar() or 0
+
+
+def upgrade(target: int = None) -> list:
+    """Apply pending migrations up to `target` (default: latest). Returns applied versions."""
+    _load_models()
+    SchemaVersion.__table__.create(bind=db.engine, checkfirst=True)
+    current = current_version()
+    applied = []
+    for version, description, fn in MIGRATIONS:
+        if version <= current or (target is not None and version > target):
+            continue
+        if getattr(fn, 'online', False):
+            fn(db.engine)
+            with db.engine.begin() as conn:
+                conn.execute(SchemaVersion.__table__.insert().values(version=version, description=description, applied_at=datetime.utcnow()))
+        else:
+            with db.engine.begin() as conn:
+                fn(conn)
+                conn.execute(SchemaVersion.__table__.insert().values(version=version, description=description, applied_at=datetime.utcnow()))
+        applied.append(version)
+    db.session.remove()
+    return applied
+
+
+# -----------------------
+# Query plan checks
+# -----------------------
+
+def _hot_queries():
+    from db import org
+    from db.approvals import Approval
+    from db.sessions import UserSession
+    from db.users import User
+    newest = (Approval.created_at.desc(), Approval.id.desc())
+    return [
+        ('list_approvals', Approval.query.order_by(*newest).limit(200)),
+        ('list_approvals(status)', Approval.query.filter_by(status='Pending').order_by(*newest).limit(200)),
+        ('list_approvals_by_requestor', Approval.query.filter_by(requestor_id=1).order_by(*newest).limit(200)),
+        ('list_approvals_by_requestors', Approval.query.filter(Approval.requestor_id.in_([1, 2])).order_by(*newest).limit(200)),
+        ('list_approvals_by_org', Approval.query.filter(Approval.requestor_id.in_(org.subtree_ids_select(1))).order_by(*newest).limit(200)),
+        ('list_approvals_by_approver', Approval.query.filter_by(approver_id=1).order_by(*newest).limit(200)),
+        ('list_approvals_by_assignee', Approval.query.filter_by(assigned_approver_id=1).order_by(*newest).limit(200)),
+        ('list_approvals_by_assignee(status)', Approval.query.filter_by(assigned_approver_id=1, status='Pending').order_by(*newest).limit(200)),
+        ('users by manager_id', User.query.filter_by(manager_id=1)),
+        ('sessions by token', UserSession.query.filter_by(token='x')),
+    ]
+
+
+def _plan(sql: str):
+    """Return (plan lines, full_scan, sort) for a SQL statement on the current dialect."""
+    dialect = db.engine.dialect.name
+    with db.engine.connect() as conn:
+        if dialect == 'sqlite':
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").mappings().all()
+            lines = [r['detail'] for r in rows]
+            full_scan = any(d.startswith('SCAN') and 'INDEX' not in d for d in lines)
+            sort = any('TEMP B-TREE' in d for d in lines)
+        else:
+            rows = conn.exec_driver_sql(f"EXPLAIN {sql}").mappings().all()
+            lines = [f"{r.get('table')}: type={r.get('type')} key={r.get('key')} extra={r.get('Extra')}" for r in rows]
+            full_scan = any(r.get('type') == 'ALL' for r in rows)
+            sort = any('filesort' in (r.get('Extra') or '') for r in rows)
+    return lines, full_scan, sort
+
+
+def explain_hot_queries() -> list:
+    """EXPLAIN each hot-path query and flag full table scans and extra sorts.
+
+    A sort is expected for the IN (...) listings, which merge several index
+    ranges; a full scan is never expected once the indexes exist.
+    """
+    _load_models()
+    out = []
+    for name, q in _hot_queries():
+        sql = str(q.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        lines, full_scan, sort = _plan(sql)
+        out.append({'name': name, 'plan': lines, 'full_scan': full_scan, 'sort': sort})
+    return out
+
+
+# -----------------------
+# CLI
+# -----------------------
+
+@click.group('db')
+def db_cli():
+    """Database schema commands."""
+
+
+@db_cli.command('upgrade')
+@click.option('--target', type=int, default=None, help='Stop after this version.')
+def upgrade_command(target):
+    applied = upgrade(target)
+    if applied:
+        click.echo(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+    click.echo(f"Schema version: {current_version()}")
+
+
+@db_cli.command('current')
+def current_command():
+    latest = MIGRATIONS[-1][0]
+    click.echo(f"Schema version: {current_version()} (latest {latest})")
+
+
+@db_cli.command('explain')
+def explain_command():
+    failed = False
+    for r in explain_hot_queries():
+        marker = 'FULL SCAN' if r['full_scan'] else ('sort' if r['sort'] else 'ok')
+        click.echo(f"[{marker}] {r['name']}")
+        for line in r['plan']:
+            click.echo(f"    {line}")
+        failed = failed or r['full_scan']
+    if failed:
+        raise SystemExit(1)
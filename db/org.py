@@ -0,0 +1,254 @@
+"""Organization hierarchy index (closure table).
+
+`users.manager_id` stays the source of truth. `org_closure` additionally holds
+one row per (ancestor, descendant) pair, plus a depth-0 row for each user.
+Subtree, ancestor and direct-report lookups are then single indexed queries
+at any depth.
+
+The table is maintained:
+  * by mapper events on User for ORM writes (create_user_record, set_manager,
+    admin deletes);
+  * by `add_users` after Core bulk inserts (db/user_import.py).
+
+Deleting a user detaches their direct reports (manager_id becomes NULL) and
+each report's subtree becomes its own tree.
+
+    flask --app main users org-rebuild   # recompute from users.manager_id
+"""
+from . import db
+from sqlalchemy import event
+import base64
+import json
+
+
+class OrgClosure(db.Model):
+    __tablename__ = 'org_closure'
+
+    ancestor_id = db.Column(db.Integer, primary_key=True)
+    descendant_id = db.Column(db.Integer, primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_org_closure_descendant_depth', 'descendant_id', 'depth'),
+        db.Index('ix_org_closure_ancestor_depth', 'ancestor_id', 'depth'),
+    )
+
+
+class OrgCycleError(ValueError):
+    """The requested manager is the user or one of their reports."""
+
+
+# -----------------------
+# Maintenance (all take a Connection so they work inside flush events)
+# -----------------------
+
+def _closure_rows(pairs, known: dict) -> list:
+    """Closure rows for new (user_id, manager_id) pairs.
+
+    `known` maps already-indexed manager ids to their [(ancestor_id, depth)]
+    lists. New users may manage each other and are resolved in
+    dependency order; users caught in a manager_id cycle are treated as roots.
+    """
+    pending = dict(pairs)
+    paths = dict(known)
+    rows = []
+    while pending:
+        progressed = False
+        for uid, mid in list(pending.items()):
+            if mid is not None and mid in pending:
+                continue
+            up = paths.get(mid, []) if mid is not None else []
+            paths[uid] = [(uid, 0)] + [(a, d + 1) for a, d in up]
+            rows.extend({'ancestor_id': a, 'descendant_id': uid, 'depth': d} for a, d in paths[uid])
+            del pending[uid]
+            progressed = True
+        if not progressed:
+            # a cycle in manager_id: break it by indexing one member as a root
+            uid = next(iter(pending))
+            pending[uid] = None
+    return rows
+
+
+def _ancestor_paths(conn, ids) -> dict:
+    t = OrgClosure.__table__
+    paths = {}
+    ids = list(ids)
+    for i in range(0, len(ids), 500):
+        q = db.select(t.c.descendant_id, t.c.ancestor_id, t.c.depth).where(t.c.descendant_id.in_(ids[i:i + 500]))
+        for d, a, depth in conn.execute(q):
+            paths.setdefault(d, []).append((a, depth))
+    return paths
+
+
+def add_users(conn, pairs) -> None:
+    """Index newly created users given as (user_id, manager_id) pairs."""
+    pairs = list(pairs)
+    if not pairs:
+        return
+    new_ids = {uid for uid, _ in pairs}
+    managers = {mid for _, mid in pairs if mid is not None and mid not in new_ids}
+    rows = _closure_rows(pairs, _ancestor_paths(conn, managers))
+    for i in range(0, len(rows), 1000):
+        conn.execute(OrgClosure.__table__.insert(), rows[i:i + 1000])
+
+
+def _subtree(conn, user_id: int) -> list:
+    t = OrgClosure.__table__
+    return list(conn.execute(db.select(t.c.descendant_id, t.c.depth).where(t.c.ancestor_id == user_id)))
+
+
+def move_user(conn, user_id: int, manager_id) -> None:
+    """Re-hang `user_id` (and everyone under them) below `manager_id` (or make it a root)."""
+    t = OrgClosure.__table__
+    subtree = _subtree(conn, user_id)
+    if not subtree:
+        # not indexed yet (e.g. created before the table existed)
+        add_users(conn, [(user_id, manager_id)])
+        return
+    below = [d for d, _ in subtree]
+    if manager_id is not None and manager_id in below:
+        raise OrgCycleError(f'user {manager_id} reports to user {user_id}')
+    # cut every link from outside the subtree into it
+    for i in range(0, len(below), 500):
+        conn.execute(t.delete().where(t.c.descendant_id.in_(below[i:i + 500]), t.c.ancestor_id.notin_(below)))
+    if manager_id is None:
+        return
+    ups = list(conn.execute(db.select(t.c.ancestor_id, t.c.depth).where(t.c.descendant_id == manager_id)))
+    if not ups:
+        ups = [(manager_id, 0)]
+    rows = [{'ancestor_id': a, 'descendant_id': d, 'depth': da + dd + 1} for a, da in ups for d, dd in subtree]
+    for i in range(0, len(rows), 1000):
+        conn.execute(t.insert(), rows[i:i + 1000])
+
+
+def remove_user(conn, user_id: int) -> None:
+    """Drop a deleted user from the index and detach their direct reports."""
+    from db.users import User
+    t = OrgClosure.__table__
+    reports = [r for (r,) in conn.execute(db.select(t.c.descendant_id).where(t.c.ancestor_id == user_id, t.c.depth == 1))]
+    for r in reports:
+        move_user(conn, r, None)
+    conn.execute(User.__table__.update().where(User.__table__.c.manager_id == user_id).values(manager_id=None))
+    conn.execute(t.delete().where((t.c.ancestor_id == user_id) | (t.c.descendant_id == user_id)))
+
+
+def backfill(conn) -> int:
+    """Rebuild the whole table from users.manager_id on `conn`. Returns the row count."""
+    from db.users import User
+    u = User.__table__
+    conn.execute(OrgClosure.__table__.delete())
+    pairs = [tuple(r) for r in conn.execute(db.select(u.c.id, u.c.manager_id))]
+    ids = {uid for uid, _ in pairs}
+    # a manager_id pointing at a deleted user counts as no manager
+    rows = _closure_rows([(uid, mid if mid in ids else None) for uid, mid in pairs], {})
+    for i in range(0, len(rows), 1000):
+        conn.execute(OrgClosure.__table__.insert(), rows[i:i + 1000])
+    return len(rows)
+
+
+def register_events(User):
+    """Keep the closure table in step with ORM writes to `User` (called by db/users.py)."""
+    from sqlalchemy import inspect as sa_inspect
+
+    @event.listens_for(User, 'after_insert')
+    def _add(mapper, connection, target):
+        add_users(connection, [(target.id, target.manager_id)])
+
+    @event.listens_for(User, 'after_update')
+    def _move(mapper, connection, target):
+        if sa_inspect(target).attrs.manager_id.history.has_changes():
+            move_user(connection, target.id, target.manager_id)
+
+    @event.listens_for(User, 'before_delete')
+    def _remove(mapper, connection, target):
+        remove_user(connection, target.id)
+
+
+# -----------------------
+# Queries
+# -----------------------
+
+def subtree(user_id: int, include_self: bool = False, max_depth: int = None, limit: int = None, after: tuple = None) -> list:
+    """Everyone below `user_id` as (User, depth), nearest levels first.
+
+    Rows are ordered by (depth, username, id). Pass `limit`, and the last
+    row's `page_key` as `after` to continue, to read a big tree in pages.
+    """
+    from db.users import User
+    q = db.session.query(User, OrgClosure.depth).join(OrgClosure, OrgClosure.descendant_id == User.id).filter(OrgClosure.ancestor_id == user_id)
+    if not include_self:
+        q = q.filter(OrgClosure.depth > 0)
+    if max_depth is not None:
+        q = q.filter(OrgClosure.depth <= max_depth)
+    if after is not None:
+        q = q.filter(db.tuple_(OrgClosure.depth, User.username, User.id) > db.tuple_(*after))
+    q = q.order_by(OrgClosure.depth.asc(), User.username.asc(), User.id.asc())
+    if limit is not None:
+        q = q.limit(limit)
+    return q.all()
+
+
+MAX_PAGE_SIZE = 1000
+
+
+def page_key(user, depth: int) -> tuple:
+    return (depth, user.username, user.id)
+
+
+def encode_cursor(key: tuple) -> str:
+    raw = json.dumps(list(key), separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Return a page key from `encode_cursor`. Raises ValueError for a malformed cursor."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        depth, username, uid = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return int(depth), str(username), int(uid)
+    except Exception:
+        raise ValueError('invalid cursor')
+
+
+def subtree_ids_select(user_id: int, include_self: bool = False):
+    """Ids below `user_id` as a subquery for `column.in_(...)` filters.
+
+    The filter stays in SQL, so a big org never becomes thousands of bound
+    parameters.
+    """
+    q = db.select(OrgClosure.descendant_id).where(OrgClosure.ancestor_id == user_id)
+    if not include_self:
+        q = q.where(OrgClosure.depth > 0)
+    return q
+
+
+def subtree_emails_select(user_id: int, include_self: bool = False):
+    """Emails of everyone below `user_id` as a subquery (see subtree_ids_select)."""
+    from db.users import User
+    q = db.select(User.email).join(OrgClosure, OrgClosure.descendant_id == User.id).where(OrgClosure.ancestor_id == user_id)
+    if not include_self:
+        q = q.where(OrgClosure.depth > 0)
+    return q
+
+
+def ancestors(user_id: int) -> list:
+    """The management chain above `user_id`, direct manager first."""
+    from db.users import User
+    q = db.session.query(User).join(OrgClosure, OrgClosure.ancestor_id == User.id).filter(
+        OrgClosure.descendant_id == user_id, OrgClosure.depth > 0
+    )
+    return q.order_by(OrgClosure.depth.asc()).all()
+
+
+def direct_reports(user_id: int) -> list:
+    return [u for u, _ in subtree(user_id, max_depth=1)]
+
+
+def is_in_subtree(manager_id: int, user_id: int) -> bool:
+    return db.session.query(OrgClosure.depth).filter_by(ancestor_id=manager_id, descendant_id=user_id).first() is not None
+
+
+def rebuild() -> int:
+    n = backfill(db.session.connection())
+    db.session.commit()
+    return n
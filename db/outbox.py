@@ -0,0 +1,206 @@
+"""Durable email outbox.
+
+Request handlers call `enqueue_email`, which only inserts a row. A separate
+worker process delivers queued mail in batches over reused SMTP connections
+and retries failures with exponential backoff:
+
+    flask --app main mail worker          # run until interrupted
+    flask --app main mail worker --once   # deliver one batch and exit
+    flask --app main mail depth           # queued / failed / sent counts
+    flask --app main mail prune           # delete finished rows past retention
+
+Bodies can hold secrets (temporary passwords), so they are cleared as soon
+as a message is sent or gives up. The finished rows themselves are deleted
+after OUTBOX_RETENTION_DAYS.
+"""
+from . import db
+from datetime import datetime, timedelta
+import os
+import random
+import time
+import click
+
+STATUS_PENDING = 'pending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+BACKOFF_BASE = float(os.getenv('OUTBOX_BACKOFF_BASE', '30'))
+BACKOFF_MAX = float(os.getenv('OUTBOX_BACKOFF_MAX', '3600'))
+# a claimed batch is retried by another worker if not finished within this
+CLAIM_SECONDS = float(os.getenv('OUTBOX_CLAIM_SECONDS', '300'))
+RETENTION = timedelta(days=float(os.getenv('OUTBOX_RETENTION_DAYS', '7')))
+PRUNE_INTERVAL = 3600
+
+
+class OutboxEmail(db.Model):
+    __tablename__ = 'email_outbox'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    to_email = db.Column(db.String(100), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body_text = db.Column(db.Text, nullable=False)
+    body_html = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(10), nullable=False, default=STATUS_PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_email_outbox_due', 'status', 'next_attempt_at'),
+    )
+
+
+# -----------------------
+# Producer side
+# -----------------------
+
+def enqueue_email(to_email: str, subject: str, body_text: str, body_html: str = None, commit: bool = True):
+    """Queue an email for the outbox worker. Returns the row, or None if SMTP is unset.
+
+    With `commit=False` the row joins the caller's transaction, so the email
+    is only queued if the surrounding change (e.g. a password reset) commits.
+    Without SMTP configuration the message is printed instead, as before.
+    """
+    from utils.mailer import smtp_config, send_email
+    if not smtp_config():
+        send_email(to_email, subject, body_text, body_html)
+        return None
+    e = OutboxEmail(to_email=to_email, subject=subject, body_text=body_text, body_html=body_html)
+    db.session.add(e)
+    if commit:
+        db.session.commit()
+    return e
+
+
+def queue_depth() -> dict:
+    """Row counts per status, plus how many pending rows are due now."""
+    counts = dict(db.session.query(OutboxEmail.status, db.func.count(OutboxEmail.id)).group_by(OutboxEmail.status).all())
+    due = OutboxEmail.query.filter(OutboxEmail.status == STATUS_PENDING, OutboxEmail.next_attempt_at <= datetime.utcnow()).count()
+    return {
+        'pending': counts.get(STATUS_PENDING, 0),
+        'due': due,
+        'failed': counts.get(STATUS_FAILED, 0),
+        'sent': counts.get(STATUS_SENT, 0),
+    }
+
+
+# -----------------------
+# Worker side
+# -----------------------
+
+def _backoff(attempts: int) -> float:
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** (attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _redact(e: OutboxEmail) -> None:
+    e.body_text = ''
+    e.body_html = None
+
+
+def deliver_batch(pool, batch_size: int = 50) -> int:
+    """Send up to `batch_size` due messages through `pool`. Returns how many were attempted.
+
+    The batch is first claimed (its next_attempt_at pushed CLAIM_SECONDS out)
+    and committed, then each message's outcome is committed on its own. A
+    crash mid-batch re-sends at most the message that was in flight.
+    """
+    now = datetime.utcnow()
+    rows = (
+        OutboxEmail.query
+        .filter(OutboxEmail.status == STATUS_PENDING, OutboxEmail.next_attempt_at <= now)
+        .order_by(OutboxEmail.next_attempt_at.asc(), OutboxEmail.id.asc())
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for e in rows:
+        e.next_attempt_at = now + timedelta(seconds=CLAIM_SECONDS)
+    db.session.commit()
+    for e in rows:
+        e.attempts = (e.attempts or 0) + 1
+        try:
+            pool.send(e.to_email, e.subject, e.body_text, e.body_html)
+            e.status = STATUS_SENT
+            e.sent_at = datetime.utcnow()
+            e.last_error = None
+            _redact(e)
+        except Exception as exc:
+            e.last_error = str(exc)
+            if e.attempts >= MAX_ATTEMPTS:
+                e.status = STATUS_FAILED
+                _redact(e)
+            else:
+                e.next_attempt_at = datetime.utcnow() + timedelta(seconds=_backoff(e.attempts))
+            # the connection may be in a bad state; start the next send fresh
+            pool.close()
+        db.session.commit()
+    return len(rows)
+
+
+def prune(older_than: timedelta = RETENTION) -> int:
+    """Delete sent and failed rows finished more than `older_than` ago. Returns the count."""
+    cutoff = datetime.utcnow() - older_than
+    n = OutboxEmail.query.filter(
+        OutboxEmail.status.in_((STATUS_SENT, STATUS_FAILED)),
+        db.func.coalesce(OutboxEmail.sent_at, OutboxEmail.next_attempt_at) < cutoff,
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return n
+
+
+def run_worker(batch_size: int = 50, interval: float = 2.0, once: bool = False) -> None:
+    from utils.mailer import SMTPPool, smtp_config
+    cfg = smtp_config()
+    if not cfg:
+        raise click.ClickException('SMTP_HOST/SMTP_PORT are not configured')
+    pool = SMTPPool(cfg)
+    last_prune = 0
+    try:
+        while True:
+            if time.time() - last_prune > PRUNE_INTERVAL:
+                last_prune = time.time()
+                prune()
+            sent = deliver_batch(pool, batch_size)
+            if once:
+                return
+            if sent < batch_size:
+                # queue drained; release the connection until there is more work
+                if sent == 0:
+                    pool.close()
+                time.sleep(interval)
+    finally:
+        pool.close()
+
+
+# -----------------------
+# CLI
+# -----------------------
+
+@click.group('mail')
+def mail_cli():
+    """Email outbox commands."""
+
+
+@mail_cli.command('worker')
+@click.option('--batch-size', type=int, default=50)
+@click.option('--interval', type=float, default=2.0, help='Seconds to sleep when the queue is empty.')
+@click.option('--once', is_flag=True, help='Deliver a single batch and exit.')
+def worker_command(batch_size, interval, once):
+    run_worker(batch_size=batch_size, interval=interval, once=once)
+
+
+@mail_cli.command('prune')
+@click.option('--days', type=float, default=None, help='Retention in days (default: OUTBOX_RETENTION_DAYS).')
+def prune_command(days):
+    n = prune(RETENTION if days is None else timedelta(days=days))
+    click.echo(f"Deleted {n} finished messages")
+
+
+@mail_cli.command('depth')
+def depth_command():
+    for k, v in queue_depth().items():
+        click.echo(f"{k}: {v}")
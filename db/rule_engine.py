@@ -0,0 +1,118 @@
+"""Compiled approval-rule matching.
+
+`list_rules()` is compiled into one static interval index per category plus
+one for rules without a category. Each index splits the amount axis at every
+rule boundary and precomputes the winning rule for every elementary segment
+(a sweep over the sorted boundaries, O(n log n) to build), so matching an
+amount is a single binary search: O(log n) regardless of rule count.
+
+Rule semantics:
+  * min_amount / max_amount are inclusive; None means unbounded.
+  * a rule with a category only matches that category (case-insensitive);
+    category-specific rules win over rules without a category.
+  * among overlapping rules the narrowest amount range wins, then the
+    oldest rule (lowest id).
+
+The compiled form is cached per process and rebuilt only when the
+`approval_rules` counter changes, which `create_rule` / `update_rule` bump.
+"""
+from bisect import bisect_right
+from collections import namedtuple
+import heapq
+import math
+import threading
+
+from db.counters import get_counter
+
+RULES_COUNTER = 'approval_rules'
+
+# Detached snapshot of an ApprovalRule; ORM rows can't outlive their session
+RuleSnapshot = namedtuple('RuleSnapshot', 'id name min_amount max_amount category required_approvers')
+
+
+class _IntervalIndex:
+    def __init__(self, rules):
+        # rule -> half-open [start, end) so inclusive max works with bisect
+        spans = []
+        for r in rules:
+            start = -math.inf if r.min_amount is None else float(r.min_amount)
+            end = math.inf if r.max_amount is None else math.nextafter(float(r.max_amount), math.inf)
+            if start < end:
+                spans.append((start, end, r))
+        self.open_rule = None
+        unbounded = [s for s in spans if s[0] == -math.inf and s[1] == math.inf]
+        if unbounded:
+            self.open_rule = min(unbounded, key=lambda s: s[2].id)[2]
+
+        points = sorted({s[0] for s in spans} | {s[1] for s in spans if s[1] != math.inf})
+        spans.sort(key=lambda s: s[0])
+        self.bounds = []
+        self.winners = []
+        heap = []
+        i = 0
+        for p in points:
+            while i < len(spans) and spans[i][0] <= p:
+                start, end, r = spans[i]
+                heapq.heappush(heap, (end - start, r.id, end, r))
+                i += 1
+            # expired spans are dropped lazily: only the top has to be live
+            while heap and heap[0][2] <= p:
+                heapq.heappop(heap)
+            self.bounds.append(p)
+            self.winners.append(heap[0][3] if heap else None)
+
+    def match(self, amount):
+        if amount is None:
+            return self.open_rule
+        idx = bisect_right(self.bounds, amount) - 1
+        if idx < 0:
+            return None
+        return self.winners[idx]
+
+
+class CompiledRules:
+    def __init__(self, rules, version: int):
+        self.version = version
+        self.count = len(rules)
+        by_category = {}
+        generic = []
+        for r in rules:
+            key = (r.category or '').strip().lower()
+            if key:
+                by_category.setdefault(key, []).append(r)
+            else:
+                generic.append(r)
+        self.by_category = {k: _IntervalIndex(v) for k, v in by_category.items()}
+        self.generic = _IntervalIndex(generic)
+
+    def match(self, category, amount):
+        """Return the winning RuleSnapshot for an expense, or None."""
+        key = (category or '').strip().lower()
+        if key in self.by_category:
+            r = self.by_category[key].match(amount)
+            if r is not None:
+                return r
+        return self.generic.match(amount)
+
+
+_compiled = None
+_lock = threading.Lock()
+
+
+def get_compiled_rules() -> CompiledRules:
+    """Return the cached compiled rules, rebuilding if the rule version moved."""
+    global _compiled
+    version = get_counter(RULES_COUNTER)
+    compiled = _compiled
+    if compiled is not None and compiled.version == version:
+        return compiled
+    with _lock:
+        if _compiled is None or _compiled.version != version:
+            from db.approvals import list_rules
+            rules = [RuleSnapshot(**r.to_dict()) for r in list_rules()]
+            _compiled = CompiledRules(rules, version)
+        return _compiled
+
+
+def match_rule(category, amount):
+    return get_compiled_rules().match(category, amount)
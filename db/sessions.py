@@ -0,0 +1,141 @@
+from . import db
+from datetime import datetime
+from sqlalchemy import and_
+from collections import OrderedDict
+import os
+import threading
+import time
+
+PRINCIPAL_ADMIN = 'admin'
+PRINCIPAL_USER = 'user'
+
+
+class UserSession(db.Model):
+    """One row per live login, keyed by the session token cookie value."""
+    __tablename__ = 'sessions'
+
+    token = db.Column(db.String(64), primary_key=True)
+    principal_type = db.Column(db.String(10), nullable=False)
+    principal_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_sessions_principal', 'principal_type', 'principal_id'),
+    )
+
+
+class _SessionCache:
+    """Small thread-safe TTL + LRU map of token -> resolved principal.
+
+    Unknown tokens are cached too (as None) so a flood of bad cookies does not
+    hit the database on every request. Entries are per process: a logout in
+    another worker is only seen here once the TTL runs out.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        """Return (hit, value)."""
+        with self._lock:
+            entry = self._data.get(token)
+            if entry is None:
+                return False, None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[token]
+                return False, None
+            self._data.move_to_end(token)
+            return True, value
+
+    def put(self, token: str, value):
+        with self._lock:
+            self._data[token] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(token)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, *tokens):
+        with self._lock:
+            for t in tokens:
+                self._data.pop(t, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_cache = _SessionCache(
+    max_size=int(os.getenv('SESSION_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('SESSION_CACHE_TTL', '60')),
+)
+
+
+# -----------------------
+# Session store helpers
+# -----------------------
+
+def start_session(principal_type: str, principal_id: int, token: str) -> None:
+    """Register `token` for a principal, replacing any previous session.
+
+    The caller owns the transaction and must commit.
+    """
+    revoke_principal(principal_type, principal_id)
+    db.session.add(UserSession(token=token, principal_type=principal_type, principal_id=principal_id))
+    _cache.invalidate(token)
+
+
+def end_session(token: str):
+    """Remove a session token. Returns the deleted row (or None); caller commits."""
+    _cache.invalidate(token)
+    s = db.session.get(UserSession, token)
+    if s:
+        db.session.delete(s)
+    return s
+
+
+def revoke_principal(principal_type: str, principal_id: int) -> None:
+    """Drop every session belonging to a principal; caller commits."""
+    rows = UserSession.query.filter_by(principal_type=principal_type, principal_id=principal_id).all()
+    for s in rows:
+        _cache.invalidate(s.token)
+        db.session.delete(s)
+
+
+def resolve_session(token: str):
+    """Resolve a token to {'id', 'name', 'role', 'email'} or None.
+
+    Served from the in-process cache when possible; otherwise a single primary
+    key lookup on `sessions` joined to the owning admin/user row.
+    """
+    if not token:
+        return None
+    hit, value = _cache.get(token)
+    if hit:
+        return value
+
+    from db.admins import Admin
+    from db.users import User
+    row = (
+        db.session.query(UserSession.principal_type, UserSession.principal_id, Admin.name, Admin.email, User.username, User.email, User.role)
+        .outerjoin(Admin, and_(UserSession.principal_type == PRINCIPAL_ADMIN, Admin.id == UserSession.principal_id))
+        .outerjoin(User, and_(UserSession.principal_type == PRINCIPAL_USER, User.id == UserSession.principal_id))
+        .filter(UserSession.token == token)
+        .first()
+    )
+    value = None
+    if row:
+        ptype, pid, admin_name, admin_email, username, user_email, role = row
+        if ptype == PRINCIPAL_ADMIN and admin_email:
+            value = {'id': pid, 'name': admin_name, 'role': 'Admin', 'email': admin_email}
+        elif ptype == PRINCIPAL_USER and user_email:
+            value = {'id': pid, 'name': username, 'role': role or 'Employee', 'email': user_email}
+    _cache.put(token, value)
+    return value
+
+
+def clear_session_cache() -> None:
+    _cache.clear()
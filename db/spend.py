@@ -0,0 +1,188 @@
+"""Incrementally maintained spend totals.
+
+`spend_totals` holds one row per (requestor, category, month, status) with
+the summed amount in company currency and the number of approvals. The rows
+are adjusted in the same transaction as `create_approval` and
+`set_approval_status`, so summaries never have to scan `approvals` or call
+the currency converter. Amounts use `Approval.company_amount`, the value
+converted when the expense was created, so moving an approval between
+statuses moves exactly what was added.
+
+    flask --app main spend rebuild    # recompute every bucket from approvals
+"""
+from . import db
+from sqlalchemy.exc import IntegrityError
+import click
+
+DIMENSIONS = ('requestor_email', 'category', 'month', 'status')
+
+
+class SpendTotal(db.Model):
+    __tablename__ = 'spend_totals'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    requestor_email = db.Column(db.String(100), nullable=False)
+    # '' when the approval has no category, so the unique key stays usable
+    category = db.Column(db.String(100), nullable=False, default='')
+    month = db.Column(db.String(7), nullable=False)  # YYYY-MM
+    status = db.Column(db.String(20), nullable=False)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('requestor_email', 'category', 'month', 'status', name='uq_spend_totals_bucket'),
+        db.Index('ix_spend_totals_month_status', 'month', 'status'),
+    )
+
+    def to_dict(self):
+        return {
+            'requestor_email': self.requestor_email,
+            'category': self.category or None,
+            'month': self.month,
+            'status': self.status,
+            'total': self.total,
+            'count': self.count,
+        }
+
+
+def _bucket_key(a, status: str) -> dict:
+    return {
+        'requestor_email': a.requestor_email,
+        'category': a.category or '',
+        'month': a.created_at.strftime('%Y-%m'),
+        'status': status,
+    }
+
+
+def _adjust(key: dict, amount: float, count: int) -> None:
+    """Add (amount, count) to one bucket, creating it on first use. Caller commits."""
+    filters = [getattr(SpendTotal, k) == v for k, v in key.items()]
+    values = {SpendTotal.total: SpendTotal.total + amount, SpendTotal.count: SpendTotal.count + count}
+    if SpendTotal.query.filter(*filters).update(values, synchronize_session=False):
+        return
+    try:
+        # a concurrent request may create the same bucket first
+        with db.session.begin_nested():
+            db.session.add(SpendTotal(total=amount, count=count, **key))
+    except IntegrityError:
+        SpendTotal.query.filter(*filters).update(values, synchronize_session=False)
+
+
+def record_created(*approvals) -> None:
+    """Account for newly created approvals (call before the commit).
+
+    Approvals landing in the same bucket are summed first, so a batch costs
+    one upsert per bucket rather than one per approval.
+    """
+    buckets = {}
+    for a in approvals:
+        key = tuple(_bucket_key(a, a.status).items())
+        t = buckets.setdefault(key, [0.0, 0])
+        t[0] += a.company_amount or 0.0
+        t[1] += 1
+    for key, (amount, count) in buckets.items():
+        _adjust(dict(key), amount, count)
+
+
+def record_status_change(a, old_status: str) -> None:
+    """Move an approval's amount from its old status bucket to the new one."""
+    if old_status == a.status:
+        return
+    amount = a.company_amount or 0.0
+    _adjust(_bucket_key(a, old_status), -amount, -1)
+    _adjust(_bucket_key(a, a.status), amount, 1)
+
+
+def record_status_changes(rows, new_status: str) -> None:
+    """Batch form of record_status_change for rows read before a bulk update.
+
+    `rows` carry the old `status`; buckets are netted before writing.
+    """
+    buckets = {}
+    for r in rows:
+        if r.status == new_status:
+            continue
+        amount = r.company_amount or 0.0
+        for status, sign in ((r.status, -1), (new_status, 1)):
+            key = tuple(_bucket_key(r, status).items())
+            t = buckets.setdefault(key, [0.0, 0])
+            t[0] += sign * amount
+            t[1] += sign
+    for key, (amount, count) in buckets.items():
+        if count or amount:
+            _adjust(dict(key), amount, count)
+
+
+def summarize(by: str, month: str = None, status: str = None, requestor_emails=None) -> list:
+    """Sum buckets grouped by one dimension, e.g. summarize('status', month='2025-01').
+
+    `requestor_emails` is a list or a SELECT of emails (e.g. org.subtree_emails_select).
+    """
+    if by not in DIMENSIONS:
+        raise ValueError(f'cannot group by {by}')
+    col = getattr(SpendTotal, by)
+    q = db.session.query(col, db.func.sum(SpendTotal.total), db.func.sum(SpendTotal.count))
+    if month:
+        q = q.filter(SpendTotal.month == month)
+    if status:
+        q = q.filter(SpendTotal.status == status)
+    if requestor_emails is not None:
+        if isinstance(requestor_emails, (list, tuple, set)) and not requestor_emails:
+            return []
+        q = q.filter(SpendTotal.requestor_email.in_(requestor_emails))
+    rows = q.group_by(col).order_by(col).all()
+    return [{by: (k or None), 'total': round(t or 0.0, 2), 'count': int(c or 0)} for k, t, c in rows]
+
+
+def rebuild(batch_size: int = 1000) -> int:
+    """Recompute every bucket from `approvals`. Returns the number of approvals read.
+
+    Approvals created before company amounts were recorded are converted at
+    today's rates and the result is saved on the row.
+    """
+    from db.admins import get_company_currency
+    from db.approvals import Approval, bump_changes
+    from utils.currency import convert_amounts
+    company_currency = get_company_currency()
+
+    missing = Approval.query.filter(Approval.company_amount.is_(None), Approval.amount.isnot(None)).with_entities(Approval.id).all()
+    ids = [r[0] for r in missing]
+    for i in range(0, len(ids), batch_size):
+        rows = Approval.query.filter(Approval.id.in_(ids[i:i + batch_size])).all()
+        converted = convert_amounts([(a.amount, a.currency or company_currency) for a in rows], company_currency)
+        for a, c in zip(rows, converted):
+            a.company_amount = c
+        bump_changes(rows)
+        db.session.commit()
+
+    totals = {}
+    seen = 0
+    q = db.session.query(Approval.requestor_email, Approval.category, Approval.created_at, Approval.status, Approval.company_amount)
+    for email, category, created_at, status, amount in q.execution_options(yield_per=batch_size):
+        seen += 1
+        if created_at is None:
+            continue
+        key = (email, category or '', created_at.strftime('%Y-%m'), status)
+        t = totals.setdefault(key, [0.0, 0])
+        t[0] += amount or 0.0
+        t[1] += 1
+
+    SpendTotal.query.delete()
+    db.session.bulk_insert_mappings(SpendTotal, [
+        {'requestor_email': k[0], 'category': k[1], 'month': k[2], 'status': k[3], 'total': v[0], 'count': v[1]}
+        for k, v in totals.items()
+    ])
+    db.session.commit()
+    return seen
+
+
+@click.group('spend')
+def spend_cli():
+    """Spend aggregate commands."""
+
+
+@spend_cli.command('rebuild')
+@click.option('--batch-size', type=int, default=1000)
+def rebuild_command(batch_size):
+    n = rebuild(batch_size)
+    click.echo(f"Rebuilt spend totals from {n} approvals")
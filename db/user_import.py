@@ -0,0 +1,234 @@
+"""Bulk user import for onboarding.
+
+Accepts CSV (header row) or JSON (a list of objects) with the fields
+`email`, `username`, optional `role` (Employee/Manager), optional
+`manager_email` or `manager_id`, and optional `password` (defaults to the
+same temporary password `admin_create_user` uses). Managers may be defined
+in the same file as their reports.
+
+Validation is set-based (one IN query per chunk for existing emails and for
+manager references), passwords are hashed in a process pool, and rows are
+inserted in batched transactions. Each batch is added to the search index
+and the org hierarchy in the same transaction, so an interrupted import
+never leaves users that search or the org tree can't see. Every input row
+gets an entry in the returned report.
+
+    flask --app main users import people.csv
+"""
+from . import db
+from sqlalchemy.exc import IntegrityError
+import csv
+import io
+import json
+import re
+import click
+
+DEFAULT_PASSWORD = 'employee'
+_EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+_CHUNK = 500
+
+
+def parse_rows(data: str, fmt: str) -> list:
+    """Parse CSV or JSON text into a list of dicts. Raises ValueError on bad input."""
+    if fmt == 'json':
+        rows = json.loads(data)
+        if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+            raise ValueError('JSON import must be a list of objects')
+        return rows
+    if fmt == 'csv':
+        return [dict(r) for r in csv.DictReader(io.StringIO(data))]
+    raise ValueError(f'unsupported import format: {fmt}')
+
+
+def _chunks(items, size=_CHUNK):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _existing(column, values) -> set:
+    found = set()
+    for chunk in _chunks(values):
+        found.update(v for (v,) in db.session.query(column).filter(column.in_(chunk)).all())
+    return found
+
+
+def _index(emails: list) -> None:
+    """Add just-inserted users to the search index and org hierarchy. Caller commits.
+
+    Core inserts skip the ORM events that normally maintain both.
+    """
+    from db import org, user_search
+    from db.users import User
+    pairs = [tuple(r) for r in db.session.query(User.id, User.manager_id).filter(User.email.in_(emails)).all()]
+    user_search.index_users(uid for uid, _ in pairs)
+    org.add_users(db.session.connection(), pairs)
+
+
+def _insert(rows: list, report: list, batch_size: int) -> None:
+    """Insert prepared row dicts batch by batch; isolate failures to single rows."""
+    from db.users import User
+    table = User.__table__
+    for batch in _chunks(rows, batch_size):
+        values = [r['values'] for r in batch]
+        try:
+            db.session.execute(table.insert(), values)
+            _index([v['email'] for v in values])
+            db.session.commit()
+            for r in batch:
+                report[r['index']].update(ok=True, error=None)
+        except IntegrityError:
+            db.session.rollback()
+            # e.g. a concurrent insert took an email; retry row by row to find it
+            for r in batch:
+                try:
+                    db.session.execute(table.insert(), [r['values']])
+                    _index([r['values']['email']])
+                    db.session.commit()
+                    report[r['index']].update(ok=True, error=None)
+                except IntegrityError:
+                    db.session.rollback()
+                    report[r['index']].update(ok=False, error='email already taken')
+
+
+def import_users(rows: list, default_password: str = DEFAULT_PASSWORD, workers: int = None, batch_size: int = _CHUNK) -> list:
+    """Validate and create users in bulk. Returns one report entry per input row."""
+    from db.users import User
+    from utils.passwords import hash_passwords
+
+    report = []
+    candidates = []
+    seen = set()
+    for i, raw in enumerate(rows):
+        raw = {str(k).strip().lower(): v for k, v in (raw or {}).items() if k is not None}
+        email = str(raw.get('email') or '').strip()
+        username = str(raw.get('username') or '').strip()
+        role = str(raw.get('role') or 'Employee').strip().capitalize()
+        entry = {'row': i + 1, 'email': email, 'ok': False, 'error': None}
+        report.append(entry)
+        if not email or not _EMAIL_RE.match(email) or len(email) > 100:
+            entry['error'] = 'invalid email'
+        elif not username or len(username) > 50:
+            entry['error'] = 'username is required (max 50 characters)'
+        elif role not in ('Employee', 'Manager'):
+            entry['error'] = 'role must be Employee or Manager'
+        elif email.lower() in seen:
+            entry['error'] = 'duplicate email in import'
+        if entry['error']:
+            continue
+        seen.add(email.lower())
+        manager_id = raw.get('manager_id')
+        try:
+            manager_id = int(manager_id) if manager_id not in (None, '') else None
+        except (TypeError, ValueError):
+            entry['error'] = 'invalid manager_id'
+            continue
+        candidates.append({
+            'index': i,
+            'email': email,
+            'username': username,
+            'role': role,
+            'manager_email': str(raw.get('manager_email') or '').strip() or None,
+            'manager_id': manager_id,
+            'password': str(raw.get('password') or '') or default_password,
+        })
+
+    # set-based checks against the existing tables
+    taken = _existing(User.email, [c['email'] for c in candidates])
+    ref_emails = {c['manager_email'] for c in candidates if c['manager_email']}
+    ref_ids = {c['manager_id'] for c in candidates if c['manager_id']}
+    manager_by_email = {}
+    for chunk in _chunks(ref_emails):
+        manager_by_email.update(db.session.query(User.email, User.id).filter(User.email.in_(chunk), User.role == 'Manager').all())
+    manager_ids = set()
+    for chunk in _chunks(ref_ids):
+        manager_ids.update(i for (i,) in db.session.query(User.id).filter(User.id.in_(chunk), User.role == 'Manager').all())
+    new_managers = {c['email'] for c in candidates if c['role'] == 'Manager' and c['email'] not in taken}
+
+    valid = []
+    for c in candidates:
+        entry = report[c['index']]
+        if c['email'] in taken:
+            entry['error'] = 'email already taken'
+        elif c['manager_email'] and c['manager_email'] not in manager_by_email and c['manager_email'] not in new_managers:
+            entry['error'] = 'manager not found'
+        elif c['manager_id'] and c['manager_id'] not in manager_ids:
+            entry['error'] = 'manager not found'
+        else:
+            valid.append(c)
+
+    hashes = hash_passwords([c['password'] for c in valid], workers=workers)
+    for c, h in zip(valid, hashes):
+        c['values'] = {'email': c['email'], 'username': c['username'], 'password': h, 'role': c['role'], 'manager_id': c['manager_id']}
+
+    # managers first, so reports in the same file can point at them
+    _insert([c for c in valid if c['role'] == 'Manager'], report, batch_size)
+    pending_refs = {c['manager_email'] for c in valid if c['manager_email'] and c['manager_email'] not in manager_by_email}
+    for chunk in _chunks(pending_refs):
+        manager_by_email.update(db.session.query(User.email, User.id).filter(User.email.in_(chunk), User.role == 'Manager').all())
+    rest = []
+    for c in valid:
+        if c['role'] == 'Manager':
+            continue
+        if c['manager_email']:
+            if c['manager_email'] not in manager_by_email:
+                report[c['index']]['error'] = 'manager not found'
+                continue
+            c['values']['manager_id'] = manager_by_email[c['manager_email']]
+        rest.append(c)
+    _insert(rest, report, batch_size)
+    # managers that reference other managers are linked after everyone exists,
+    # each together with its move in the org hierarchy
+    from db import org
+    for c in valid:
+        if c['role'] == 'Manager' and c['manager_email'] and report[c['index']]['ok']:
+            mgr = manager_by_email.get(c['manager_email'])
+            if mgr:
+                uid = db.session.query(User.id).filter_by(email=c['email']).scalar()
+                try:
+                    User.query.filter_by(id=uid).update({User.manager_id: mgr}, synchronize_session=False)
+                    org.move_user(db.session.connection(), uid, mgr)
+                    db.session.commit()
+                except org.OrgCycleError:
+                    # the user is created, just without a manager
+                    db.session.rollback()
+                    report[c['index']]['error'] = 'manager reports to this user; left without a manager'
+    return report
+
+
+@click.group('users')
+def users_cli():
+    """User administration commands."""
+
+
+@users_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'json']), default=None, help='Defaults to the file extension.')
+@click.option('--workers', type=int, default=None, help='Password hashing processes (default: CPU count).')
+@click.option('--default-password', default=DEFAULT_PASSWORD, show_default=True)
+def import_command(path, fmt, workers, default_password):
+    fmt = fmt or ('json' if path.lower().endswith('.json') else 'csv')
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        rows = parse_rows(f.read(), fmt)
+    report = import_users(rows, default_password=default_password, workers=workers)
+    created = sum(1 for r in report if r['ok'])
+    for r in report:
+        if not r['ok']:
+            click.echo(f"row {r['row']} ({r['email'] or '-'}): {r['error']}")
+    click.echo(f"Created {created} of {len(report)} users")
+
+
+@users_cli.command('org-rebuild')
+def org_rebuild_command():
+    """Recompute the org hierarchy index from users.manager_id."""
+    from db import org
+    n = org.rebuild()
+    click.echo(f"Wrote {n} org hierarchy rows")
+
+
+@users_cli.command('reindex')
+def reindex_command():
+    """Rebuild the user search index."""
+    from db import user_search
+    n = user_search.rebuild()
+    click.echo(f"Indexed {n} users ({user_search.backend()})")
@@ -0,0 +1,240 @@
+"""Indexed substring search over users (email and username).
+
+Two backends, chosen by what migration 10 could create:
+  * SQLite with FTS5: an external-content `users_fts` table using the trigram
+    tokenizer, kept in sync by triggers on `users`.
+  * anything else: `user_search_grams`, one (trigram, user_id) row per distinct
+    trigram of the lowercased email and username. The rows are maintained by
+    mapper events on User and by `index_users` after Core bulk inserts.
+
+Both produce at most CANDIDATES ids from the index, in no useful order, so
+exact and prefix hits are first read separately from the lower(email) and
+lower(username) indexes (in key order, so the exact match comes first) and
+merged in. A common term can't push its best matches out of the candidate
+set. The final order is computed on the candidates only: exact match, then
+prefix, then word prefix, then substring, with shorter usernames first.
+Terms shorter than three characters can't use trigrams and use only the
+prefix lookup.
+
+    flask --app main users reindex   # rebuild the index from the users table
+"""
+from . import db
+from sqlalchemy import event, inspect, text
+import re
+
+CANDIDATES = 200
+FTS_TABLE = 'users_fts'
+_WORD_SPLIT = re.compile(r'[\s._@+-]+')
+
+
+class UserSearchGram(db.Model):
+    __tablename__ = 'user_search_grams'
+
+    gram = db.Column(db.String(3), primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True, index=True)
+
+
+def trigrams(*values) -> set:
+    grams = set()
+    for v in values:
+        v = (v or '').lower()
+        grams.update(v[i:i + 3] for i in range(len(v) - 2))
+    return grams
+
+
+_backend = None
+
+
+def backend(conn=None) -> str:
+    """'fts5' or 'grams' for the current database (checked once per process)."""
+    global _backend
+    if _backend is None:
+        _backend = 'fts5' if inspect(conn if conn is not None else db.engine).has_table(FTS_TABLE) else 'grams'
+    return _backend
+
+
+# -----------------------
+# Index maintenance
+# -----------------------
+
+def create_fts(conn) -> bool:
+    """Create the FTS5 table and its triggers on SQLite. False if unavailable."""
+    global _backend
+    from sqlalchemy.exc import OperationalError
+    if conn.dialect.name != 'sqlite':
+        return False
+    try:
+        conn.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "email, username, content='users', content_rowid='id', tokenize='trigram')"
+        )
+    except OperationalError:
+        # SQLite built without FTS5 (or older than 3.34, which added trigram)
+        return False
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, email, username) VALUES (new.id, new.email, new.username); END"
+    )
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, email, username) VALUES ('delete', old.id, old.email, old.username); END"
+    )
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF email, username ON users BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, email, username) VALUES ('delete', old.id, old.email, old.username); "
+        f"INSERT INTO {FTS_TABLE}(rowid, email, username) VALUES (new.id, new.email, new.username); END"
+    )
+    conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    _backend = 'fts5'
+    return True
+
+
+def _write_grams(conn, rows) -> None:
+    """Replace the grams of (user_id, email, username) rows on `conn`."""
+    table = UserSearchGram.__table__
+    rows = list(rows)
+    if not rows:
+        return
+    conn.execute(table.delete().where(table.c.user_id.in_([r[0] for r in rows])))
+    values = [{'gram': g, 'user_id': uid} for uid, email, username in rows for g in trigrams(email, username)]
+    if values:
+        conn.execute(table.insert(), values)
+
+
+def index_users(ids) -> None:
+    """Index users inserted without the ORM (e.g. bulk import). Caller commits."""
+    if backend() != 'grams':
+        return
+    from db.users import User
+    ids = list(ids)
+    for i in range(0, len(ids), 500):
+        rows = db.session.query(User.id, User.email, User.username).filter(User.id.in_(ids[i:i + 500])).all()
+        _write_grams(db.session.connection(), rows)
+
+
+def backfill_grams(conn, batch_size: int = 1000) -> None:
+    """Index every user into `user_search_grams` on `conn` (used by migrations)."""
+    from db.users import User
+    t = User.__table__
+    last = 0
+    while True:
+        rows = conn.execute(db.select(t.c.id, t.c.email, t.c.username).where(t.c.id > last).order_by(t.c.id).limit(batch_size)).all()
+        if not rows:
+            return
+        _write_grams(conn, [tuple(r) for r in rows])
+        last = rows[-1][0]
+
+
+def rebuild(batch_size: int = 1000) -> int:
+    """Rebuild the whole index from `users`. Returns the number of users indexed."""
+    from db.users import User
+    n = db.session.query(db.func.count(User.id)).scalar() or 0
+    if backend() == 'fts5':
+        db.session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    else:
+        conn = db.session.connection()
+        conn.execute(UserSearchGram.__table__.delete())
+        batch = []
+        for row in db.session.query(User.id, User.email, User.username).execution_options(yield_per=batch_size):
+            batch.append(tuple(row))
+            if len(batch) >= batch_size:
+                _write_grams(conn, batch)
+                batch = []
+        _write_grams(conn, batch)
+    db.session.commit()
+    return n
+
+
+def register_events(User):
+    """Keep the gram index in step with ORM writes to `User` (called by db/users.py)."""
+
+    @event.listens_for(User, 'after_insert')
+    @event.listens_for(User, 'after_update')
+    def _index_user(mapper, connection, target):
+        if backend(connection) == 'grams':
+            _write_grams(connection, [(target.id, target.email, target.username)])
+
+    @event.listens_for(User, 'after_delete')
+    def _unindex_user(mapper, connection, target):
+        if backend(connection) == 'grams':
+            table = UserSearchGram.__table__
+            connection.execute(table.delete().where(table.c.user_id == target.id))
+
+
+# -----------------------
+# Search
+# -----------------------
+
+def _fts_query(term: str) -> str:
+    # one quoted phrase: trigram FTS matches it as a substring
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _prefix_ids(term: str, role: str = None) -> list:
+    """Ids whose lowercased email or username starts with `term`, shortest keys first.
+
+    A range scan on the lower() indexes: [term, term with its last character
+    bumped) covers exactly the strings with that prefix.
+    """
+    from db.users import User
+    upper = term[:-1] + chr(ord(term[-1]) + 1)
+    ids = []
+    for col in (db.func.lower(User.email), db.func.lower(User.username)):
+        q = db.session.query(User.id).filter(col >= term, col < upper)
+        if role:
+            q = q.filter(User.role == role)
+        ids.extend(i for (i,) in q.order_by(col).limit(CANDIDATES).all())
+    return list(dict.fromkeys(ids))
+
+
+def _candidate_ids(term: str, role: str = None) -> list:
+    from db.users import User
+    prefix = _prefix_ids(term, role)
+    if len(term) < 3:
+        return prefix
+    if backend() == 'fts5':
+        sql = f"SELECT {FTS_TABLE}.rowid FROM {FTS_TABLE}"
+        params = {'q': _fts_query(term), 'n': CANDIDATES}
+        if role:
+            sql += f" JOIN users u ON u.id = {FTS_TABLE}.rowid"
+        sql += f" WHERE {FTS_TABLE} MATCH :q"
+        if role:
+            sql += " AND u.role = :role"
+            params['role'] = role
+        sql += f" ORDER BY bm25({FTS_TABLE}) LIMIT :n"
+        return list(dict.fromkeys(prefix + [i for (i,) in db.session.execute(text(sql), params)]))
+    grams = trigrams(term)
+    q = db.session.query(UserSearchGram.user_id).filter(UserSearchGram.gram.in_(grams))
+    if role:
+        q = q.join(User, User.id == UserSearchGram.user_id).filter(User.role == role)
+    q = q.group_by(UserSearchGram.user_id).having(db.func.count() == len(grams))
+    return list(dict.fromkeys(prefix + [i for (i,) in q.limit(CANDIDATES).all()]))
+
+
+def _rank(term: str, u):
+    email, username = (u.email or '').lower(), (u.username or '').lower()
+    if term in (email, username):
+        tier = 0
+    elif email.startswith(term) or username.startswith(term):
+        tier = 1
+    elif any(w.startswith(term) for w in _WORD_SPLIT.split(username) + _WORD_SPLIT.split(email)):
+        tier = 2
+    else:
+        tier = 3
+    return (tier, len(username), username, u.id)
+
+
+def search_users(term: str, limit: int = 10, role: str = None) -> list:
+    """Users whose email or username contains `term`, best matches first."""
+    from db.users import User
+    term = (term or '').strip().lower()
+    if not term:
+        return []
+    ids = _candidate_ids(term, role)
+    if not ids:
+        return []
+    rows = User.query.filter(User.id.in_(ids)).all()
+    # trigram candidates can be false positives; FTS may match across columns
+    rows = [u for u in rows if term in (u.email or '').lower() or term in (u.username or '').lower()]
+    rows.sort(key=lambda u: _rank(term, u))
+    return rows[:limit]
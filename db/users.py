@@ -1,5 +1,6 @@
 from . import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event
+from utils.passwords import hash_password, verify_password as _verify_hash, needs_rehash
 from utils.tokens import generate_random_tokens
 
 class User(db.Model):
@@ -12,7 +13,13 @@ class User(db.Model):
     session_token = db.Column(db.String(64), nullable=True)
     # Role: Employee or Manager
     role = db.Column(db.String(20), nullable=False, default='Employee')
-    manager_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    manager_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
+
+    __table_args__ = (
+        # case-insensitive prefix lookups for user search (db/user_search.py)
+        db.Index('ix_users_email_lower', db.func.lower(email)),
+        db.Index('ix_users_username_lower', db.func.lower(username)),
+    )
 
     def __repr__(self):
         return f"<User {self.username}>"
@@ -34,11 +41,50 @@ def create_user_record(email: str, username: str, password_hash: str, role: str
     db.session.commit()
     return user
 
+def set_manager(user_id: int, manager_id: int = None) -> User:
+    """Change a user's manager and move their pending approvals to the new inbox.
+
+    Raises org.OrgCycleError if `manager_id` is the user or reports to them.
+    """
+    from db import approvals, org
+    user = db.session.get(User, user_id)
+    if not user:
+        return None
+    if manager_id is not None and (manager_id == user_id or org.is_in_subtree(user_id, manager_id)):
+        raise org.OrgCycleError(f'user {manager_id} reports to user {user_id}')
+    user.manager_id = manager_id
+    approvals.reassign_pending([user.id], manager_id)
+    db.session.commit()
+    return user
+
+
+def check_user_password(user: User, password: str) -> bool:
+    """Verify a user's password, upgrading the stored hash if the hash method changed.
+
+    The upgrade is committed by the caller (login commits the new session).
+    """
+    if not _verify_hash(user.password, password):
+        return False
+    if needs_rehash(user.password):
+        user.password = hash_password(password)
+    return True
+
+
+def get_manager_names(user_ids: list) -> dict:
+    """{user_id: manager username} for the given users, in one self-join query."""
+    if not user_ids:
+        return {}
+    from sqlalchemy.orm import aliased
+    mgr = aliased(User)
+    rows = db.session.query(User.id, mgr.username).join(mgr, mgr.id == User.manager_id).filter(User.id.in_(user_ids)).all()
+    return dict(rows)
+
+
 def verify_password(email: str, password: str) -> bool:
     user = User.query.filter_by(email=email).first()
     if not user:
         return False
-    return check_password_hash(user.password, password)
+    return check_user_password(user, password)
 
 def is_email_already_taken(email: str) -> bool:
     return User.query.filter_by(email=email).first() is not None
@@ -46,8 +92,10 @@ def is_email_already_taken(email: str) -> bool:
 def update_session_token(email: str) -> None:
     user = User.query.filter_by(email=email).first()
     if user:
+        from db import sessions
         token = generate_random_tokens(32)
         user.session_token = token
+        sessions.start_session(sessions.PRINCIPAL_USER, user.id, token)
         db.session.commit()
         return token
 
@@ -56,7 +104,8 @@ def get_user_by_email(email: str) -> User:
 
 
 def get_users(search: str = None, limit: int = 100):
-    """Return a list of users. If `search` is provided, filter by email or username (case-insensitive).
+    """Return a list of users. If `search` is provided, match it as a substring of
+    email or username through the search index (db/user_search.py), best matches first.
 
     Args:
         search: optional search string to match against email or username
@@ -65,13 +114,22 @@ def get_users(search: str = None, limit: int = 100):
     Returns:
         List[User]
     """
-    query = User.query
-    if search:
-        like = f"%{search}%"
-        # Use ilike for case-insensitive search when supported
-        try:
-            query = query.filter((User.email.ilike(like)) | (User.username.ilike(like)))
-        except Exception:
-            # Fallback to case-sensitive contains if ilike not supported
-            query = query.filter((User.email.contains(search)) | (User.username.contains(search)))
-    return query.limit(limit).all()
+    if search and search.strip():
+        from db import user_search
+        return user_search.search_users(search, limit=limit)
+    return User.query.order_by(User.id.asc()).limit(limit).all()
+
+
+# keep the search index and org hierarchy in step with ORM writes
+# (see db/user_search.py and db/org.py)
+from db import org as _org  # noqa: E402
+from db import user_search as _user_search  # noqa: E402
+_user_search.register_events(User)
+_org.register_events(User)
+
+
+@event.listens_for(User, 'before_delete')
+def _detach_approvals(mapper, connection, target):
+    # SQLite doesn't enforce ON DELETE SET NULL unless foreign keys are enabled
+    from db import approvals
+    approvals.detach_user(connection, target.id)
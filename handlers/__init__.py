@@ -3,4 +3,5 @@ from flask import Blueprint
 auth_bp = Blueprint('auth', __name__)
 admin_bp = Blueprint('admin', __name__)
 manager_bp = Blueprint('manager', __name__)
-employee_bp = Blueprint('employee', __name__)
\ No newline at end of file
+employee_bp = Blueprint('employee', __name__)
+events_bp = Blueprint('events', __name__)
\ No newline at end of file
@@ -5,6 +5,7 @@ from db import admins as admins
 from werkzeug.security import generate_password_hash, check_password_hash
 from handlers import auth_bp
 from handlers.auth_utils import require_role
+from handlers.caching import conditional
 
 
 @admin_bp.route('/admin/overview')
@@ -32,13 +33,11 @@ def admin_users():
         # limit parameter optional
         limit = request.args.get('limit', default=100, type=int)
         user_objs = users.get_users(search=q, limit=limit)
+        # resolve every listed user's manager name with one query
+        manager_names = users.get_manager_names([u.id for u in user_objs])
         users_list = []
         for u in user_objs:
-            manager_name = None
-            if getattr(u, 'manager_id', None):
-                mgr = users.User.query.get(u.manager_id)
-                manager_name = mgr.username if mgr else None
-            users_list.append({'id': u.id, 'username': u.username, 'email': u.email, 'role': u.role, 'manager': manager_name})
+            users_list.append({'id': u.id, 'username': u.username, 'email': u.email, 'role': u.role, 'manager': manager_names.get(u.id)})
         # Render dashboard.html (available) and provide users in context for the template to use
         # Also provide a list of managers for the "Create User" modal
         manager_objs = users.User.query.filter_by(role='Manager').all()
@@ -49,6 +48,19 @@ def admin_users():
         return "An error occurred while fetching users.", 500
 
 
+@admin_bp.route('/admin/api/users/search', methods=['GET'])
+@require_role('Admin')
+def admin_search_users():
+    """Typeahead: ?q=term&limit=10&role=Manager -> best-ranked matching users."""
+    from flask import jsonify
+    from db import user_search
+    q = request.args.get('q', default='', type=str)
+    limit = max(1, min(request.args.get('limit', default=10, type=int), 50))
+    role = request.args.get('role') or None
+    found = user_search.search_users(q, limit=limit, role=role)
+    return jsonify({'ok': True, 'users': [{'id': u.id, 'username': u.username, 'email': u.email, 'role': u.role} for u in found]})
+
+
 @admin_bp.route('/admin/approval-rules', methods=['GET'])
 @require_role('Admin')
 def admin_approval_rules():
@@ -71,22 +83,74 @@ def admin_approval_rules():
 
 @admin_bp.route('/admin/expenses', methods=['GET'])
 @require_role('Admin')
+@conditional('admin-expenses')
 def admin_expenses():
     try:
-        # fetch all approvals/expenses
+        # fetch one page of approvals/expenses, newest first
+        cursor = request.args.get('cursor')
+        limit = request.args.get('limit', default=100, type=int)
         items = []
+        next_cursor = prev_cursor = None
         try:
             from db import approvals
-            items = [a.to_dict() for a in approvals.list_approvals(limit=500)]
+            page = approvals.list_approvals(limit=limit, cursor=cursor)
+            items = [a.to_dict() for a in page]
+            next_cursor, prev_cursor = page.next_cursor, page.prev_cursor
+        except ValueError:
+            return "Invalid cursor", 400
         except Exception:
             items = []
 
-        return render_template('admin_expense.html', approvals=items, current_user_name='Admin', current_user_role='Admin')
+        return render_template('admin_expense.html', approvals=items, next_cursor=next_cursor, prev_cursor=prev_cursor, current_user_name='Admin', current_user_role='Admin')
     except Exception as e:
         print(f"Error fetching expenses: {e}")
         return "Error", 500
 
 
+@admin_bp.route('/admin/api/spend-summary', methods=['GET'])
+@require_role('Admin')
+def admin_spend_summary():
+    """Company-wide spend totals from the maintained aggregates (?by=status|category|month|requestor_email&month=YYYY-MM)."""
+    from flask import jsonify
+    from db import spend
+    from db.admins import get_company_currency
+    by = request.args.get('by', default='status')
+    month = request.args.get('month')
+    status = request.args.get('status')
+    try:
+        rows = spend.summarize(by, month=month, status=status)
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    return jsonify({'ok': True, 'currency': get_company_currency(), 'by': by, 'month': month, 'totals': rows})
+
+
+@admin_bp.route('/admin/api/approvals/export', methods=['GET'])
+@require_role('Admin')
+def admin_export_approvals():
+    """Stream approvals as CSV or JSON Lines (?format=csv|jsonl&status=&requestor=&from=YYYY-MM-DD&to=YYYY-MM-DD)."""
+    from datetime import datetime
+    from flask import jsonify, Response, stream_with_context
+    from db import export
+    fmt = request.args.get('format', default='csv')
+    try:
+        chunks = export.stream_export(
+            fmt,
+            status=request.args.get('status') or None,
+            requestor_email=request.args.get('requestor') or None,
+            date_from=export.parse_date(request.args.get('from')),
+            date_to=export.parse_date(request.args.get('to')),
+        )
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f"approvals-{datetime.utcnow():%Y%m%d}.{fmt}"
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        # keep reverse proxies from buffering the whole export
+        'X-Accel-Buffering': 'no',
+    })
+
+
 @admin_bp.route('/admin/approval-rules', methods=['POST'])
 def admin_approval_rules_create():
     # Handle form submission from admin_approve.html to create a new rule
@@ -124,6 +188,7 @@ def admin_approval_rules_create():
 @require_role('Admin')
 def admin_override_expense(aid: int):
     # Admin override: set approval status directly from admin UI
+    from db import approvals as approvals_mod
     try:
         action = request.form.get('action')
         approver_email = request.form.get('approver_email') or 'admin@company'
@@ -131,11 +196,12 @@ def admin_override_expense(aid: int):
         if action not in ('approve', 'reject'):
             return "Invalid action", 400
         status = 'Approved' if action == 'approve' else 'Rejected'
-        from db import approvals as approvals_mod
         a = approvals_mod.set_approval_status(aid, approver_email=approver_email, status=status, comments=comments)
         if not a:
             return "Not found", 404
         return redirect(url_for('admin.admin_expenses'))
+    except approvals_mod.VersionConflict:
+        return "This expense was just updated by someone else", 409
     except Exception as e:
         print(f"Error overriding expense: {e}")
         return "Error", 500
@@ -150,21 +216,23 @@ def admin_send_password(uid: int):
             return "User not found", 404
         # Generate a temporary password and email it
         from utils.tokens import generate_random_tokens
-        from utils.mailer import send_email
-        from werkzeug.security import generate_password_hash
+        from db.outbox import enqueue_email
+        from utils.passwords import hash_password
 
         temp_password = generate_random_tokens(10)
         # store hashed password
-        user.password = generate_password_hash(temp_password)
-        from db import db as _db
-        _db.session.commit()
+        user.password = hash_password(temp_password)
 
         subject = "Your temporary password"
         body = f"Hello {user.username},\n\nAn admin has reset your password. Your temporary password is:\n\n{temp_password}\n\nPlease login and change your password immediately using the 'Forgot Password' flow if needed.\n\nThanks."
 
-        sent = send_email(user.email, subject, body)
-        if not sent:
-            print("Email not sent; SMTP not configured or error occurred. Temporary password:", temp_password)
+        # queued in the same transaction as the password change; the outbox
+        # worker delivers it
+        queued = enqueue_email(user.email, subject, body, commit=False)
+        from db import db as _db
+        _db.session.commit()
+        if not queued:
+            print("Email not queued; SMTP not configured. Temporary password:", temp_password)
 
         return redirect(url_for('admin.admin_users'))
     except Exception as e:
@@ -179,6 +247,8 @@ def admin_delete_user(uid: int):
         if not user:
             return "User not found", 404
         from db import db as _db
+        from db import sessions
+        sessions.revoke_principal(sessions.PRINCIPAL_USER, user.id)
         _db.session.delete(user)
         _db.session.commit()
         return redirect(url_for('admin.admin_users'))
@@ -188,6 +258,29 @@ def admin_delete_user(uid: int):
 
 
 
+@admin_bp.route('/admin/users/<int:uid>/manager', methods=['POST'])
+@require_role('Admin')
+def admin_set_manager(uid: int):
+    """Reassign a user's manager (form field `manager_id`, empty for none)."""
+    from db.org import OrgCycleError
+    manager_id = request.form.get('manager_id')
+    try:
+        manager_id = int(manager_id) if manager_id else None
+    except ValueError:
+        return "Invalid manager id", 400
+    if manager_id is not None:
+        mgr = users.User.query.get(manager_id)
+        if not mgr or mgr.role != 'Manager':
+            return "Selected manager is invalid", 400
+    try:
+        user = users.set_manager(uid, manager_id)
+    except OrgCycleError:
+        return "A user cannot report to someone in their own team", 400
+    if not user:
+        return "User not found", 404
+    return redirect(url_for('admin.admin_users'))
+
+
 @admin_bp.route('/admin/users/create', methods=['POST'])
 @require_role('Admin')
 def admin_create_user():
@@ -229,9 +322,9 @@ def admin_create_user():
 
         # Generate a temporary password for the new user and store its hash
         from utils.tokens import generate_random_tokens
-        from werkzeug.security import generate_password_hash
+        from utils.passwords import hash_password
         temp_password = "employee"
-        password_hash = generate_password_hash(temp_password)
+        password_hash = hash_password(temp_password)
 
         # Create the user record
         users.create_user_record(email=email, username=username, password_hash=password_hash, role=role, manager_id=mgr_id)
@@ -242,4 +335,34 @@ def admin_create_user():
         return redirect(url_for('admin.admin_users'))
     except Exception as e:
         print(f"Error creating user: {e}")
-        return "Error", 500
\ No newline at end of file
+        return "Error", 500
+
+
+@admin_bp.route('/admin/users/import', methods=['POST'])
+@require_role('Admin')
+def admin_import_users():
+    """Bulk-create users from an uploaded CSV/JSON file (field `file`) or a JSON body.
+
+    Returns a per-row report: [{'row', 'email', 'ok', 'error'}].
+    """
+    from flask import jsonify
+    from db import user_import
+    try:
+        upload = request.files.get('file')
+        if upload and upload.filename:
+            fmt = 'json' if upload.filename.lower().endswith('.json') else 'csv'
+            rows = user_import.parse_rows(upload.read().decode('utf-8-sig'), fmt)
+        elif request.is_json:
+            rows = request.get_json(silent=True)
+            if not isinstance(rows, list):
+                return jsonify({'ok': False, 'error': 'expected a JSON list of users'}), 400
+        else:
+            return jsonify({'ok': False, 'error': 'upload a CSV/JSON file or send a JSON list'}), 400
+        report = user_import.import_users(rows)
+        created = sum(1 for r in report if r['ok'])
+        return jsonify({'ok': True, 'created': created, 'failed': len(report) - created, 'report': report})
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error importing users: {e}")
+        return "Error", 500
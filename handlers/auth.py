@@ -2,12 +2,11 @@ from . import auth_bp
 from flask import request, render_template, redirect, url_for, make_response
 from db import users
 from db import admins as admins
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask import redirect
 from utils.currency import get_all_countries
-from utils.mailer import send_email
+from db.outbox import enqueue_email
 from utils.tokens import generate_random_tokens
-from werkzeug.security import generate_password_hash
+from utils.passwords import hash_password, VerifierBusy
 
 # 🟢 Register Route
 @auth_bp.route("/", methods=["GET"])
@@ -32,10 +31,7 @@ def register():
     if users.is_email_already_taken(email):
         return render_template("register.html", error_msg="⚠️ Email already registered", hide_navbar=True)
 
-    # Hash password
-    hashed_password = generate_password_hash(password)
-
-    # Create an Admin account on registration
+    # Create an Admin account (create_admin hashes the password) on registration
     admins.create_admin(name=username, email=email, password=password)
 
     # Redirect to login after successful register
@@ -55,6 +51,14 @@ def login():
     if not email or not password:
         return render_template("login.html", error_msg="⚠️ All fields are required", hide_navbar=True)
 
+    try:
+        return _login(email, password)
+    except VerifierBusy:
+        # too many logins are hashing at once; ask the client to retry
+        return render_template("login.html", error_msg="⏳ Too many sign-ins right now, please try again", hide_navbar=True), 503, {'Retry-After': '1'}
+
+
+def _login(email: str, password: str):
     # First, check if this is an admin
     admin = admins.get_admin_by_email(email)
     if admin and admin.check_password(password):
@@ -68,7 +72,7 @@ def login():
 
     # Not an admin — check users table
     user = users.get_user_by_email(email)
-    if not user or not check_password_hash(user.password, password):
+    if not user or not users.check_user_password(user, password):
         return render_template("login.html", error_msg="❌ Invalid credentials", hide_navbar=True)
 
     # Update user session token
@@ -93,18 +97,19 @@ def logout():
     # Clear server-side token for the logged-in user (if cookie present)
     token = request.cookies.get('session_token')
     if token:
-        # try to find a user with this token
-        u = users.User.query.filter_by(session_token=token).first()
-        if u:
-            u.session_token = None
-            from db import db as _db
-            _db.session.commit()
-        # also try admins
-        from db import admins as admins_mod
-        a = admins_mod.Admin.query.filter_by(session_token=token).first()
-        if a:
-            a.session_token = None
-            from db import db as _db
+        from db import db as _db
+        from db import sessions
+        s = sessions.end_session(token)
+        if s:
+            # keep the legacy per-row token columns in sync with the store
+            if s.principal_type == sessions.PRINCIPAL_USER:
+                u = _db.session.get(users.User, s.principal_id)
+                if u and u.session_token == token:
+                    u.session_token = None
+            else:
+                a = _db.session.get(admins.Admin, s.principal_id)
+                if a and a.session_token == token:
+                    a.session_token = None
             _db.session.commit()
 
     res = make_response(redirect(url_for('auth.login')))
@@ -128,11 +133,12 @@ def forgot_password():
         if admin:
             temp_password = generate_random_tokens(10)
             admin.set_password(temp_password)
-            from db import db as _db
-            _db.session.commit()
             subject = 'Your temporary admin password'
             body = f'Hello {admin.name},\n\nA temporary password has been generated for you:\n\n{temp_password}\n\nPlease login and change it immediately.'
-            send_email(admin.email, subject, body)
+            # queued in the same transaction as the password change
+            enqueue_email(admin.email, subject, body, commit=False)
+            from db import db as _db
+            _db.session.commit()
             return render_template('forgot_password.html', success_msg='If an account exists, a temporary password was emailed.')
     except Exception:
         pass
@@ -142,12 +148,13 @@ def forgot_password():
         user = users.get_user_by_email(email)
         if user:
             temp_password = generate_random_tokens(10)
-            user.password = generate_password_hash(temp_password)
-            from db import db as _db
-            _db.session.commit()
+            user.password = hash_password(temp_password)
             subject = 'Your temporary password'
             body = f'Hello {user.username},\n\nA temporary password has been generated for you:\n\n{temp_password}\n\nPlease login and change it immediately.'
-            send_email(user.email, subject, body)
+            # queued in the same transaction as the password change
+            enqueue_email(user.email, subject, body, commit=False)
+            from db import db as _db
+            _db.session.commit()
             return render_template('forgot_password.html', success_msg='If an account exists, a temporary password was emailed.')
     except Exception:
         pass
@@ -0,0 +1,78 @@
+"""Conditional GET for approval views.
+
+`conditional(scope)` answers a repeat request with `304 Not Modified` while
+the approvals change counter (db/approvals.CHANGES_COUNTER) hasn't moved.
+Views showing a single person's approvals pass `counter` to validate
+against that person's requestor or assignee counter instead.
+The check is one primary-key read. No ORM rows are built and no template is
+rendered. The ETag also covers the signed-in user, the path and query string
+and any view-specific `extra` marker, so each scope is validated separately.
+Last-Modified carries only the counter's timestamp, so it is sent, and
+If-Modified-Since honoured, only for views without an `extra` marker; the
+response also varies on the session cookie.
+
+Place the decorator below `require_role` so redirects and 403s are never
+cached.
+"""
+from datetime import datetime, timedelta
+from functools import wraps
+import hashlib
+
+from flask import g, make_response, request
+
+
+def _http_date_safe(updated_at, now):
+    # Last-Modified has one-second resolution. A change later in the same
+    # second would be missed by If-Modified-Since, so only advertise it once
+    # that second is over (the ETag still covers the gap).
+    return updated_at is not None and now - updated_at >= timedelta(seconds=1)
+
+
+def conditional(scope: str, extra=None, counter=None):
+    """Decorate a GET view with ETag / Last-Modified validation.
+
+    `extra` is an optional callable returning anything else the response
+    depends on (e.g. the exchange-rate stamp for converted amounts). Such
+    views are validated by ETag alone.
+    `counter` is an optional callable returning the name of the counter to
+    validate against (default: the global approvals counter).
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapped(*args, **kwargs):
+            from db.approvals import CHANGES_COUNTER
+            from db.counters import get_counter_state
+            # read the marker before the view queries, so a concurrent write
+            # can only make the ETag older than the body, never newer
+            name = (counter() if counter is not None else None) or CHANGES_COUNTER
+            version, updated_at = get_counter_state(name)
+            parts = [scope, name, version, getattr(g, 'current_user_role', None), getattr(g, 'current_user_id', None), request.full_path]
+            if extra is not None:
+                parts.append(extra())
+            etag = hashlib.sha1('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()[:20]
+            now = datetime.utcnow()
+            # a date can't express a change in `extra`, so those views only get an ETag
+            last_modified = updated_at if extra is None and _http_date_safe(updated_at, now) else None
+
+            def headers(res):
+                res.set_etag(etag, weak=True)
+                if last_modified is not None:
+                    res.last_modified = last_modified.replace(microsecond=0)
+                # browsers must revalidate on every poll
+                res.headers['Cache-Control'] = 'private, no-cache'
+                # another login in the same browser must not reuse this copy
+                res.vary.add('Cookie')
+                return res
+
+            if request.if_none_match:
+                fresh = request.if_none_match.contains_weak(etag)
+            else:
+                ims = request.if_modified_since
+                fresh = bool(ims and last_modified and last_modified.replace(microsecond=0) <= ims.replace(tzinfo=None))
+            if fresh:
+                return headers(make_response('', 304))
+            res = make_response(fn(*args, **kwargs))
+            # errors and redirects are never revalidated against
+            return headers(res) if res.status_code == 200 else res
+        return wrapped
+    return decorator
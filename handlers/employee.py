@@ -3,9 +3,30 @@ from flask import request, render_template, redirect, url_for, make_response
 from db import users
 from werkzeug.security import generate_password_hash, check_password_hash
 
-from flask import jsonify
+from flask import jsonify, g
 from db import approvals as approvals
+from db import idempotency
 from handlers.auth_utils import require_role
+from handlers.caching import conditional
+
+
+MAX_BATCH_SIZE = 1000
+
+
+def _parse_amount(value):
+	"""Return (amount, error). Numbers and numeric strings are accepted; None stays None."""
+	import math
+	if value is None or value == '':
+		return None, None
+	if isinstance(value, bool):
+		return None, 'amount must be a number'
+	try:
+		amount = float(value)
+	except (TypeError, ValueError):
+		return None, 'amount must be a number'
+	if not math.isfinite(amount):
+		return None, 'amount must be a number'
+	return amount, None
 
 
 @employee_bp.route('/employee/api/approvals', methods=['POST'])
@@ -17,28 +38,96 @@ def employee_api_create_approval():
 		return jsonify({'ok': False, 'error': 'requestor_email is required'}), 400
 	description = data.get('description')
 	category = data.get('category')
-	amount = data.get('amount')
+	amount, error = _parse_amount(data.get('amount'))
+	if error:
+		return jsonify({'ok': False, 'error': error}), 400
 	currency = data.get('currency')
 
+	# retries carrying the same Idempotency-Key return the original approval
+	key = request.headers.get('Idempotency-Key')
+	if key:
+		if len(key) > 100:
+			return jsonify({'ok': False, 'error': 'Idempotency-Key is too long'}), 400
+		fields = {'requestor_email': requestor_email, 'description': description, 'category': category, 'amount': amount, 'currency': currency}
+		[(aid, created)] = idempotency.create_approvals_once(g.current_user_email, [(key, fields)])
+		a = approvals.get_approval_by_id(aid)
+		return jsonify({'ok': True, 'approval': a.to_dict(), 'duplicate': not created}), 201 if created else 200
+
 	a = approvals.create_approval(requestor_email=requestor_email, description=description, category=category, amount=amount, currency=currency)
 	return jsonify({'ok': True, 'approval': a.to_dict()}), 201
 
 
+@employee_bp.route('/employee/api/approvals/batch', methods=['POST'])
+@require_role('Employee')
+def employee_api_create_approvals_batch():
+	"""Create many approvals in one transaction.
+
+	Body: {"requestor_email": default, "items": [{"idempotency_key", "requestor_email",
+	"description", "category", "amount", "currency"}, ...]}. Items whose key was
+	already used by this caller are reported as duplicates and not re-created.
+	"""
+	data = request.get_json(force=True, silent=True) or {}
+	items = data.get('items')
+	if not isinstance(items, list) or not items:
+		return jsonify({'ok': False, 'error': 'items must be a non-empty list'}), 400
+	if len(items) > MAX_BATCH_SIZE:
+		return jsonify({'ok': False, 'error': f'at most {MAX_BATCH_SIZE} items per batch'}), 400
+	default_email = data.get('requestor_email')
+
+	results = []
+	keyed = []
+	positions = []
+	for idx, item in enumerate(items):
+		result = {'index': idx, 'ok': False, 'approval_id': None, 'duplicate': False, 'error': None}
+		results.append(result)
+		if not isinstance(item, dict):
+			result['error'] = 'item must be an object'
+			continue
+		key = item.get('idempotency_key')
+		requestor_email = item.get('requestor_email') or default_email
+		amount, amount_error = _parse_amount(item.get('amount'))
+		if not isinstance(key, str) or not key or len(key) > 100:
+			result['error'] = 'idempotency_key is required (max 100 characters)'
+		elif not requestor_email:
+			result['error'] = 'requestor_email is required'
+		elif amount_error:
+			result['error'] = amount_error
+		if result['error']:
+			continue
+		keyed.append((key, {'requestor_email': requestor_email, 'description': item.get('description'), 'category': item.get('category'), 'amount': amount, 'currency': item.get('currency')}))
+		positions.append(idx)
+
+	if keyed:
+		for idx, (aid, created) in zip(positions, idempotency.create_approvals_once(g.current_user_email, keyed)):
+			results[idx].update(ok=True, approval_id=aid, duplicate=not created)
+
+	created = sum(1 for r in results if r['ok'] and not r['duplicate'])
+	duplicates = sum(1 for r in results if r['duplicate'])
+	return jsonify({'ok': True, 'created': created, 'duplicates': duplicates, 'failed': len(results) - created - duplicates, 'results': results})
+
+
 @employee_bp.route('/employee/api/approvals', methods=['GET'])
 @require_role('Employee')
 def employee_api_list_approvals():
 	return render_template('emp_submit_expense.html', current_user_name='Employee', current_user_role='Employee')
 
 
+def _own_counter():
+	# the dashboard only lists the employee's own approvals
+	user_id = getattr(g, 'current_user_id', None)
+	return approvals.requestor_counter(user_id) if user_id else None
+
+
 @employee_bp.route('/employee/dashboard')
 @require_role('Employee')
+@conditional('employee-dashboard', counter=_own_counter)
 def employee_dashboard():
-	# show employee view; accept email query param for now
+	# show the signed-in employee's own approvals
 	username = request.args.get('username')
-	email = request.args.get('email')
+	user_id = getattr(g, 'current_user_id', None)
 	approvals_list = []
-	if email:
-		items = approvals.list_approvals_by_requestor(email=email)
+	if user_id:
+		items = approvals.list_approvals_by_requestor(user_id=user_id)
 		# convert to dicts for template
 		approvals_list = [a.to_dict() for a in items]
 	return render_template('emp_view_expense.html', approvals=approvals_list, current_user_name=username or 'Employee', current_user_role='Employee')
@@ -54,6 +143,10 @@ def submit_expense():
 	or via a hidden input named `email` in the submitted form. If no email is
 	provided the handler returns the submit form with an error message.
 	"""
+	from utils import receipts
+	# reject an oversized upload from its Content-Length before the body is
+	# read; only this route takes receipts, so the cap isn't app-wide
+	request.max_content_length = receipts.MAX_BYTES + 64 * 1024
 	username = request.args.get('username') or request.form.get('username')
 	email = request.args.get('email') or request.form.get('email')
 	if not email:
@@ -63,28 +156,20 @@ def submit_expense():
 	description = request.form.get('description')
 	amount = request.form.get('amount')
 	currency = request.form.get('currency') or 'USD'
+	amount_val, error = _parse_amount(amount)
+	if error:
+		return render_template('emp_submit_expense.html', error_msg='Amount must be a number.', current_user_name=username or 'Employee', current_user_role='Employee'), 400
 
-	# handle optional receipt upload
-	receipt = None
+	# handle optional receipt upload; stored by content hash (see utils/receipts.py)
 	receipt_filename = None
 	if 'receipt' in request.files:
 		receipt = request.files.get('receipt')
 		if receipt and receipt.filename:
-			import os
-			uploads_dir = os.path.join(os.getcwd(), 'static', 'uploads')
-			os.makedirs(uploads_dir, exist_ok=True)
-			# sanitize filename lightly
-			from werkzeug.utils import secure_filename
-			fname = secure_filename(receipt.filename)
-			path = os.path.join(uploads_dir, fname)
-			receipt.save(path)
-			receipt_filename = fname
-
-	# Convert amount where possible
-	try:
-		amount_val = float(amount) if amount else None
-	except Exception:
-		amount_val = None
+			from utils.receipts import save_receipt, ReceiptError
+			try:
+				receipt_filename = save_receipt(receipt)
+			except ReceiptError as e:
+				return render_template('emp_submit_expense.html', error_msg=str(e), current_user_name=username or 'Employee', current_user_role='Employee')
 
 	a = approvals.create_approval(requestor_email=email, description=description, category=None, amount=amount_val, currency=currency, receipt_filename=receipt_filename)
 
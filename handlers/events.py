@@ -0,0 +1,107 @@
+"""Approval change feed: Server-Sent Events plus a long-poll fallback.
+
+Each signed-in user sees events for approvals they requested, are assigned
+to or decided; admins see everything. Clients resume with the standard
+`Last-Event-ID` header (EventSource sends it on reconnect) or
+`?last_event_id=`. A `reset` event means the gap can't be replayed and the
+client should refetch its listing. See db/events.py for the fan-out modes.
+"""
+from . import events_bp
+from flask import Response, current_app, g, jsonify, request
+from db import db
+from db import events
+from handlers.auth_utils import require_any_role
+import json
+import os
+import time
+
+KEEPALIVE = 15
+# streams end after this long; EventSource reconnects with Last-Event-ID
+STREAM_MAX = float(os.getenv('EVENTS_STREAM_MAX', '300'))
+POLL_MAX = 30
+
+
+def _last_event_id(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _sse(e: dict) -> str:
+    return f"id: {e['id']}\nevent: {e['type']}\ndata: {json.dumps(e)}\n\n"
+
+
+@events_bp.route('/events/approvals')
+@require_any_role('Admin', 'Manager', 'Employee')
+def approval_events_stream():
+    events.ensure_poller(current_app._get_current_object())
+    user_id, role = g.current_user_id, g.current_user_role
+    last_id = _last_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    if last_id is None:
+        backlog, complete, last_id = [], True, events.bus.last_id
+    else:
+        backlog, complete = events.replay(last_id)
+    # the stream only reads the in-process bus; don't pin a pooled connection
+    db.session.remove()
+
+    def generate():
+        cursor = last_id
+        yield "retry: 3000\n\n"
+        if not complete:
+            cursor = events.bus.last_id
+            yield f"id: {cursor}\nevent: reset\ndata: {{}}\n\n"
+        pending = backlog
+        deadline = time.monotonic() + STREAM_MAX
+        while True:
+            for e in pending:
+                cursor = e['id']
+                if events.visible_to(e, user_id, role):
+                    yield _sse(e)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            pending, ok = events.bus.wait(cursor, min(KEEPALIVE, remaining))
+            if not ok:
+                # this reader fell behind the buffer
+                cursor = events.bus.last_id
+                pending = []
+                yield f"id: {cursor}\nevent: reset\ndata: {{}}\n\n"
+            elif not pending:
+                # keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(generate(), mimetype='text/event-stream', headers=headers)
+
+
+@events_bp.route('/events/approvals/poll')
+@require_any_role('Admin', 'Manager', 'Employee')
+def approval_events_poll():
+    """Long-poll: wait up to `timeout` seconds for events after `after`."""
+    events.ensure_poller(current_app._get_current_object())
+    user_id, role = g.current_user_id, g.current_user_role
+    after = _last_event_id(request.args.get('after'))
+    try:
+        timeout = min(max(float(request.args.get('timeout', 25)), 0), POLL_MAX)
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'timeout must be a number'}), 400
+    if after is None:
+        # first call: just hand out the current cursor
+        return jsonify({'ok': True, 'events': [], 'last_id': events.bus.last_id, 'reset': False})
+    pending, complete = events.replay(after)
+    db.session.remove()
+    if not complete:
+        return jsonify({'ok': True, 'events': [], 'last_id': events.bus.last_id, 'reset': True})
+    cursor = after
+    deadline = time.monotonic() + timeout
+    while True:
+        visible = [e for e in pending if events.visible_to(e, user_id, role)]
+        if pending:
+            cursor = pending[-1]['id']
+        remaining = deadline - time.monotonic()
+        if visible or remaining <= 0:
+            return jsonify({'ok': True, 'events': visible, 'last_id': cursor, 'reset': False})
+        pending, complete = events.bus.wait(cursor, remaining)
+        if not complete:
+            return jsonify({'ok': True, 'events': [], 'last_id': events.bus.last_id, 'reset': True})
@@ -1,31 +1,50 @@
 from . import manager_bp
 from flask import request, render_template, redirect, url_for, jsonify, g
+from db import db
 from db import users
 from db import approvals as approvals
+from db import spend
+from db import org
 from handlers.auth_utils import require_role
-from utils.currency import get_currency_for_country, convert_amount
+from handlers.caching import conditional
+from db.admins import get_company_currency
+from utils.currency import convert_amounts
 
 
 @manager_bp.route('/manager/api/approvals', methods=['GET'])
 @require_role('Manager')
+@conditional('manager-api-approvals')
 def manager_api_list_approvals():
+	approver_id = request.args.get('approver_id', type=int)
 	approver_email = request.args.get('approver_email')
 	status = request.args.get('status')
 	limit = request.args.get('limit', default=200, type=int)
-	if approver_email:
-		items = approvals.list_approvals_by_approver(email=approver_email, status=status, limit=limit)
-	else:
-		# if no approver specified, return pending approvals for managers to pick up
-		items = approvals.list_approvals(status='Pending', limit=limit)
+	cursor = request.args.get('cursor')
+	try:
+		if request.args.get('scope') == 'org':
+			# everything requested by anyone in the manager's whole reporting tree
+			if g.current_user_id:
+				items = approvals.list_approvals_by_org(g.current_user_id, status=status, limit=limit, cursor=cursor)
+			else:
+				items = approvals.ApprovalPage()
+		elif approver_id or approver_email:
+			if not approver_id:
+				approver = users.get_user_by_email(approver_email)
+				approver_id = approver.id if approver else None
+			if approver_id is None:
+				# unknown approver email: nothing they decided, not every undecided row
+				items = approvals.ApprovalPage()
+			else:
+				items = approvals.list_approvals_by_approver(user_id=approver_id, status=status, limit=limit, cursor=cursor)
+		else:
+			# if no approver specified, return pending approvals for managers to pick up
+			items = approvals.list_approvals(status='Pending', limit=limit, cursor=cursor)
+	except ValueError:
+		return jsonify({'ok': False, 'error': 'invalid cursor'}), 400
 
 	# enrich with requestor username
-	out = []
-	for i in items:
-		d = i.to_dict()
-		u = users.User.query.filter_by(email=d.get('requestor_email')).first()
-		d['requestor_username'] = u.username if u else d.get('requestor_email')
-		out.append(d)
-	return jsonify({'ok': True, 'approvals': out})
+	out = approvals.enrich_with_requestors(items)
+	return jsonify({'ok': True, 'approvals': out, 'next_cursor': items.next_cursor, 'prev_cursor': items.prev_cursor})
 
 
 @manager_bp.route('/manager/api/approvals/<int:aid>/decide', methods=['POST'])
@@ -41,64 +60,151 @@ def manager_api_decide_approval(aid: int):
 	if not approver_email:
 		return jsonify({'ok': False, 'error': 'approver_email is required'}), 400
 
+	expected_version = data.get('version')
+	if expected_version is not None:
+		try:
+			expected_version = int(expected_version)
+		except (TypeError, ValueError):
+			return jsonify({'ok': False, 'error': 'version must be an integer'}), 400
+
 	status = 'Approved' if action == 'approve' else 'Rejected'
-	a = approvals.set_approval_status(aid, approver_email=approver_email, status=status, comments=comments)
+	try:
+		a = approvals.set_approval_status(aid, approver_email=approver_email, status=status, comments=comments, expected_version=expected_version)
+	except approvals.VersionConflict as e:
+		return jsonify({'ok': False, 'error': str(e)}), 409
 	if not a:
 		return jsonify({'ok': False, 'error': 'approval not found'}), 404
 	return jsonify({'ok': True, 'approval': a.to_dict()})
 
 
+@manager_bp.route('/manager/api/approvals/decide', methods=['POST'])
+@require_role('Manager')
+def manager_api_decide_approvals():
+	"""Approve or reject many approvals at once.
+
+	Body: {"action": "approve"|"reject", "ids": [...]} or {"items": [{"id", "version"}, ...]},
+	plus optional "comments". Ids that are no longer pending, or whose version
+	moved, come back in "conflicts" untouched.
+	"""
+	data = request.get_json(force=True, silent=True) or {}
+	action = (data.get('action') or '').lower()
+	if action not in ('approve', 'reject'):
+		return jsonify({'ok': False, 'error': 'action must be approve or reject'}), 400
+	approver_email = data.get('approver_email') or getattr(g, 'current_user_email', None)
+	if not approver_email:
+		return jsonify({'ok': False, 'error': 'approver_email is required'}), 400
+
+	ids = data.get('ids') or []
+	items = data.get('items') or []
+	try:
+		ids = [int(i) for i in ids] + [int(it['id']) for it in items]
+		expected = {int(it['id']): int(it['version']) for it in items if it.get('version') is not None}
+	except (TypeError, ValueError, KeyError):
+		return jsonify({'ok': False, 'error': 'ids must be integers'}), 400
+	if not ids:
+		return jsonify({'ok': False, 'error': 'no approvals given'}), 400
+	if len(ids) > approvals.MAX_PAGE_SIZE:
+		return jsonify({'ok': False, 'error': f'at most {approvals.MAX_PAGE_SIZE} approvals per request'}), 400
+
+	status = 'Approved' if action == 'approve' else 'Rejected'
+	result = approvals.decide_approvals(ids, approver_email=approver_email, status=status, comments=data.get('comments'), expected_versions=expected)
+	return jsonify({'ok': True, 'status': status, **result.to_dict()})
+
+
+
+@manager_bp.route('/manager/api/spend-summary', methods=['GET'])
+@require_role('Manager')
+def manager_spend_summary():
+	"""Spend totals for the manager's direct reports, read from the maintained aggregates."""
+	by = request.args.get('by', default='status')
+	month = request.args.get('month')
+	status = request.args.get('status')
+	manager_id = getattr(g, 'current_user_id', None)
+	if not manager_id:
+		emails = []
+	elif request.args.get('scope') == 'org':
+		emails = org.subtree_emails_select(manager_id)
+	else:
+		emails = db.select(users.User.email).where(users.User.manager_id == manager_id)
+	try:
+		rows = spend.summarize(by, month=month, status=status, requestor_emails=emails)
+	except ValueError as e:
+		return jsonify({'ok': False, 'error': str(e)}), 400
+	return jsonify({'ok': True, 'currency': get_company_currency(), 'by': by, 'month': month, 'totals': rows})
+
+
+@manager_bp.route('/manager/api/org', methods=['GET'])
+@require_role('Manager')
+def manager_org():
+	"""The manager's management chain, direct reports and reporting tree (?max_depth=N).
+
+	The tree comes back in pages of `limit` people, nearest levels first;
+	pass `next_cursor` as ?cursor= for the next page.
+	"""
+	manager_id = getattr(g, 'current_user_id', None)
+	if not manager_id:
+		return jsonify({'ok': False, 'error': 'not signed in as a user'}), 403
+	max_depth = request.args.get('max_depth', type=int)
+	limit = max(1, min(request.args.get('limit', default=200, type=int), org.MAX_PAGE_SIZE))
+	cursor = request.args.get('cursor')
+	try:
+		after = org.decode_cursor(cursor) if cursor else None
+	except ValueError:
+		return jsonify({'ok': False, 'error': 'invalid cursor'}), 400
+
+	def person(u):
+		return {'id': u.id, 'username': u.username, 'email': u.email, 'role': u.role, 'manager_id': u.manager_id}
+
+	# one extra row tells us whether there is another page
+	tree = org.subtree(manager_id, max_depth=max_depth, limit=limit + 1, after=after)
+	more = len(tree) > limit
+	tree = tree[:limit]
+	return jsonify({
+		'ok': True,
+		'ancestors': [person(u) for u in org.ancestors(manager_id)],
+		'direct_reports': [person(u) for u, _ in org.subtree(manager_id, max_depth=1, limit=limit)],
+		'subtree': [dict(person(u), depth=depth) for u, depth in tree],
+		'next_cursor': org.encode_cursor(org.page_key(*tree[-1])) if more else None,
+	})
+
+
+def _rates_stamp():
+	# converted amounts change when exchange rates are refreshed
+	from utils import rates
+	return rates.get_store().stamp()
+
+
+def _inbox_counter():
+	# the dashboard only lists approvals assigned to the manager
+	manager_id = getattr(g, 'current_user_id', None)
+	return approvals.assignee_counter(manager_id) if manager_id else None
+
 
 @manager_bp.route('/manager/dashboard')
 @require_role('Manager')
+@conditional('manager-dashboard', extra=_rates_stamp, counter=_inbox_counter)
 def manager_dashboard():
 	# Render dashboard but mark role as Manager; front-end can adapt
 	username = request.args.get('username')
-	# Determine current manager's email and user id from the request context (g)
-	manager_email = getattr(g, 'current_user_email', None)
+	# Determine current manager's user id from the request context (g)
+	manager_id = getattr(g, 'current_user_id', None)
 	approvals_list = []
-	if manager_email:
-		# find all employees who have this manager
-		mgr_user = users.User.query.filter_by(email=manager_email).first()
-		if mgr_user:
-			employees = users.User.query.filter_by(manager_id=mgr_user.id).all()
-			emails = [e.email for e in employees]
-			# include approvals from those employees
-			approvals_list = approvals.list_approvals_by_requestors(emails=emails)
+	if manager_id:
+		# approvals are assigned to the requestor's manager when created
+		approvals_list = approvals.list_approvals_by_assignee(approver_id=manager_id)
 	else:
 		# fallback: show global pending approvals
 		approvals_list = approvals.list_approvals(status='Pending')
 
 	# convert to dicts and add requestor_username for display
-	approvals_dicts = []
-	for a in approvals_list:
-		d = a.to_dict()
-		u = users.User.query.filter_by(email=d.get('requestor_email')).first()
-		d['requestor_username'] = u.username if u else d.get('requestor_email')
-		# convert amount to company currency (determine company currency from manager's admin record if possible)
-		company_currency = 'USD'
-		# try to infer company currency from manager user's manager (admin) or environment; fallback USD
-		# Here we check if there's an Admin record and use its country to derive currency
-		try:
-			from db import admins as admins_mod
-			admin_obj = admins_mod.Admin.query.first()
-			if admin_obj and admin_obj.country:
-				cc = get_currency_for_country(admin_obj.country)
-				if cc:
-					company_currency = cc
-		except Exception:
-			pass
-		# convert if approval has currency
-		orig_currency = d.get('currency') or ''
-		converted = None
-		if d.get('amount') is not None and orig_currency:
-			try:
-				converted = convert_amount(d.get('amount'), orig_currency, company_currency)
-			except Exception:
-				converted = None
-		d['converted_amount'] = converted
+	approvals_dicts = approvals.enrich_with_requestors(approvals_list)
+	# convert amounts to the company currency; rates are looked up once per
+	# distinct source currency rather than once per row
+	company_currency = get_company_currency()
+	converted = convert_amounts([(d.get('amount'), d.get('currency')) for d in approvals_dicts], company_currency)
+	for d, c in zip(approvals_dicts, converted):
+		d['converted_amount'] = c
 		d['company_currency'] = company_currency
-		approvals_dicts.append(d)
 
 	return render_template('manager.html', approvals=approvals_dicts, current_user_name=username or 'Manager', current_user_role='Manager')
 
@@ -111,7 +217,10 @@ def manager_approve(aid: int):
 	approver_email = request.form.get('approver_email') or request.args.get('email') or getattr(g, 'current_user_email', None)
 	if not approver_email:
 		return "Approver email required", 400
-	a = approvals.set_approval_status(aid, approver_email=approver_email, status='Approved', comments=request.form.get('comments'))
+	try:
+		a = approvals.set_approval_status(aid, approver_email=approver_email, status='Approved', comments=request.form.get('comments'))
+	except approvals.VersionConflict:
+		return "This expense was just updated by someone else", 409
 	if not a:
 		return "Not found", 404
 	return redirect(url_for('manager.manager_dashboard', email=approver_email))
@@ -123,7 +232,10 @@ def manager_reject(aid: int):
 	approver_email = request.form.get('approver_email') or request.args.get('email') or getattr(g, 'current_user_email', None)
 	if not approver_email:
 		return "Approver email required", 400
-	a = approvals.set_approval_status(aid, approver_email=approver_email, status='Rejected', comments=request.form.get('comments'))
+	try:
+		a = approvals.set_approval_status(aid, approver_email=approver_email, status='Rejected', comments=request.form.get('comments'))
+	except approvals.VersionConflict:
+		return "This expense was just updated by someone else", 409
 	if not a:
 		return "Not found", 404
 	return redirect(url_for('manager.manager_dashboard', email=approver_email))
@@ -1,15 +1,24 @@
 from flask import Flask
 from db import db
 from db.users import User
+from db import migrations
+from db import outbox
+from db import spend
+from db import export
+from db import user_import
 from handlers.auth import auth_bp
 # Import modules that declare routes so their route decorators run
 from handlers.admin import admin_bp
 from handlers.manager import manager_bp
 from handlers.employee import employee_bp
+from handlers.events import events_bp
 from flask import render_template
 from flask import request, g
+from flask.ctx import _AppCtxGlobals
 import os
 from dotenv import load_dotenv
+from utils import rates
+from utils import metrics
 
 load_dotenv()
 
@@ -18,33 +27,48 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("SQL_URL")
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db.init_app(app)
+# Per-endpoint latency / SQL counters, served on /metrics
+metrics.init_app(app)
+
+
+_USER_ATTRS = ('current_user_id', 'current_user_name', 'current_user_role', 'current_user_email')
+
+
+class RequestGlobals(_AppCtxGlobals):
+    """`g` that resolves the logged-in user only when first read.
+
+    Views that never look at `g.current_user_*` (static files, anonymous
+    pages, JSON endpoints without role checks) never touch the session store.
+    """
+
+    def __getattr__(self, name):
+        if name not in _USER_ATTRS:
+            raise AttributeError(name)
+        from db import sessions
+        principal = sessions.resolve_session(self.__dict__.get('session_token'))
+        self.current_user_id = principal['id'] if principal else None
+        self.current_user_name = principal['name'] if principal else None
+        self.current_user_role = principal['role'] if principal else None
+        self.current_user_email = principal['email'] if principal else None
+        return self.__dict__[name]
+
+
+app.app_ctx_globals_class = RequestGlobals
 
 
 @app.before_request
 def load_current_user():
-    """Set g.current_user_name and g.current_user_role based on session_token cookie.
+    """Remember the `session_token` cookie for lazy resolution on `g`.
 
-    This looks for a `session_token` cookie, then tries to resolve it to an Admin
-    first and then to a User. If found, it stores values on `g` for later use.
+    Requests for static files skip user resolution entirely.
     """
-    g.current_user_name = None
-    g.current_user_role = None
-    token = request.cookies.get('session_token')
-    if not token:
+    if request.path.startswith(app.static_url_path + '/'):
+        g.current_user_id = None
+        g.current_user_name = None
+        g.current_user_role = None
+        g.current_user_email = None
         return
-    from db import admins as admins_mod
-    from db import users as users_mod
-    admin = admins_mod.Admin.query.filter_by(session_token=token).first()
-    if admin:
-        g.current_user_name = admin.name
-        g.current_user_role = 'Admin'
-        g.current_user_email = admin.email
-        return
-    user = users_mod.User.query.filter_by(session_token=token).first()
-    if user:
-        g.current_user_name = user.username
-        g.current_user_role = user.role or 'Employee'
-        g.current_user_email = user.email
+    g.session_token = request.cookies.get('session_token')
 
 
 @app.context_processor
@@ -59,6 +83,7 @@ app.register_blueprint(auth_bp)
 app.register_blueprint(admin_bp)
 app.register_blueprint(manager_bp)
 app.register_blueprint(employee_bp)
+app.register_blueprint(events_bp)
 
 
 @app.route('/dashboard')
@@ -66,8 +91,20 @@ def dashboard():
     # Render the existing dashboard.html template
     return render_template('dashboard.html')
 
-with app.app_context():
-    db.create_all()
+# Keep exchange-rate tables warm off the request path. Spawned worker
+# processes (utils.passwords) re-import this file as __mp_main__ and skip it.
+if os.getenv('EXCHANGE_RATES_BACKGROUND', '1') != '0' and __name__ != '__mp_main__':
+    rates.start_refresher()
+
+# Schema changes are applied with `flask --app main db upgrade` (see db/migrations.py)
+app.cli.add_command(migrations.db_cli)
+# Queued email is delivered by `flask --app main mail worker` (see db/outbox.py)
+app.cli.add_command(outbox.mail_cli)
+app.cli.add_command(spend.spend_cli)
+app.cli.add_command(user_import.users_cli)
+app.cli.add_command(export.approvals_cli)
 
 if __name__ == "__main__":
+    with app.app_context():
+        migrations.upgrade()
     app.run(host="0.0.0.0", debug=True)
\ No newline at end of file
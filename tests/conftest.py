@@ -0,0 +1,65 @@
+"""Shared fixtures: the real app on a throwaway SQLite database."""
+import contextlib
+import io
+import os
+
+import pytest
+
+PASSWORD = 'pw'
+# USD-quoted, like the HTTP provider's tables
+RATES = {'USD': 1.0, 'EUR': 0.5, 'INR': 80.0}
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    os.environ['SQL_URL'] = f"sqlite:///{tmp_path_factory.mktemp('app') / 'app.db'}"
+    os.environ['EXCHANGE_RATES_BACKGROUND'] = '0'
+    # a cheap hash keeps the login-heavy tests fast
+    os.environ['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+    import main
+    from db import migrations
+    from utils import rates
+
+    class Rates(rates.RateProvider):
+        def fetch(self, base):
+            if base not in RATES:
+                return None
+            return {code: rate / RATES[base] for code, rate in RATES.items()}
+
+    rates.configure(Rates(), path=None)
+    with main.app.app_context():
+        migrations.upgrade()
+    return main.app
+
+
+def _wipe():
+    from db import db, migrations, rule_engine, sessions
+    migrations._load_models()
+    with db.engine.begin() as conn:
+        for table in reversed(db.metadata.sorted_tables):
+            if table.name != 'schema_version':
+                conn.execute(table.delete())
+    sessions.clear_session_cache()
+    rule_engine._compiled = None
+
+
+@pytest.fixture
+def people(app):
+    """An empty database holding the admin (in India), a manager and one of their employees."""
+    from db import admins, users
+    from utils.passwords import hash_password
+    with app.app_context():
+        _wipe()
+        admins.create_admin('Boss', 'boss@x.com', PASSWORD, 'India')
+        m = users.create_user_record('m@x.com', 'mgr', hash_password(PASSWORD), 'Manager')
+        e = users.create_user_record('e@x.com', 'emp', hash_password(PASSWORD), 'Employee', m.id)
+        return {'admin': 'boss@x.com', 'manager': m.id, 'employee': e.id}
+
+
+def login(app, email, password=PASSWORD):
+    client = app.test_client()
+    # the login view prints debug lines
+    with contextlib.redirect_stdout(io.StringIO()):
+        res = client.post('/login', data={'email': email, 'password': password})
+    assert res.status_code == 302, res.status_code
+    return client
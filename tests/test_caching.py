@@ -0,0 +1,37 @@
+"""Conditional GET: ETag and If-Modified-Since revalidation."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import login
+
+
+@pytest.fixture
+def changed(app, people):
+    """One approval, whose change counters last moved a minute ago."""
+    from db import approvals, counters, db
+    with app.app_context():
+        approvals.create_approval('e@x.com', amount=1, currency='USD')
+        db.session.execute(counters.Counter.__table__.update().values(updated_at=datetime.utcnow() - timedelta(minutes=1)))
+        db.session.commit()
+
+
+def test_if_modified_since_without_extra(app, changed):
+    client = login(app, 'm@x.com')
+    res = client.get('/manager/api/approvals')
+    assert res.status_code == 200
+    assert res.last_modified is not None
+    assert 'Cookie' in res.vary
+    again = client.get('/manager/api/approvals', headers={'If-Modified-Since': res.headers['Last-Modified']})
+    assert again.status_code == 304
+
+
+def test_views_with_extra_ignore_if_modified_since(app, changed):
+    client = login(app, 'm@x.com')
+    res = client.get('/manager/dashboard')
+    assert res.status_code == 200
+    assert res.last_modified is None
+    # the exchange-rate stamp is not in any date, so a date can't validate it
+    since = (datetime.utcnow() + timedelta(days=1)).strftime('%a, %d %b %Y %H:%M:%S GMT')
+    assert client.get('/manager/dashboard', headers={'If-Modified-Since': since}).status_code == 200
+    assert client.get('/manager/dashboard', headers={'If-None-Match': res.headers['ETag']}).status_code == 304
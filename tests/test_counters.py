@@ -0,0 +1,38 @@
+"""Change counters: creation, batching and concurrent first bumps."""
+import pytest
+from flask import Flask
+
+from db import db
+from db import counters
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "counters.db"}'
+    db.init_app(app)
+    with app.app_context():
+        counters.Counter.__table__.create(db.engine)
+        yield app
+
+
+def test_bump_creates_and_increments(app):
+    counters.bump_counter('a')
+    counters.bump_counters(['a', 'b', 'b'])
+    db.session.commit()
+    assert counters.get_counter('a') == 2
+    assert counters.get_counter('b') == 1
+    assert counters.get_counter_state('missing') == (0, None)
+
+
+def test_counter_created_by_another_writer(app):
+    # another transaction creates the row after this one found it missing
+    with db.engine.begin() as conn:
+        counters._insert_missing(conn, ['a'], None)
+        conn.execute(counters.Counter.__table__.update().values(value=5))
+    with db.engine.begin() as conn:
+        counters._insert_missing(conn, ['a', 'b'], None)
+    counters.bump_counters(['a', 'b'])
+    db.session.commit()
+    assert counters.get_counter('a') == 6
+    assert counters.get_counter('b') == 1
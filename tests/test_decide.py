@@ -0,0 +1,56 @@
+"""Deciding approvals with optimistic concurrency, one at a time and in bulk."""
+import pytest
+
+from conftest import login
+
+
+@pytest.fixture
+def pending(app, people):
+    from db import approvals
+    with app.app_context():
+        return [approvals.create_approval('e@x.com', amount=i + 1, currency='USD').id for i in range(3)]
+
+
+def test_single_decide_coerces_version(app, pending):
+    client = login(app, 'm@x.com')
+    url = f'/manager/api/approvals/{pending[0]}/decide'
+    body = {'action': 'approve', 'approver_email': 'm@x.com'}
+    assert client.post(url, json={**body, 'version': 'abc'}).status_code == 400
+    res = client.post(url, json={**body, 'version': '1'})
+    assert res.status_code == 200, res.get_json()
+    assert res.get_json()['approval']['status'] == 'Approved'
+    assert client.post(url, json={**body, 'version': '1'}).status_code == 409
+
+
+def test_bulk_decide_reports_conflicts(app, pending):
+    from db import approvals, db
+    stale, decided, fresh = pending
+    with app.app_context():
+        approvals.set_approval_status(decided, approver_email='m@x.com', status='Rejected')
+        # someone else edits `stale` after the client read version 1
+        a = approvals.get_approval_by_id(stale)
+        a.approver_comments = 'edited'
+        db.session.commit()
+        assert a.version == 2
+
+    client = login(app, 'm@x.com')
+    res = client.post('/manager/api/approvals/decide', json={
+        'action': 'approve',
+        'items': [{'id': stale, 'version': 1}, {'id': decided, 'version': 1}, {'id': fresh, 'version': 1}, {'id': 999999}],
+    })
+    assert res.status_code == 200
+    data = res.get_json()
+    assert data['applied'] == [fresh]
+    assert sorted(data['conflicts']) == sorted([stale, decided])
+    assert data['not_found'] == [999999]
+
+    with app.app_context():
+        assert approvals.get_approval_by_id(stale).status == 'Pending'
+        assert approvals.get_approval_by_id(decided).status == 'Rejected'
+        assert approvals.get_approval_by_id(fresh).status == 'Approved'
+
+
+def test_bulk_decide_rejects_bad_versions(app, pending):
+    client = login(app, 'm@x.com')
+    res = client.post('/manager/api/approvals/decide', json={'action': 'approve', 'items': [{'id': pending[0], 'version': 'abc'}]})
+    assert res.status_code == 400
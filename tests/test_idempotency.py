@@ -0,0 +1,96 @@
+"""Idempotent approval submission: replays, reused keys and retries."""
+from conftest import PASSWORD, login
+
+
+def _state(app):
+    from db import approvals, counters
+    with app.app_context():
+        return approvals.Approval.query.count(), counters.get_counter(approvals.CHANGES_COUNTER)
+
+
+def test_replayed_key_returns_the_original(app, people):
+    client = login(app, 'e@x.com')
+    body = {'requestor_email': 'e@x.com', 'amount': 10, 'currency': 'USD'}
+    first = client.post('/employee/api/approvals', json=body, headers={'Idempotency-Key': 'k1'})
+    assert first.status_code == 201
+    before = _state(app)
+
+    again = client.post('/employee/api/approvals', json=body, headers={'Idempotency-Key': 'k1'})
+    assert again.status_code == 200
+    assert again.get_json()['duplicate'] is True
+    assert again.get_json()['approval']['id'] == first.get_json()['approval']['id']
+    # a pure replay writes nothing, so cached listings stay valid
+    assert _state(app) == before
+
+
+def test_reused_key_with_another_body_keeps_the_original(app, people):
+    client = login(app, 'e@x.com')
+    first = client.post('/employee/api/approvals', json={'requestor_email': 'e@x.com', 'amount': 10, 'currency': 'USD'},
+                        headers={'Idempotency-Key': 'k1'})
+    other = client.post('/employee/api/approvals', json={'requestor_email': 'e@x.com', 'amount': 99, 'currency': 'EUR'},
+                        headers={'Idempotency-Key': 'k1'})
+    assert other.status_code == 200
+    approval = other.get_json()['approval']
+    assert approval['id'] == first.get_json()['approval']['id']
+    assert (approval['amount'], approval['currency']) == (10, 'USD')
+
+
+def test_keys_are_scoped_per_caller(app, people):
+    from db import users
+    from utils.passwords import hash_password
+    with app.app_context():
+        users.create_user_record('f@x.com', 'emp2', hash_password(PASSWORD), 'Employee', people['manager'])
+    body = {'requestor_email': 'e@x.com', 'amount': 10, 'currency': 'USD'}
+    a = login(app, 'e@x.com').post('/employee/api/approvals', json=body, headers={'Idempotency-Key': 'k1'})
+    b = login(app, 'f@x.com').post('/employee/api/approvals', json=body, headers={'Idempotency-Key': 'k1'})
+    assert b.status_code == 201
+    assert a.get_json()['approval']['id'] != b.get_json()['approval']['id']
+
+
+def test_batch_replay_and_retry_after_partial_failure(app, people):
+    client = login(app, 'e@x.com')
+    items = [
+        {'idempotency_key': 'a', 'amount': 1, 'currency': 'USD'},
+        {'idempotency_key': 'b', 'amount': 'abc', 'currency': 'USD'},
+        {'idempotency_key': 'c', 'amount': 3, 'currency': 'USD'},
+        {'idempotency_key': 'a', 'amount': 1, 'currency': 'USD'},
+    ]
+    res = client.post('/employee/api/approvals/batch', json={'requestor_email': 'e@x.com', 'items': items}).get_json()
+    assert (res['created'], res['duplicates'], res['failed']) == (2, 1, 1)
+    assert res['results'][1]['error'] == 'amount must be a number'
+    assert res['results'][3]['approval_id'] == res['results'][0]['approval_id']
+    ids = {r['index']: r['approval_id'] for r in res['results'] if r['ok']}
+
+    # the client fixes the bad item and resends the whole batch
+    items[1]['amount'] = 2
+    retry = client.post('/employee/api/approvals/batch', json={'requestor_email': 'e@x.com', 'items': items}).get_json()
+    assert (retry['created'], retry['duplicates'], retry['failed']) == (1, 3, 0)
+    assert [r['duplicate'] for r in retry['results']] == [True, False, True, True]
+    assert {i: retry['results'][i]['approval_id'] for i in ids} == ids
+    assert _state(app)[0] == 3
+
+    before = _state(app)
+    replay = client.post('/employee/api/approvals/batch', json={'requestor_email': 'e@x.com', 'items': items}).get_json()
+    assert (replay['created'], replay['duplicates']) == (0, 4)
+    assert _state(app) == before
+
+
+def test_retry_after_failed_commit_creates_once(app, people, monkeypatch):
+    from db import idempotency
+    client = login(app, 'e@x.com')
+    items = [{'idempotency_key': k, 'amount': 1, 'currency': 'USD'} for k in 'xyz']
+    remember_keys = idempotency.remember_keys
+
+    def broken(scope, pairs):
+        raise RuntimeError('connection lost')
+
+    monkeypatch.setattr(idempotency, 'remember_keys', broken)
+    res = client.post('/employee/api/approvals/batch', json={'requestor_email': 'e@x.com', 'items': items})
+    assert res.status_code == 500
+    # the approvals were rolled back together with their keys
+    assert _state(app)[0] == 0
+
+    monkeypatch.setattr(idempotency, 'remember_keys', remember_keys)
+    retry = client.post('/employee/api/approvals/batch', json={'requestor_email': 'e@x.com', 'items': items}).get_json()
+    assert retry['created'] == 3
+    assert _state(app)[0] == 3
@@ -0,0 +1,135 @@
+"""Upgrade databases created by older releases through every migration."""
+import sqlite3
+
+import pytest
+from flask import Flask
+from sqlalchemy import inspect
+
+from db import db
+from db import migrations
+
+# Schema as created by the original release (db.create_all, before migrations existed)
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER NOT NULL, email VARCHAR(100) NOT NULL, username VARCHAR(50) NOT NULL,
+    password VARCHAR(200) NOT NULL, session_token VARCHAR(64), role VARCHAR(20) NOT NULL,
+    manager_id INTEGER, PRIMARY KEY (id), UNIQUE (email),
+    FOREIGN KEY(manager_id) REFERENCES users (id)
+);
+CREATE TABLE admins (
+    id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, email VARCHAR(100) NOT NULL,
+    password VARCHAR(200) NOT NULL, country VARCHAR(50), session_token VARCHAR(64),
+    PRIMARY KEY (id), UNIQUE (email)
+);
+CREATE TABLE approvals (
+    id INTEGER NOT NULL, requestor_email VARCHAR(100) NOT NULL, description TEXT,
+    category VARCHAR(100), amount FLOAT, currency VARCHAR(10), status VARCHAR(20) NOT NULL,
+    created_at DATETIME, updated_at DATETIME, approver_email VARCHAR(100),
+    approver_comments TEXT, receipt_filename VARCHAR(200), PRIMARY KEY (id)
+);
+CREATE TABLE approval_rules (
+    id INTEGER NOT NULL, name VARCHAR(200) NOT NULL, min_amount FLOAT, max_amount FLOAT,
+    category VARCHAR(100), required_approvers INTEGER NOT NULL, PRIMARY KEY (id)
+);
+INSERT INTO users VALUES (1, 'm@x.com', 'mgr', 'h', NULL, 'Manager', NULL);
+INSERT INTO users VALUES (2, 'e@x.com', 'emp', 'h', NULL, 'Employee', 1);
+INSERT INTO approvals (requestor_email, status, amount, currency, created_at, approver_email)
+    VALUES ('e@x.com', 'Approved', 12.5, 'USD', '2025-01-02 10:00:00', 'm@x.com');
+INSERT INTO approvals (requestor_email, status, amount, currency, created_at)
+    VALUES ('e@x.com', 'Pending', 3, 'USD', '2025-01-03 10:00:00');
+"""
+
+
+def _app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db.init_app(app)
+    return app
+
+
+def _existing_indexes(table_name):
+    with db.engine.connect() as conn:
+        return {i['name'] for i in inspect(conn).get_indexes(table_name)}
+
+
+def _declared_indexes(table_name):
+    migrations._load_models()
+    return {i.name for i in db.metadata.tables[table_name].indexes}
+
+
+@pytest.fixture
+def baseline_db(tmp_path):
+    path = tmp_path / 'baseline.db'
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_upgrade_baseline_database(baseline_db):
+    app = _app(baseline_db)
+    with app.app_context():
+        applied = migrations.upgrade()
+        assert applied == [v for v, _, _ in migrations.MIGRATIONS]
+        assert migrations.current_version() == migrations.MIGRATIONS[-1][0]
+
+        existing = _existing_indexes('approvals')
+        assert _declared_indexes('approvals') <= existing
+        # the email-keyed indexes were replaced by the id-keyed ones
+        assert 'ix_approvals_requestor_created_id' not in existing
+
+        rows = db.session.execute(db.text(
+            'SELECT requestor_id, approver_id, assigned_approver_id, version FROM approvals ORDER BY id'
+        )).all()
+        assert [tuple(r) for r in rows] == [(2, 1, 1, 1), (2, None, 1, 1)]
+
+
+def test_upgrade_is_resumable_from_every_version(baseline_db, tmp_path):
+    for version, _, _ in migrations.MIGRATIONS[:-1]:
+        path = tmp_path / f'v{version}.db'
+        path.write_bytes(baseline_db.read_bytes())
+        app = _app(path)
+        with app.app_context():
+            migrations.upgrade(target=version)
+            assert migrations.current_version() == version
+            migrations.upgrade()
+            assert migrations.current_version() == migrations.MIGRATIONS[-1][0]
+            db.session.remove()
+
+
+def test_upgrade_fresh_database(tmp_path):
+    app = _app(tmp_path / 'fresh.db')
+    with app.app_context():
+        migrations.upgrade()
+        existing = _existing_indexes('approvals')
+        assert _declared_indexes('approvals') <= existing
+        assert migrations.upgrade() == []
+
+
+def test_hot_queries_use_indexes_after_analyze(tmp_path):
+    app = _app(tmp_path / 'analyzed.db')
+    with app.app_context():
+        migrations.upgrade()
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("INSERT INTO users (id, email, username, password, role) VALUES (1, 'm@x.com', 'mgr', 'h', 'Manager')")
+            for i in range(2, 200):
+                conn.exec_driver_sql(
+                    f"INSERT INTO users (id, email, username, password, role, manager_id) "
+                    f"VALUES ({i}, 'u{i}@x.com', 'user{i}', 'h', 'Employee', {1 + i % 10})"
+                )
+                conn.exec_driver_sql(
+                    f"INSERT INTO sessions (token, principal_type, principal_id) VALUES ('t{i}', 'user', {i})"
+                )
+            for i in range(2000):
+                conn.exec_driver_sql(
+                    f"INSERT INTO approvals (requestor_email, requestor_id, approver_id, assigned_approver_id, status, created_at, version) "
+                    f"VALUES ('u@x.com', {2 + i % 198}, {1 + i % 10}, {1 + i % 10}, '{('Pending', 'Approved', 'Rejected')[i % 3]}', "
+                    f"datetime('2025-01-01', '+{i} minutes'), 1)"
+                )
+            conn.exec_driver_sql('ANALYZE')
+        results = migrations.explain_hot_queries()
+        assert 'sessions by token' in {r['name'] for r in results}
+        assert [r['name'] for r in results if r['full_scan']] == []
+        with db.engine.connect() as conn:
+            assert 'ix_users_session_token' not in migrations._index_names(conn, 'users')
@@ -0,0 +1,161 @@
+"""Outbox delivery through the SMTP pool, against a local SMTP sink."""
+import email
+import socketserver
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: no extensions, so STARTTLS is skipped."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 sink ready')
+        rcpts = []
+        for raw in self.rfile:
+            verb = raw.decode().strip()[:4].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 sink')
+            elif verb == 'MAIL':
+                rcpts = []
+                self.reply('250 ok')
+            elif verb == 'RCPT':
+                rcpts.append(raw.decode().split(':', 1)[1].strip().strip('<>'))
+                self.reply('250 ok')
+            elif verb == 'DATA':
+                self.reply('354 go ahead')
+                lines = []
+                for line in self.rfile:
+                    if line == b'.\r\n':
+                        break
+                    lines.append(line)
+                if set(rcpts) & self.server.reject:
+                    self.reply('451 try again later')
+                else:
+                    self.server.received.append(email.message_from_bytes(b''.join(lines)))
+                    self.reply('250 queued')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+@pytest.fixture
+def sink(monkeypatch):
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _SinkHandler)
+    server.daemon_threads = True
+    server.received = []
+    server.reject = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv('SMTP_HOST', '127.0.0.1')
+    monkeypatch.setenv('SMTP_PORT', str(server.server_address[1]))
+    monkeypatch.setenv('FROM_EMAIL', 'noreply@x.com')
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def pool(app, people, sink):
+    from utils.mailer import SMTPPool
+    with app.app_context():
+        pool = SMTPPool()
+        yield pool
+        pool.close()
+
+
+def _queue(*recipients):
+    from db import outbox
+    return [outbox.enqueue_email(to, f'Hello {to}', 'secret password').id for to in recipients]
+
+
+def _row(aid):
+    from db import db, outbox
+    return db.session.get(outbox.OutboxEmail, aid)
+
+
+def test_delivers_claimed_batch_and_redacts(pool, sink):
+    from db import outbox
+    ids = _queue('a@x.com', 'b@x.com', 'c@x.com')
+    assert outbox.deliver_batch(pool, batch_size=2) == 2
+    assert [m['To'] for m in sink.received] == ['a@x.com', 'b@x.com']
+    assert outbox.deliver_batch(pool, batch_size=2) == 1
+    assert outbox.deliver_batch(pool, batch_size=2) == 0
+    assert len(sink.received) == 3
+    for aid in ids:
+        row = _row(aid)
+        assert (row.status, row.attempts, row.body_text) == (outbox.STATUS_SENT, 1, '')
+    assert outbox.queue_depth() == {'pending': 0, 'due': 0, 'failed': 0, 'sent': 3}
+
+
+def test_failed_send_is_retried_after_backoff(pool, sink):
+    from db import db, outbox
+    sink.reject.add('b@x.com')
+    ok, bad = _queue('a@x.com', 'b@x.com')
+    assert outbox.deliver_batch(pool) == 2
+    row = _row(bad)
+    assert (row.status, row.attempts) == (outbox.STATUS_PENDING, 1)
+    assert '451' in row.last_error
+    assert row.body_text == 'secret password'
+    assert row.next_attempt_at > datetime.utcnow()
+    # not due yet
+    assert outbox.deliver_batch(pool) == 0
+
+    sink.reject.clear()
+    row.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    assert outbox.deliver_batch(pool) == 1
+    assert [m['To'] for m in sink.received] == ['a@x.com', 'b@x.com']
+    assert (_row(bad).status, _row(bad).attempts) == (outbox.STATUS_SENT, 2)
+
+
+def test_gives_up_after_max_attempts(pool, sink, monkeypatch):
+    from db import db, outbox
+    monkeypatch.setattr(outbox, 'MAX_ATTEMPTS', 2)
+    sink.reject.add('b@x.com')
+    [bad] = _queue('b@x.com')
+    for _ in range(2):
+        _row(bad).next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        outbox.deliver_batch(pool)
+    row = _row(bad)
+    assert (row.status, row.attempts, row.body_text) == (outbox.STATUS_FAILED, 2, '')
+    assert sink.received == []
+
+
+def test_resends_after_failed_commit_once_claim_expires(pool, sink, monkeypatch):
+    from db import db, outbox
+    [aid] = _queue('a@x.com')
+    commit = db.session.commit
+    calls = []
+
+    def flaky_commit():
+        calls.append(1)
+        # the claim commits; recording the send does not
+        if len(calls) == 2:
+            raise RuntimeError('database went away')
+        commit()
+
+    monkeypatch.setattr(db.session, 'commit', flaky_commit)
+    with pytest.raises(RuntimeError):
+        outbox.deliver_batch(pool)
+    monkeypatch.setattr(db.session, 'commit', commit)
+    db.session.rollback()
+    assert len(sink.received) == 1
+
+    row = _row(aid)
+    assert (row.status, row.attempts) == (outbox.STATUS_PENDING, 0)
+    # still claimed, so no other worker picks it up yet
+    assert row.next_attempt_at > datetime.utcnow() + timedelta(seconds=outbox.CLAIM_SECONDS - 60)
+    assert outbox.deliver_batch(pool) == 0
+
+    row.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    assert outbox.deliver_batch(pool) == 1
+    assert len(sink.received) == 2
+    assert _row(aid).status == outbox.STATUS_SENT
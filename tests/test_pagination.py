@@ -0,0 +1,78 @@
+"""Keyset pagination of approval listings."""
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import login
+
+
+@pytest.fixture
+def listed(app, people):
+    """Eleven pending approvals; several share a created_at, so only the id breaks the tie."""
+    from db import approvals, db
+    base = datetime(2025, 1, 1, 12, 0, 0)
+    with app.app_context():
+        rows = [approvals.create_approval('e@x.com', amount=i + 1, currency='USD') for i in range(11)]
+        for i, a in enumerate(rows):
+            a.created_at = base + timedelta(minutes=i // 4)
+        db.session.commit()
+        return [a.id for a in sorted(rows, key=lambda a: (a.created_at, a.id), reverse=True)]
+
+
+def _walk(app, cursor=None, forward=True, limit=4):
+    from db import approvals
+    pages = []
+    with app.app_context():
+        while True:
+            page = approvals.list_approvals(status='Pending', limit=limit, cursor=cursor)
+            pages.append([a.id for a in page])
+            cursor = page.next_cursor if forward else page.prev_cursor
+            if not cursor:
+                return pages, page
+
+
+def test_forward_and_back_across_pages(app, listed):
+    pages, last = _walk(app)
+    assert pages == [listed[0:4], listed[4:8], listed[8:11]]
+    assert last.prev_cursor is not None
+
+    back, first = _walk(app, cursor=last.prev_cursor, forward=False)
+    assert back == [listed[4:8], listed[0:4]]
+    assert first.next_cursor is not None
+
+
+def test_page_boundary_inside_a_tie(app, listed):
+    from db import approvals
+    with app.app_context():
+        # limit 3 splits the first group of four equal timestamps
+        page = approvals.list_approvals(limit=3)
+        rest = approvals.list_approvals(limit=3, cursor=page.next_cursor)
+        assert [a.id for a in page] + [a.id for a in rest] == listed[:6]
+        prev = approvals.list_approvals(limit=3, cursor=rest.prev_cursor)
+        assert [a.id for a in prev] == listed[:3]
+        assert prev.prev_cursor is None
+
+
+def test_cursor_round_trip(app, listed):
+    from db import approvals
+    with app.app_context():
+        a = approvals.get_approval_by_id(listed[0])
+        assert approvals.decode_cursor(approvals.encode_cursor(a, 'p')) == ('p', a.created_at, a.id)
+
+
+def test_api_pages_and_rejects_tampered_cursors(app, listed):
+    client = login(app, 'm@x.com')
+    first = client.get('/manager/api/approvals?limit=4').get_json()
+    second = client.get(f"/manager/api/approvals?limit=4&cursor={first['next_cursor']}").get_json()
+    assert [a['id'] for a in first['approvals'] + second['approvals']] == listed[:8]
+
+    def b64(value):
+        return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+    for cursor in ('garbage', first['next_cursor'][:-3], b64(['x', '2025-01-01T12:00:00', 1]),
+                   b64(['n', 'yesterday', 1]), b64(['n', '2025-01-01T12:00:00', 'id'])):
+        res = client.get('/manager/api/approvals', query_string={'cursor': cursor})
+        assert res.status_code == 400, cursor
+        assert res.get_json()['error'] == 'invalid cursor'
@@ -0,0 +1,70 @@
+"""Compiled rule matching, and how new approvals are matched to rules."""
+import math
+import random
+
+from conftest import login
+from db.rule_engine import CompiledRules, RuleSnapshot
+
+
+def _brute_force(rules, category, amount):
+    """The documented semantics, checked rule by rule."""
+    def fits(r):
+        if amount is None:
+            return r.min_amount is None and r.max_amount is None
+        lo = -math.inf if r.min_amount is None else r.min_amount
+        hi = math.inf if r.max_amount is None else r.max_amount
+        return lo <= amount <= hi
+
+    def width(r):
+        lo = -math.inf if r.min_amount is None else float(r.min_amount)
+        hi = math.inf if r.max_amount is None else math.nextafter(float(r.max_amount), math.inf)
+        return hi - lo
+
+    key = (category or '').strip().lower()
+    for group in ([r for r in rules if (r.category or '').strip().lower() == key and key],
+                  [r for r in rules if not (r.category or '').strip()]):
+        hits = [r for r in group if fits(r)]
+        if hits:
+            return min(hits, key=lambda r: (width(r), r.id))
+    return None
+
+
+def test_compiled_rules_match_brute_force():
+    rng = random.Random(7)
+    bounds = [None, 0, 10, 50, 100, 100.5, 250, 1000]
+    categories = [None, '', 'Travel', 'travel ', 'Meals']
+    for _ in range(200):
+        rules = []
+        for rid in range(1, rng.randint(1, 12) + 1):
+            rules.append(RuleSnapshot(rid, f'r{rid}', rng.choice(bounds), rng.choice(bounds), rng.choice(categories), 1))
+        compiled = CompiledRules(rules, version=1)
+        amounts = [None, -1, 0, 5, 10, 10.0001, 49.99, 50, 100, 100.25, 100.5, 250, 999, 1000, 5000]
+        for category in ('Travel', 'MEALS', 'Lodging', None):
+            for amount in amounts:
+                assert compiled.match(category, amount) == _brute_force(rules, category, amount), (rules, category, amount)
+
+
+def test_create_rejects_non_numeric_amount(app, people):
+    client = login(app, 'e@x.com')
+    res = client.post('/employee/api/approvals', json={'requestor_email': 'e@x.com', 'amount': 'abc', 'currency': 'USD'})
+    assert res.status_code == 400
+    res = client.post('/employee/api/approvals', json={'requestor_email': 'e@x.com', 'amount': '12.5', 'currency': 'USD'})
+    assert res.status_code == 201
+    assert res.get_json()['approval']['amount'] == 12.5
+
+
+def test_unconvertible_amount_is_left_unmatched(app, people):
+    from db import approvals
+    with app.app_context():
+        # 0..100 INR; 12.5 XYZ must not be compared against it as if it were INR
+        approvals.create_rule('small', min_amount=0, max_amount=100)
+    client = login(app, 'e@x.com')
+    res = client.post('/employee/api/approvals', json={'requestor_email': 'e@x.com', 'amount': '12.5', 'currency': 'XYZ'})
+    assert res.status_code == 201
+    with app.app_context():
+        a = approvals.get_approval_by_id(res.get_json()['approval']['id'])
+        assert a.company_amount is None
+        assert a.rule_id is None
+        # 1 USD is 80 INR, inside the rule
+        ok = approvals.create_approval('e@x.com', amount=1, currency='USD')
+        assert ok.rule_id is not None
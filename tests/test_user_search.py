@@ -0,0 +1,37 @@
+"""User search keeps exact and prefix matches for common terms."""
+import pytest
+
+from db import db, user_search
+from db.users import User
+
+
+@pytest.fixture(params=['fts5', 'grams'])
+def search_backend(request, app, people, monkeypatch):
+    monkeypatch.setattr(user_search, '_backend', request.param)
+    with app.app_context():
+        # more substring matches than the index hands back as candidates
+        db.session.add_all(
+            User(email=f'user{i}@x.com', username=f'bjohnson{i:04d}', password='h', role='Employee')
+            for i in range(user_search.CANDIDATES + 100)
+        )
+        db.session.add_all([
+            User(email='jdoe@x.com', username='John', password='h', role='Manager'),
+            User(email='johnny@x.com', username='johnny', password='h', role='Employee'),
+        ])
+        db.session.commit()
+        if request.param == 'grams':
+            user_search.rebuild()
+        yield request.param
+
+
+def test_exact_and_prefix_matches_come_first(app, search_backend):
+    with app.app_context():
+        found = [u.username for u in user_search.search_users('john', limit=3)]
+        assert found[:2] == ['John', 'johnny']
+        assert found[2].startswith('bjohnson')
+
+
+def test_short_terms_use_the_prefix_lookup(app, search_backend):
+    with app.app_context():
+        assert [u.username for u in user_search.search_users('jo', limit=5)] == ['John', 'johnny']
+        assert [u.username for u in user_search.search_users('jo', limit=5, role='Manager')] == ['John']
@@ -1,104 +1,221 @@
 import json
-import time
+import os
+import re
+import threading
+import unicodedata
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
 from urllib.request import urlopen, Request
 
-# Simple in-memory caches
-_country_currency_map = None
-_rates_cache = {}
+from utils import rates as rates_store
+from utils.metrics import timed
 
+# Country -> currency data ships with the package (utils/data/countries.tsv),
+# one `name<TAB>currency<TAB>alias|alias...` row per country. It is parsed on
+# first use; `python -m utils.currency refresh-countries` regenerates it from
+# restcountries.com when a network is available.
+COUNTRIES_PATH = os.path.join(os.path.dirname(__file__), 'data', 'countries.tsv')
+COUNTRIES_URL = "https://restcountries.com/v3.1/all?fields=name,currencies,cca2,cca3,altSpellings"
 
-def _fetch_countries():
-    global _country_currency_map
-    if _country_currency_map is not None:
-        return _country_currency_map
-    url = "https://restcountries.com/v3.1/all?fields=name,currencies"
-    req = Request(url, headers={"User-Agent": "ExpenseMgmt/1.0"})
-    with urlopen(req, timeout=10) as resp:
-        data = json.load(resp)
-    mapping = {}
-    for c in data:
-        name = None
-        try:
-            name = c.get('name', {}).get('common')
-        except Exception:
-            continue
-        currencies = c.get('currencies') or {}
-        # pick first currency code if available
-        code = None
-        if isinstance(currencies, dict) and len(currencies) > 0:
-            try:
-                code = list(currencies.keys())[0]
-            except Exception:
-                code = None
-        if name and code:
-            mapping[name] = code
-    _country_currency_map = mapping
-    return _country_currency_map
+_country_index = None
+_country_index_lock = threading.Lock()
+
+
+def _normalize_country(name: str) -> str:
+    """Case-, accent- and punctuation-insensitive key for country lookups."""
+    s = unicodedata.normalize('NFKD', name)
+    s = ''.join(ch for ch in s if not unicodedata.combining(ch)).casefold()
+    return ' '.join(re.sub(r"[^\w]+", ' ', s).split())
+
+
+class _CountryIndex:
+    def __init__(self, rows):
+        self.names = sorted(name for name, _, _ in rows)
+        self.exact = {}
+        self.normalized = {}
+        for name, code, _ in rows:
+            self.exact[name] = code
+            self.normalized[_normalize_country(name)] = code
+        # aliases never shadow a real country name
+        for _, code, aliases in rows:
+            for alias in aliases:
+                self.normalized.setdefault(_normalize_country(alias), code)
+
+
+def _load_countries(path: str = COUNTRIES_PATH) -> _CountryIndex:
+    rows = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) < 2:
+                continue
+            aliases = [a for a in parts[2].split('|') if a] if len(parts) > 2 else []
+            rows.append((parts[0], parts[1], aliases))
+    return _CountryIndex(rows)
+
+
+def _countries() -> _CountryIndex:
+    global _country_index
+    if _country_index is None:
+        with _country_index_lock:
+            if _country_index is None:
+                _country_index = _load_countries()
+    return _country_index
 
 
 def get_all_countries():
-    mapping = _fetch_countries()
     # return sorted list of country names
-    return sorted(mapping.keys())
+    return list(_countries().names)
 
 
 def get_currency_for_country(country_name: str):
     """Return a 3-letter currency code (e.g., 'USD') for the given country name.
 
-    This queries restcountries and caches the mapping in memory.
+    Matches the bundled dataset exactly, then case/accent-insensitively against
+    names and aliases (ISO codes, official names, common spellings).
     """
     if not country_name:
         return None
-    mapping = _fetch_countries()
-    # try exact match
-    if country_name in mapping:
-        return mapping[country_name]
-    # try case-insensitive match
-    for k, v in mapping.items():
-        if k.lower() == country_name.lower():
-            return v
-    # no match
-    return None
-
-
-def _fetch_rates(base: str):
-    # cache for 10 minutes per base
-    now = time.time()
-    entry = _rates_cache.get(base)
-    if entry and now - entry['ts'] < 600:
-        return entry['rates']
-    url = f"https://api.exchangerate-api.com/v4/latest/{base}"
-    req = Request(url, headers={"User-Agent": "ExpenseMgmt/1.0"})
+    index = _countries()
+    code = index.exact.get(country_name)
+    if code:
+        return code
+    return index.normalized.get(_normalize_country(country_name))
+
+
+def refresh_countries(path: str = COUNTRIES_PATH) -> int:
+    """Regenerate the bundled dataset from restcountries.com. Returns the row count.
+
+    Offline maintenance only; nothing on the request path calls this.
+    """
+    global _country_index
+    req = Request(COUNTRIES_URL, headers={"User-Agent": "ExpenseMgmt/1.0"})
+    with urlopen(req, timeout=30) as resp:
+        data = json.load(resp)
+    rows = []
+    for c in data:
+        names = c.get('name') or {}
+        name = names.get('common')
+        currencies = c.get('currencies') or {}
+        if not name or not isinstance(currencies, dict) or not currencies:
+            continue
+        aliases = []
+        for a in [c.get('cca2'), c.get('cca3'), names.get('official')] + list(c.get('altSpellings') or []):
+            if a and a != name and a not in aliases:
+                aliases.append(a)
+        rows.append((name, list(currencies.keys())[0], aliases))
+    rows.sort()
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write('# name\tcurrency\taliases (| separated)\n')
+        for name, code, aliases in rows:
+            f.write(f"{name}\t{code}\t{'|'.join(aliases)}\n")
+    os.replace(tmp, path)
+    _country_index = None
+    return len(rows)
+
+
+# All conversions go through one rate table quoted against this pivot; any
+# pair is triangulated from it, so one upstream fetch per refresh interval
+# covers every currency mix.
+PIVOT_CURRENCY = (os.getenv('EXCHANGE_RATES_PIVOT') or 'USD').upper()
+
+# ISO 4217 minor units for currencies that don't use 2 decimals. Converted
+# amounts are rounded half-even to the target currency's minor unit.
+_MINOR_UNITS = {
+    'BIF': 0, 'CLP': 0, 'DJF': 0, 'GNF': 0, 'ISK': 0, 'JPY': 0, 'KMF': 0, 'KRW': 0,
+    'PYG': 0, 'RWF': 0, 'UGX': 0, 'UYI': 0, 'VND': 0, 'VUV': 0, 'XAF': 0, 'XOF': 0, 'XPF': 0,
+    'BHD': 3, 'IQD': 3, 'JOD': 3, 'KWD': 3, 'LYD': 3, 'OMR': 3, 'TND': 3,
+}
+
+
+def _fetch_rates(base: str = PIVOT_CURRENCY):
+    # served from the persistent, background-refreshed store in utils.rates
+    return rates_store.get_store().get(base)
+
+
+def _quantum(currency: str) -> Decimal:
+    return Decimal(1).scaleb(-_MINOR_UNITS.get(currency, 2))
+
+
+def _get_rate(from_currency: str, to_currency: str):
+    """Exact Decimal multiplier converting `from_currency` into `to_currency`, or None.
+
+    Cross rate via the pivot table: (pivot -> to) / (pivot -> from).
+    """
+    if from_currency == to_currency:
+        return Decimal(1)
+    rates = _fetch_rates()
+    if not rates:
+        return None
+    try:
+        from_rate = Decimal(1) if from_currency == PIVOT_CURRENCY else Decimal(str(rates[from_currency]))
+        to_rate = Decimal(1) if to_currency == PIVOT_CURRENCY else Decimal(str(rates[to_currency]))
+        if not from_rate:
+            return None
+        return to_rate / from_rate
+    except (KeyError, InvalidOperation, TypeError, ValueError):
+        return None
+
+
+def _apply_rate(amount, rate: Decimal, to_currency: str):
     try:
-        with urlopen(req, timeout=10) as resp:
-            data = json.load(resp)
-    except Exception:
+        value = Decimal(str(amount)) * rate
+        return float(value.quantize(_quantum(to_currency), rounding=ROUND_HALF_EVEN))
+    except (InvalidOperation, TypeError, ValueError):
         return None
-    rates = data.get('rates')
-    if rates:
-        _rates_cache[base] = {'ts': now, 'rates': rates}
-    return rates
 
 
+@timed('currency.convert_amount')
 def convert_amount(amount: float, from_currency: str, to_currency: str):
-    """Convert amount from `from_currency` to `to_currency` using exchangerate-api.
+    """Convert amount from `from_currency` to `to_currency`.
 
-    Returns float or None if conversion failed.
+    Returns float rounded to the target currency's minor unit, or None if
+    conversion failed.
     """
     if amount is None:
         return None
     if not from_currency or not to_currency:
         return None
-    if from_currency.upper() == to_currency.upper():
-        return float(amount)
-    # Fetch rates with base=from_currency so rates[to_currency] gives multiplier
-    rates = _fetch_rates(from_currency.upper())
-    if not rates:
-        return None
-    rate = rates.get(to_currency.upper())
+    target = to_currency.upper()
+    rate = _get_rate(from_currency.upper(), target)
     if rate is None:
         return None
-    try:
-        return float(amount) * float(rate)
-    except Exception:
-        return None
+    return _apply_rate(amount, rate, target)
+
+
+@timed('currency.convert_amounts')
+def convert_amounts(items, to_currency: str) -> list:
+    """Convert a list of (amount, currency) pairs to `to_currency` in one pass.
+
+    Pairs are grouped by source currency so each distinct currency costs one
+    rate lookup, however many rows share it. Returns a list aligned with
+    `items`; entries that can't be converted are None.
+    """
+    if not to_currency:
+        return [None] * len(items)
+    target = to_currency.upper()
+    rates = {}
+    for _, currency in items:
+        if currency:
+            src = currency.upper()
+            if src not in rates:
+                rates[src] = _get_rate(src, target)
+    out = []
+    for amount, currency in items:
+        rate = rates.get(currency.upper()) if currency else None
+        if amount is None or rate is None:
+            out.append(None)
+            continue
+        out.append(_apply_rate(amount, rate, target))
+    return out
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] == ['refresh-countries']:
+        print(f"Wrote {refresh_countries()} countries to {COUNTRIES_PATH}")
+    else:
+        print("usage: python -m utils.currency refresh-countries")
+        sys.exit(2)
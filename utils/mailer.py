@@ -1,24 +1,73 @@
 import os
 import smtplib
+import threading
 from email.message import EmailMessage
 from typing import Optional
 
+from utils.metrics import timed
 
-def send_email(to_email: str, subject: str, body_text: str, body_html: Optional[str] = None) -> bool:
-    """Send an email using SMTP configuration from environment variables.
+
+def smtp_config() -> Optional[dict]:
+    """Return SMTP settings from the environment, or None if not configured.
 
     Environment variables expected:
       SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, FROM_EMAIL
-
-    Returns True on success, False on error (prints the error).
     """
     host = os.environ.get('SMTP_HOST')
     port = os.environ.get('SMTP_PORT')
+    if not host or not port:
+        return None
     user = os.environ.get('SMTP_USER')
-    password = os.environ.get('SMTP_PASS')
-    from_email = os.environ.get('FROM_EMAIL') or user
+    return {
+        'host': host,
+        'port': int(port),
+        'user': user,
+        'password': os.environ.get('SMTP_PASS'),
+        'from_email': os.environ.get('FROM_EMAIL') or user,
+    }
 
-    if not host or not port:
+
+def _build_message(from_email: str, to_email: str, subject: str, body_text: str, body_html: Optional[str] = None) -> EmailMessage:
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg['From'] = from_email
+    msg['To'] = to_email
+    msg.set_content(body_text)
+    if body_html:
+        msg.add_alternative(body_html, subtype='html')
+    return msg
+
+
+@timed('mailer.connect')
+def _open_connection(cfg: dict):
+    """Connect, upgrade to TLS where possible and log in."""
+    # Use SSL if port is 465, otherwise try STARTTLS
+    if cfg['port'] == 465:
+        smtp = smtplib.SMTP_SSL(cfg['host'], cfg['port'])
+    else:
+        smtp = smtplib.SMTP(cfg['host'], cfg['port'])
+        smtp.ehlo()
+        try:
+            smtp.starttls()
+        except Exception:
+            pass
+    if cfg['user'] and cfg['password']:
+        smtp.login(cfg['user'], cfg['password'])
+    return smtp
+
+
+@timed('mailer.send_email')
+def send_email(to_email: str, subject: str, body_text: str, body_html: Optional[str] = None) -> bool:
+    """Send an email using SMTP configuration from environment variables.
+
+    Opens a connection for this one message. Request handlers should queue
+    mail through `db.outbox.enqueue_email` instead; see `SMTPPool` for the
+    delivery side.
+
+    Returns True on success, False on error (prints the error).
+    """
+    cfg = smtp_config()
+    if not cfg:
         print('SMTP not configured (SMTP_HOST/SMTP_PORT missing). Email would be:' )
         print('To:', to_email)
         print('Subject:', subject)
@@ -26,32 +75,49 @@ def send_email(to_email: str, subject: str, body_text: str, body_html: Optional[
         return False
 
     try:
-        msg = EmailMessage()
-        msg['Subject'] = subject
-        msg['From'] = from_email
-        msg['To'] = to_email
-        msg.set_content(body_text)
-        if body_html:
-            msg.add_alternative(body_html, subtype='html')
-
-        port_int = int(port)
-        # Use SSL if port is 465, otherwise try STARTTLS
-        if port_int == 465:
-            with smtplib.SMTP_SSL(host, port_int) as smtp:
-                if user and password:
-                    smtp.login(user, password)
-                smtp.send_message(msg)
-        else:
-            with smtplib.SMTP(host, port_int) as smtp:
-                smtp.ehlo()
-                try:
-                    smtp.starttls()
-                except Exception:
-                    pass
-                if user and password:
-                    smtp.login(user, password)
-                smtp.send_message(msg)
+        msg = _build_message(cfg['from_email'], to_email, subject, body_text, body_html)
+        with _open_connection(cfg) as smtp:
+            smtp.send_message(msg)
         return True
     except Exception as e:
         print(f"Error sending email: {e}")
         return False
+
+
+class SMTPPool:
+    """Keeps one authenticated SMTP connection per thread and reuses it.
+
+    The outbox worker sends whole batches through the same connection
+    instead of paying connect + STARTTLS + login for every message. A dropped
+    connection is reopened once before the send is reported as failed.
+    """
+
+    def __init__(self, cfg: dict = None):
+        self.cfg = cfg or smtp_config()
+        self._local = threading.local()
+
+    def _connection(self):
+        smtp = getattr(self._local, 'smtp', None)
+        if smtp is None:
+            smtp = _open_connection(self.cfg)
+            self._local.smtp = smtp
+        return smtp
+
+    @timed('mailer.pool_send')
+    def send(self, to_email: str, subject: str, body_text: str, body_html: Optional[str] = None) -> None:
+        """Send one message; raises on failure so the caller can retry later."""
+        msg = _build_message(self.cfg['from_email'], to_email, subject, body_text, body_html)
+        try:
+            self._connection().send_message(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self.close()
+            self._connection().send_message(msg)
+
+    def close(self):
+        smtp = getattr(self._local, 'smtp', None)
+        self._local.smtp = None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except Exception:
+                pass
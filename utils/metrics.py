@@ -0,0 +1,213 @@
+"""Request, SQL and external-call instrumentation exposed as Prometheus text.
+
+`init_app(app)` installs:
+  * request timing per endpoint (blueprint view name), method and status;
+  * SQLAlchemy cursor hooks that count and time every statement against the
+    endpoint that issued it ("background" outside a request, e.g. the
+    outbox worker or the events poller);
+  * a slow-query log;
+  * `GET /metrics` in the Prometheus text format.
+
+External calls are timed with the `timed(name)` decorator (currency
+conversion, rate fetches, SMTP). Values are per process; with several
+workers, scrape each one or aggregate in Prometheus.
+
+Configuration (environment):
+  SLOW_QUERY_MS    log statements slower than this, in ms (200; 0 disables)
+  SLOW_QUERY_LOG   append slow queries to this file instead of stdout
+  METRICS_TOKEN    /metrics requires `Authorization: Bearer <token>`; unset, it answers 403
+"""
+from bisect import bisect_left
+from functools import wraps
+import hmac
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, labels: tuple, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labels, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple, buckets: tuple):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, labels: tuple, value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((k, list(v[0]), v[1]) for k, v in self._series.items())
+        for key, counts, total in series:
+            running = 0
+            for le, n in zip(self.buckets + ('+Inf',), counts):
+                running += n
+                bound = 'le="%s"' % le
+                lines.append(f'{self.name}_bucket{_labels(self.labels, key, bound)} {running}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, key)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labels, key)} {running}')
+        return lines
+
+
+REGISTRY = []
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time to build the response, by endpoint.', ('endpoint', 'method', 'status'), LATENCY_BUCKETS)
+REQUEST_QUERIES = Histogram('http_request_sql_queries', 'SQL statements executed per request.', ('endpoint',), QUERY_COUNT_BUCKETS)
+SQL_SECONDS = Histogram('sql_query_duration_seconds', 'SQL statement execution time, by issuing endpoint.', ('endpoint',), SQL_BUCKETS)
+SLOW_QUERIES = Counter('sql_slow_queries_total', 'Statements slower than SLOW_QUERY_MS.', ('endpoint',))
+EXTERNAL_SECONDS = Histogram('external_call_duration_seconds', 'Currency and mail calls.', ('call', 'outcome'), LATENCY_BUCKETS)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def timed(name: str):
+    """Record how long the wrapped call takes under `call=name`."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapped(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = fn(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            finally:
+                EXTERNAL_SECONDS.observe((name, outcome), time.perf_counter() - start)
+        return wrapped
+    return decorator
+
+
+# -----------------------
+# SQL hooks
+# -----------------------
+
+def _current_endpoint() -> str:
+    from flask import has_request_context, request
+    if not has_request_context():
+        return 'background'
+    return request.endpoint or 'unmatched'
+
+
+def _log_slow(ms: float, endpoint: str, statement: str) -> None:
+    from flask import has_request_context, request
+    where = f'{request.method} {request.path} ({endpoint})' if has_request_context() else endpoint
+    line = f"Slow query {ms:.1f} ms on {where}: {' '.join(statement.split())[:1000]}"
+    if SLOW_QUERY_LOG:
+        try:
+            with open(SLOW_QUERY_LOG, 'a', encoding='utf-8') as f:
+                f.write(f"{time.strftime('%Y-%m-%dT%H:%M:%S')} {line}\n")
+            return
+        except OSError as e:
+            print(f"Error writing slow query log: {e}")
+    print(line)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # kept on the execution context, which is discarded with the statement
+    # whether or not it succeeds (a failed statement never reaches the hook below)
+    if context is not None:
+        context._metrics_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_metrics_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    endpoint = _current_endpoint()
+    SQL_SECONDS.observe((endpoint,), elapsed)
+    if endpoint != 'background':
+        from flask import g
+        g.sql_queries = getattr(g, 'sql_queries', 0) + 1
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        SLOW_QUERIES.inc((endpoint,))
+        _log_slow(elapsed * 1000, endpoint, statement)
+
+
+# -----------------------
+# Flask wiring
+# -----------------------
+
+def init_app(app) -> None:
+    from flask import Response, abort, g, request
+
+    @app.before_request
+    def _start_timer():
+        g.request_start = time.perf_counter()
+        g.sql_queries = 0
+
+    @app.after_request
+    def _record_request(response):
+        start = getattr(g, 'request_start', None)
+        if start is not None:
+            endpoint = request.endpoint or 'unmatched'
+            # streamed bodies (exports, SSE) are timed up to the first byte
+            REQUEST_SECONDS.observe((endpoint, request.method, response.status_code), time.perf_counter() - start)
+            REQUEST_QUERIES.observe((endpoint,), getattr(g, 'sql_queries', 0))
+        return response
+
+    def metrics_view():
+        token = os.getenv('METRICS_TOKEN')
+        if not token:
+            # endpoint names, volumes and slow routes aren't for anonymous callers
+            abort(403)
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            abort(401)
+        return Response(render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
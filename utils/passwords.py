@@ -0,0 +1,139 @@
+"""Password hashing and verification.
+
+The hash method is configurable with PASSWORD_HASH_METHOD, using any werkzeug
+method string, e.g. ``scrypt:32768:8:1`` (the werkzeug default) or
+``pbkdf2:sha256:600000``. Hashes made with other parameters still verify.
+`needs_rehash` tells the login path to upgrade them to the current method.
+
+Verification is CPU-bound, so it is gated. At most PASSWORD_VERIFY_WORKERS
+key derivations run at once (hashlib releases the GIL while deriving). Other
+logins queue for up to PASSWORD_VERIFY_WAIT seconds (default 0.25) and then
+get `VerifierBusy`. A login storm is turned away with a quick 503 instead of
+holding request threads that approval traffic needs.
+
+    python -m utils.passwords bench --method pbkdf2:sha256:600000 --method scrypt:16384:8:1
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+VERIFY_WORKERS = int(os.getenv('PASSWORD_VERIFY_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+VERIFY_WAIT = float(os.getenv('PASSWORD_VERIFY_WAIT', '0.25'))
+
+# Below this many passwords the process pool costs more than it saves
+# (spawned workers start a fresh interpreter)
+POOL_THRESHOLD = 32
+
+
+class VerifierBusy(RuntimeError):
+    """No verification slot freed up within PASSWORD_VERIFY_WAIT."""
+
+
+def hash_password(password: str, method: str = None) -> str:
+    return generate_password_hash(password, method=method or HASH_METHOD)
+
+
+def hash_passwords(passwords: list, workers: int = None) -> list:
+    """Hash many passwords, spreading the key derivation over a process pool.
+
+    Returns hashes in the same order as `passwords`. Workers are spawned, not
+    forked: this runs inside a threaded web server (the admin import), and a
+    fork there could copy a lock another thread holds.
+    """
+    if len(passwords) < POOL_THRESHOLD:
+        return [hash_password(p) for p in passwords]
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(passwords) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return list(pool.map(hash_password, passwords, chunksize=chunksize))
+
+
+_method_prefixes = {}
+
+
+def _method_prefix(method: str) -> str:
+    """The parameter prefix werkzeug writes for `method`, e.g. 'scrypt' -> 'scrypt:32768:8:1'."""
+    prefix = _method_prefixes.get(method)
+    if prefix is None:
+        # werkzeug fills in default parameters; ask it rather than duplicating them
+        prefix = generate_password_hash('', method=method).split('$', 1)[0]
+        _method_prefixes[method] = prefix
+    return prefix
+
+
+def needs_rehash(stored_hash: str, method: str = None) -> bool:
+    """True if `stored_hash` was made with different parameters than the current method."""
+    if not stored_hash or '$' not in stored_hash:
+        return True
+    return stored_hash.split('$', 1)[0] != _method_prefix(method or HASH_METHOD)
+
+
+_slots = threading.BoundedSemaphore(max(1, VERIFY_WORKERS))
+
+
+def verify_password(stored_hash: str, password: str, wait: float = None) -> bool:
+    """check_password_hash, limited to VERIFY_WORKERS concurrent derivations.
+
+    Raises VerifierBusy if no slot frees up within `wait` seconds.
+    """
+    if not stored_hash:
+        return False
+    if not _slots.acquire(timeout=VERIFY_WAIT if wait is None else wait):
+        raise VerifierBusy('too many logins in progress')
+    try:
+        return check_password_hash(stored_hash, password)
+    finally:
+        _slots.release()
+
+
+def measure(method: str = None, rounds: int = 3) -> float:
+    """Average seconds to verify one password hashed with `method`."""
+    stored = hash_password('benchmark-password', method)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        check_password_hash(stored, 'benchmark-password')
+    return (time.perf_counter() - start) / rounds
+
+
+def bench(methods: list, logins: int = 40, concurrency: int = 8) -> list:
+    """Run `logins` verifications from `concurrency` threads through the gate, per method."""
+    results = []
+    for method in methods:
+        stored = hash_password('benchmark-password', method)
+        latencies = []
+
+        def one(_):
+            start = time.perf_counter()
+            verify_password(stored, 'benchmark-password', wait=3600)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(logins)))
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        results.append({
+            'method': _method_prefix(method),
+            'per_hash_ms': round(measure(method, rounds=1) * 1000, 1),
+            'logins_per_sec': round(logins / elapsed, 1),
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1),
+            'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+        })
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Login (password verification) throughput at different hash costs')
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('--method', action='append', dest='methods', help='werkzeug hash method; repeatable (default: current)')
+    parser.add_argument('--logins', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=8, help='simulated concurrent login requests')
+    args = parser.parse_args()
+    print(f'verify workers: {VERIFY_WORKERS}, CPUs: {os.cpu_count()}')
+    for r in bench(args.methods or [HASH_METHOD], logins=args.logins, concurrency=args.concurrency):
+        print(f"{r['method']:<28} {r['per_hash_ms']:>8} ms/hash {r['logins_per_sec']:>8} logins/s  p50 {r['p50_ms']} ms  p95 {r['p95_ms']} ms")
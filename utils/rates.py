@@ -0,0 +1,264 @@
+"""Exchange-rate store used by `utils.currency`.
+
+Rate tables come from a pluggable `RateProvider` and are kept in memory and in
+a small JSON file, so a restart starts warm instead of blocking on the network.
+Fresh entries are served directly. Stale entries are still served while a
+background thread fetches a new copy. A missing entry is fetched inline, and
+concurrent misses for the same table share a single upstream call. A failed
+fetch is remembered: until its backoff expires (doubling per consecutive
+failure, up to the TTL) callers keep the stale table, or get None, without
+another upstream call.
+
+Configuration (environment):
+  EXCHANGE_RATES_FILE   read rates from this local JSON file instead of HTTP
+  EXCHANGE_RATES_URL    HTTP endpoint template, `{base}` is substituted
+  EXCHANGE_RATES_STORE  where fetched tables are persisted
+  EXCHANGE_RATES_TTL    seconds before a table is considered stale (600)
+  EXCHANGE_RATES_RETRY  seconds to wait after a failed fetch, doubled per failure (30)
+"""
+import json
+import os
+import threading
+import time
+from urllib.request import urlopen, Request
+
+from utils.metrics import timed
+
+DEFAULT_URL = "https://api.exchangerate-api.com/v4/latest/{base}"
+
+
+class RateProvider:
+    """Source of exchange-rate tables."""
+
+    def fetch(self, base: str):
+        """Return {currency_code: rate} quoted against `base`, or None."""
+        raise NotImplementedError
+
+
+class HttpRateProvider(RateProvider):
+    """Fetches `{"rates": {...}}` JSON from an exchangerate-api style endpoint."""
+
+    def __init__(self, url_template: str = DEFAULT_URL, timeout: float = 10):
+        self.url_template = url_template
+        self.timeout = timeout
+
+    def fetch(self, base: str):
+        req = Request(self.url_template.format(base=base), headers={"User-Agent": "ExpenseMgmt/1.0"})
+        try:
+            with urlopen(req, timeout=self.timeout) as resp:
+                data = json.load(resp)
+        except Exception:
+            return None
+        return data.get('rates') or None
+
+
+class FileRateProvider(RateProvider):
+    """Reads rates from a local JSON file, for tests and air-gapped installs.
+
+    The file maps a base currency to its table, either directly
+    (`{"USD": {"EUR": 0.9}}`) or in the HTTP response shape
+    (`{"USD": {"rates": {"EUR": 0.9}}}`).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def fetch(self, base: str):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception:
+            return None
+        table = data.get(base)
+        if isinstance(table, dict) and isinstance(table.get('rates'), dict):
+            table = table['rates']
+        return table or None
+
+
+@timed('rates.fetch')
+def _timed_fetch(provider: RateProvider, base: str):
+    return provider.fetch(base)
+
+
+class RateStore:
+    """Persistent, stale-while-revalidate cache of rate tables keyed by base."""
+
+    def __init__(self, provider: RateProvider, path: str = None, ttl: float = 600, wait_timeout: float = 15, retry_after: float = 30):
+        self.provider = provider
+        self.path = path
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.retry_after = retry_after
+        self._tables = None
+        self._lock = threading.Lock()
+        self._inflight = {}
+        # base -> (retry no earlier than, consecutive failures)
+        self._failures = {}
+
+    def _entries(self) -> dict:
+        with self._lock:
+            if self._tables is None:
+                self._tables = self._read_file()
+            return self._tables
+
+    def _read_file(self) -> dict:
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except Exception as e:
+            print(f"Ignoring unreadable rate store {self.path}: {e}")
+            return {}
+
+    def _write_file(self):
+        if not self.path:
+            return
+        with self._lock:
+            snapshot = dict(self._tables or {})
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"Could not persist exchange rates: {e}")
+
+    def _snapshot(self) -> dict:
+        # a copy taken under the lock; a refresh may add entries meanwhile
+        entries = self._entries()
+        with self._lock:
+            return dict(entries)
+
+    def stamp(self) -> float:
+        """Time of the newest cached table; changes whenever any rates are refreshed."""
+        return max((e['ts'] for e in self._snapshot().values()), default=0)
+
+    def bases(self) -> list:
+        return list(self._snapshot().keys())
+
+    def backing_off(self, base: str) -> bool:
+        """True while `base` is waiting out the backoff from a failed fetch."""
+        with self._lock:
+            failure = self._failures.get(base)
+        return failure is not None and time.time() < failure[0]
+
+    def _record_failure(self, base: str) -> None:
+        with self._lock:
+            count = self._failures.get(base, (0, 0))[1] + 1
+            delay = min(self.retry_after * 2 ** (count - 1), max(self.ttl, self.retry_after))
+            self._failures[base] = (time.time() + delay, count)
+
+    def get(self, base: str):
+        """Return the rate table for `base`, fetching only when nothing is cached."""
+        entry = self._snapshot().get(base)
+        if entry:
+            if time.time() - entry['ts'] >= self.ttl and not self.backing_off(base):
+                self.refresh_async(base)
+            return entry['rates']
+        return self.refresh(base)
+
+    def refresh(self, base: str):
+        """Fetch `base` from the provider. Concurrent callers share one fetch.
+
+        Returns the cached table (possibly stale) or None without calling the
+        provider while a previous failure's backoff is running.
+        """
+        if self.backing_off(base):
+            entry = self._snapshot().get(base)
+            return entry['rates'] if entry else None
+        with self._lock:
+            event = self._inflight.get(base)
+            leader = event is None
+            if leader:
+                event = threading.Event()
+                self._inflight[base] = event
+        if not leader:
+            event.wait(self.wait_timeout)
+        else:
+            try:
+                try:
+                    rates = _timed_fetch(self.provider, base)
+                except Exception as e:
+                    print(f"Error fetching exchange rates for {base}: {e}")
+                    rates = None
+                if rates:
+                    entries = self._entries()
+                    with self._lock:
+                        entries[base] = {'ts': time.time(), 'rates': rates}
+                        self._failures.pop(base, None)
+                    self._write_file()
+                else:
+                    self._record_failure(base)
+            finally:
+                with self._lock:
+                    self._inflight.pop(base, None)
+                event.set()
+        entry = self._snapshot().get(base)
+        return entry['rates'] if entry else None
+
+    def refresh_async(self, base: str):
+        with self._lock:
+            if base in self._inflight:
+                return
+        threading.Thread(target=self.refresh, args=(base,), daemon=True).start()
+
+
+def _default_provider() -> RateProvider:
+    path = os.getenv('EXCHANGE_RATES_FILE')
+    if path:
+        return FileRateProvider(path)
+    return HttpRateProvider(os.getenv('EXCHANGE_RATES_URL') or DEFAULT_URL)
+
+
+_store = None
+_store_lock = threading.Lock()
+_refresher = None
+
+
+def get_store() -> RateStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RateStore(
+                _default_provider(),
+                path=os.getenv('EXCHANGE_RATES_STORE') or os.path.join(os.getcwd(), 'instance', 'exchange_rates.json'),
+                ttl=float(os.getenv('EXCHANGE_RATES_TTL', '600')),
+                retry_after=float(os.getenv('EXCHANGE_RATES_RETRY', '30')),
+            )
+        return _store
+
+
+def configure(provider: RateProvider = None, path: str = None, ttl: float = None) -> RateStore:
+    """Replace the process-wide store, e.g. to point tests at a local provider."""
+    global _store
+    with _store_lock:
+        _store = RateStore(
+            provider or _default_provider(),
+            path=path,
+            ttl=600 if ttl is None else ttl,
+        )
+        return _store
+
+
+def _refresh_loop(interval: float):
+    while True:
+        time.sleep(interval)
+        store = get_store()
+        for base in store.bases():
+            store.refresh(base)
+
+
+def start_refresher(interval: float = None):
+    """Start the background thread that keeps every known table fresh."""
+    global _refresher
+    with _store_lock:
+        if _refresher is not None:
+            return _refresher
+        if interval is None:
+            interval = float(os.getenv('EXCHANGE_RATES_TTL', '600'))
+        _refresher = threading.Thread(target=_refresh_loop, args=(interval,), name='exchange-rate-refresher', daemon=True)
+        _refresher.start()
+        return _refresher
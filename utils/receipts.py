@@ -0,0 +1,141 @@
+"""Content-addressed receipt storage.
+
+Uploads are streamed in chunks to a temporary file while being hashed
+(SHA-256), then stored under their digest in a sharded layout:
+
+    ab/cd/abcd...ef.png
+
+Identical receipts are therefore stored once, and two employees uploading
+`receipt.png` no longer overwrite each other. The returned key is what gets
+saved in `Approval.receipt_filename`; with the default local backend it is a
+path relative to `static/uploads`, so existing templates keep linking to
+`/static/uploads/<key>`.
+
+Configuration (environment):
+  RECEIPTS_MAX_BYTES   largest accepted upload (default 5 MB)
+"""
+import hashlib
+import os
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+MAX_BYTES = int(os.getenv('RECEIPTS_MAX_BYTES', str(5 * 1024 * 1024)))
+
+# magic-number prefix -> extension; anything else is rejected
+_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+    (b'%PDF-', '.pdf'),
+]
+
+
+class ReceiptError(ValueError):
+    """Raised when an upload is rejected (too large or not an accepted type)."""
+
+
+def _sniff_extension(head: bytes):
+    for sig, ext in _SIGNATURES:
+        if head.startswith(sig):
+            return ext
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    return None
+
+
+class ReceiptBackend:
+    """Where stored receipts live. An object-storage backend implements the same three calls."""
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def put(self, local_path: str, key: str) -> None:
+        """Move a fully written temp file into place under `key`."""
+        raise NotImplementedError
+
+    def temp_dir(self):
+        """Directory for in-progress uploads (None = system default)."""
+        return None
+
+
+class LocalReceiptBackend(ReceiptBackend):
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def put(self, local_path: str, key: str) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(local_path, path)
+
+    def temp_dir(self):
+        # same filesystem as the final location so put() is an atomic rename
+        path = os.path.join(self.root, '.incoming')
+        os.makedirs(path, exist_ok=True)
+        return path
+
+
+class ReceiptStore:
+    def __init__(self, backend: ReceiptBackend, max_bytes: int = MAX_BYTES):
+        self.backend = backend
+        self.max_bytes = max_bytes
+
+    def save(self, stream) -> str:
+        """Stream `stream` (any object with .read(n)) into storage; returns its key.
+
+        Raises ReceiptError if the content isn't an accepted image/PDF or goes
+        over `max_bytes`; nothing is stored in that case.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        ext = None
+        fd, tmp_path = tempfile.mkstemp(dir=self.backend.temp_dir())
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if ext is None:
+                        ext = _sniff_extension(chunk)
+                        if ext is None:
+                            raise ReceiptError('Receipt must be a PNG, JPEG, GIF, WebP or PDF file.')
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise ReceiptError(f'Receipt is larger than {self.max_bytes // (1024 * 1024)} MB.')
+                    digest.update(chunk)
+                    out.write(chunk)
+            if size == 0:
+                raise ReceiptError('Receipt file is empty.')
+            hexdigest = digest.hexdigest()
+            key = f"{hexdigest[:2]}/{hexdigest[2:4]}/{hexdigest}{ext}"
+            if self.backend.exists(key):
+                os.remove(tmp_path)
+            else:
+                self.backend.put(tmp_path, key)
+            return key
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+_store = None
+
+
+def get_store() -> ReceiptStore:
+    global _store
+    if _store is None:
+        _store = ReceiptStore(LocalReceiptBackend(os.path.join(os.getcwd(), 'static', 'uploads')))
+    return _store
+
+
+def save_receipt(file_storage) -> str:
+    """Store an uploaded werkzeug FileStorage and return its storage key."""
+    return get_store().save(file_storage.stream)